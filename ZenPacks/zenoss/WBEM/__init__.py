@@ -12,7 +12,6 @@ LOG = logging.getLogger('zen.WBEM')
 
 from Products.ZenModel.ZenPack import ZenPackBase
 from Products.ZenRelations.zPropertyCategory import setzPropertyCategory
-import ZenPacks.zenoss.WBEM.patches
 
 
 # Categorize our zProperties.
@@ -23,6 +22,11 @@ setzPropertyCategory('zWBEMUseSSL', 'WBEM')
 setzPropertyCategory('zWBEMRequestTimeout', 'WBEM')
 setzPropertyCategory('zWBEMMaxObjectCount', 'WBEM')
 setzPropertyCategory('zWBEMOperationTimeout', 'WBEM')
+setzPropertyCategory('zWBEMGetInstanceConcurrency', 'WBEM')
+setzPropertyCategory('zWBEMGetInstanceShardSize', 'WBEM')
+setzPropertyCategory('zWBEMAutoStrategy', 'WBEM')
+setzPropertyCategory('zWBEMIndicationCacheTTL', 'WBEM')
+setzPropertyCategory('zWBEMIndicationPort', 'WBEM')
 
 
 class ZenPack(ZenPackBase):
@@ -36,4 +40,9 @@ class ZenPack(ZenPackBase):
         ('zWBEMRequestTimeout', 290, 'int'),
         ('zWBEMMaxObjectCount', 0, 'int'),
         ('zWBEMOperationTimeout', 0, 'int'),
+        ('zWBEMGetInstanceConcurrency', 4, 'int'),
+        ('zWBEMGetInstanceShardSize', 100, 'int'),
+        ('zWBEMAutoStrategy', False, 'boolean'),
+        ('zWBEMIndicationCacheTTL', 0, 'int'),
+        ('zWBEMIndicationPort', 5990, 'int'),
     ]
@@ -0,0 +1,135 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2017, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Collector-side cache of WBEM responses.
+
+Configuration-type classes such as CIM_ComputerSystem or
+CIM_SoftwareIdentity rarely change, but datasources with short cycle times
+would otherwise fetch them from the device on every cycle.  Results are
+cached per (device, namespace, classname, query) for the TTL configured on
+the datasource.  A single RESPONSE_CACHE is shared by every datasource
+config in the collector process.  Its estimated size is bounded, and the
+least recently used entries are evicted first.
+"""
+
+import time
+
+from collections import OrderedDict
+
+# Rough number of bytes an instance property occupies once parsed. Used to
+# estimate the memory held by cached results without walking every object.
+PROPERTY_SIZE_ESTIMATE = 256
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def estimate_size(results):
+    """Return an estimate of the memory used by parsed WBEM results."""
+    if isinstance(results, dict):
+        return sum(estimate_size(x) for x in results.itervalues())
+
+    if isinstance(results, (list, tuple)):
+        return sum(estimate_size(x) for x in results)
+
+    properties = getattr(results, 'properties', None)
+    if properties is not None:
+        return PROPERTY_SIZE_ESTIMATE * max(len(properties), 1)
+
+    return PROPERTY_SIZE_ESTIMATE
+
+
+class ResponseCache(object):
+    """LRU cache of WBEM results with per-entry expiration."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, count=True):
+        """Return cached results for key, or None if missing or expired."""
+        entry = self.entries.pop(key, None)
+        if entry is not None and entry[0] > time.time():
+            self.entries[key] = entry
+            if count:
+                self.hits += 1
+            return entry[2]
+
+        if entry is not None:
+            self.size -= entry[1]
+
+        if count:
+            self.misses += 1
+
+        return None
+
+    def put(self, key, results, ttl, size=None):
+        """Cache results under key for ttl seconds."""
+        self.invalidate(key)
+
+        if ttl <= 0:
+            return
+
+        if size is None:
+            size = estimate_size(results)
+
+        if size > self.max_bytes:
+            return
+
+        self.entries[key] = (time.time() + ttl, size, results)
+        self.size += size
+
+        while self.size > self.max_bytes:
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def update(self, key, results):
+        """Replace the results cached under key without changing when they
+        expire."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+
+        size = estimate_size(results)
+        self.entries[key] = (entry[0], size, results)
+        self.size += size - entry[1]
+
+    def invalidate(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def invalidate_class(self, device, classname=None):
+        """Drop every entry for device, or only those for classname."""
+        for key in self.entries.keys():
+            if key[0] != device:
+                continue
+            if classname and key[2].lower() != classname.lower():
+                continue
+            self.invalidate(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+
+RESPONSE_CACHE = ResponseCache()
+
+
+def cache_key(device, namespace, classname, query=None):
+    """Return the RESPONSE_CACHE key for a request."""
+    return (device, namespace, classname or '', query or '')
@@ -11,6 +11,7 @@ import logging
 log = logging.getLogger('zen.WBEM')
 
 import re
+import time
 
 from twisted.internet import ssl, reactor, defer
 from twisted.internet.error import TimeoutError
@@ -30,24 +31,42 @@ from Products.Zuul.utils import ZuulMessageFactory as _t
 from ZenPacks.zenoss.PythonCollector.datasources.PythonDataSource \
     import PythonDataSource, PythonDataSourcePlugin
 
+from ZenPacks.zenoss.WBEM.cache import RESPONSE_CACHE, cache_key
+from ZenPacks.zenoss.WBEM.invalidation import INVALIDATOR, SUBSCRIBER
 from ZenPacks.zenoss.WBEM.modeler.wbem import check_if_complete
+from ZenPacks.zenoss.WBEM.sharded import SHARD_SELECTOR, collect_sharded
+from ZenPacks.zenoss.WBEM.strategy import (
+    EXEC_QUERY,
+    PULLED,
+    STRATEGIES,
+    is_unsupported,
+)
+from ZenPacks.zenoss.WBEM.timing import TIMINGS
 from ZenPacks.zenoss.WBEM.utils import (
     addLocalLibPath,
     result_errmsg,
     create_connection,
     convert_to_timestamp,
+    add_timeout,
 )
 
 addLocalLibPath()
 
 from pywbem import CIMDateTime
+from pywbem.cim_constants import DEFAULT_ITER_MAXOBJECTCOUNT
+from pywbem.cql import CQLError, any_of, compile_where
 from pywbem.twisted_client import (
     ExecQuery,
+    InstanceFingerprints,
     OpenEnumerateInstances,
 )
 
 CIM_CLASSNAME = re.compile(r'from\s+([\w_]+)', re.I)
 
+# InstanceFingerprints used for delta collection, keyed like the response
+# cache, along with the number of cycles since the last full refresh.
+FINGERPRINTS = {}
+
 
 def get_classname(query):
     """Extract class name from a CQL query"""
@@ -55,6 +74,17 @@ def get_classname(query):
     return match[0] if match else ''
 
 
+def where_predicate(query):
+    """Return a CQLPredicate for the WHERE clause of query, or None if it
+    has none or it cannot be evaluated on the collector."""
+    try:
+        return compile_where(query)
+    except CQLError as e:
+        log.debug('Not filtering results of %r on the collector: %s',
+                  query, e)
+        return None
+
+
 def string_to_lines(string):
     if isinstance(string, (list, tuple)):
         return string
@@ -80,6 +110,8 @@ class WBEMDataSource(PythonDataSource):
     result_component_key = ''
     result_component_value = ''
     result_timestamp_key = ''
+    cache_ttl = 0
+    delta_refresh_cycles = 0
 
     _properties = PythonDataSource._properties + (
         {'id': 'namespace', 'type': 'string'},
@@ -88,6 +120,8 @@ class WBEMDataSource(PythonDataSource):
         {'id': 'result_component_key', 'type': 'string'},
         {'id': 'result_component_value', 'type': 'string'},
         {'id': 'result_timestamp_key', 'type': 'string'},
+        {'id': 'cache_ttl', 'type': 'int'},
+        {'id': 'delta_refresh_cycles', 'type': 'int'},
         )
 
 
@@ -116,6 +150,14 @@ class IWBEMDataSourceInfo(IRRDDataSourceInfo):
         group=_t(u'WBEM Results'),
         title=_t(u'Result Timestamp Key'))
 
+    cache_ttl = schema.Int(
+        group=_t(u'WBEM Results'),
+        title=_t(u'Result Cache TTL (seconds)'))
+
+    delta_refresh_cycles = schema.Int(
+        group=_t(u'WBEM Results'),
+        title=_t(u'Delta Collection Full Refresh (cycles)'))
+
 
 class WBEMDataSourceInfo(RRDDataSourceInfo):
     implements(IWBEMDataSourceInfo)
@@ -129,6 +171,8 @@ class WBEMDataSourceInfo(RRDDataSourceInfo):
     result_component_key = ProxyProperty('result_component_key')
     result_component_value = ProxyProperty('result_component_value')
     result_timestamp_key = ProxyProperty('result_timestamp_key')
+    cache_ttl = ProxyProperty('cache_ttl')
+    delta_refresh_cycles = ProxyProperty('delta_refresh_cycles')
 
     @property
     def query(self):
@@ -148,6 +192,11 @@ class WBEMDataSourcePlugin(PythonDataSourcePlugin):
         'zWBEMRequestTimeout',
         'zWBEMMaxObjectCount',
         'zWBEMOperationTimeout',
+        'zWBEMGetInstanceConcurrency',
+        'zWBEMGetInstanceShardSize',
+        'zWBEMAutoStrategy',
+        'zWBEMIndicationCacheTTL',
+        'zWBEMIndicationPort',
         )
 
     @classmethod
@@ -197,42 +246,224 @@ class WBEMDataSourcePlugin(PythonDataSourcePlugin):
 
         params['classname'] = get_classname(params['query'])
 
+        params['cache_ttl'] = datasource.cache_ttl
+        params['delta_refresh_cycles'] = datasource.delta_refresh_cycles
+
         return params
 
     def collect(self, config):
 
         ds0 = config.datasources[0]
 
-        credentials = (ds0.zWBEMUsername, ds0.zWBEMPassword)
+        if ds0.zWBEMIndicationCacheTTL > 0:
+            SUBSCRIBER.watch(ds0, ds0.params['classname'])
+
+        key = self.cacheKey(config)
+        ttl = self.cacheTTL(config)
+        if ttl > 0:
+            results = RESPONSE_CACHE.get(key)
+            if results is not None:
+                log.debug('%s using cached results for %s',
+                          config.id, ds0.params['classname'])
+                return defer.succeed(results)
+
+        if ds0.zWBEMGetInstanceConcurrency > 0 and SHARD_SELECTOR.use_sharded(
+                config.id, ds0.params['classname'], ds0.zWBEMRequestTimeout):
+            d = collect_sharded(
+                ds0,
+                ds0.params['namespace'],
+                ds0.params['classname'],
+                max(ds0.zWBEMGetInstanceShardSize, 1),
+                ds0.zWBEMGetInstanceConcurrency,
+                ds0.zWBEMRequestTimeout)
+
+            if ttl > 0:
+                d.addCallback(self.cacheResults, key, ttl)
+
+            return d
 
         if ds0.zWBEMMaxObjectCount > 0:
+            preferred = PULLED
+        else:
+            preferred = EXEC_QUERY
+
+        method = STRATEGIES.choose(
+            config.id, ds0.params['classname'], preferred,
+            auto=ds0.zWBEMAutoStrategy)
+
+        d = self.collectWith(method, config, key)
+        d.addErrback(self.fallback, method, config, key)
+
+        return d
+
+    def collectWith(self, method, config, key):
+        """Collect config with ExecQuery or a pulled enumeration."""
+        ds0 = config.datasources[0]
+        credentials = (ds0.zWBEMUsername, ds0.zWBEMPassword)
+
+        fingerprints = None
+
+        # Every request of the collection, whose responses are measured.
+        factories = []
+
+        if method == PULLED:
+            max_object_count = ds0.zWBEMMaxObjectCount or \
+                DEFAULT_ITER_MAXOBJECTCOUNT
             property_filter = ds0.params.get('property_filter', (None, None))
+            fingerprints = self.beginDelta(config, key)
+            where = any_of(
+                where_predicate(x.params['query']) for x in config.datasources)
             factory = OpenEnumerateInstances(
                 credentials,
                 namespace=ds0.params['namespace'],
                 classname=ds0.params['classname'],
-                MaxObjectCount=ds0.zWBEMMaxObjectCount,
+                MaxObjectCount=max_object_count,
                 OperationTimeout=ds0.zWBEMOperationTimeout,
                 PropertyFilter=property_filter,
-                ResultComponentKey=ds0.params['result_component_key']
+                ResultComponentKey=ds0.params['result_component_key'],
+                Fingerprints=fingerprints,
+                Where=where,
             )
             factory.deferred.addCallback(
                 check_if_complete, ds0,
                 ds0.params['namespace'],
                 ds0.params['classname'],
+                max_object_count=max_object_count,
+                factories=factories,
                 PropertyFilter=property_filter,
-                ResultComponentKey=ds0.params['result_component_key']
+                ResultComponentKey=ds0.params['result_component_key'],
+                Fingerprints=fingerprints,
+                Where=where,
             )
         else:
+            # Datasources grouped for a pulled enumeration share a class
+            # but not necessarily a query.
+            queries = set(x.params['query'] for x in config.datasources)
+            if len(queries) == 1:
+                query = ds0.params['query']
+            else:
+                query = 'SELECT * FROM %s' % ds0.params['classname']
+
             factory = ExecQuery(
                 credentials,
                 ds0.params['query_language'],
-                ds0.params['query'],
-                namespace=ds0.params['namespace'])
+                query,
+                namespace=ds0.params['namespace'],
+                Where=any_of(where_predicate(x) for x in queries))
+            factory.classname = ds0.params['classname']
 
+        factories.append(factory)
         create_connection(ds0, factory)
 
-        return add_timeout(factory, ds0.zWBEMRequestTimeout)
+        d = add_timeout(factory, ds0.zWBEMRequestTimeout)
+        d.addBoth(self.recordDuration, config, method, time.time(), factories)
+
+        ttl = self.cacheTTL(config)
+        if fingerprints is not None:
+            d.addCallbacks(self.commitDelta, self.abortDelta,
+                           callbackArgs=(fingerprints,),
+                           errbackArgs=(fingerprints,))
+        elif ttl > 0:
+            d.addCallback(self.cacheResults, key, ttl)
+
+        return d
+
+    def fallback(self, result, method, config, key):
+        """Collect config with the other method if the device doesn't
+        support the one that was tried."""
+        if not is_unsupported(result):
+            return result
+
+        alternative = STRATEGIES.fallback(config.id, method)
+        if alternative is None:
+            return result
+
+        log.info('%s does not support %s, using %s instead',
+                 config.id, method, alternative)
+
+        return self.collectWith(alternative, config, key)
+
+    def recordDuration(self, result, config, method, start, factories=()):
+        """Record how long a full enumeration took, so that huge classes
+        can be switched to sharded GetInstance collection, and how long
+        it took and how many bytes the responses of factories held, so
+        that the faster method can be chosen for each class."""
+        classname = config.datasources[0].params['classname']
+        seconds = time.time() - start
+
+        if isinstance(result, failure.Failure):
+            if result.check(TimeoutError):
+                SHARD_SELECTOR.record(
+                    config.id, classname, seconds, timed_out=True)
+            return result
+
+        SHARD_SELECTOR.record(config.id, classname, seconds)
+        STRATEGIES.record(
+            config.id, classname, method, seconds,
+            sum(len(x.response_xml or '') for x in factories))
+
+        return result
+
+    def beginDelta(self, config, key):
+        """Return InstanceFingerprints for a pulled enumeration in delta
+        mode, or None if delta collection is disabled."""
+        refresh_cycles = config.datasources[0].params.get(
+            'delta_refresh_cycles', 0)
+
+        if refresh_cycles <= 0:
+            FINGERPRINTS.pop(key, None)
+            return None
+
+        if key not in FINGERPRINTS:
+            FINGERPRINTS[key] = [InstanceFingerprints(), 0]
+
+        fingerprints, cycles = FINGERPRINTS[key]
+        full = cycles % refresh_cycles == 0
+        FINGERPRINTS[key][1] = cycles + 1
+
+        fingerprints.begin(full=full)
+        return fingerprints
+
+    def commitDelta(self, results, fingerprints):
+        log.debug('Delta collection skipped %s unchanged instances',
+                  fingerprints.skipped)
+        fingerprints.commit()
+        return results
+
+    def abortDelta(self, result, fingerprints):
+        fingerprints.abort()
+        return result
+
+    def cacheKey(self, config):
+        """Return the response cache key for config."""
+        ds0 = config.datasources[0]
+
+        if ds0.zWBEMMaxObjectCount > 0:
+            query = repr(ds0.params.get('property_filter'))
+        else:
+            query = ds0.params['query']
+
+        return cache_key(
+            config.id,
+            ds0.params['namespace'],
+            ds0.params['classname'],
+            query)
+
+    def cacheTTL(self, config):
+        """Return how long results for config are cached.  Indications
+        keep the cached results of subscribed devices up to date, so they
+        are kept for at least zWBEMIndicationCacheTTL."""
+        ds0 = config.datasources[0]
+        ttl = ds0.params.get('cache_ttl', 0)
+
+        if INVALIDATOR.subscribed(config.id):
+            ttl = max(ttl, ds0.zWBEMIndicationCacheTTL)
+
+        return ttl
+
+    def cacheResults(self, results, key, ttl):
+        RESPONSE_CACHE.put(key, results, ttl)
+        return results
 
     def onSuccess(self, results, config):
         data = self.new_data()
@@ -258,6 +489,12 @@ class WBEMDataSourcePlugin(PythonDataSourcePlugin):
         result_component_key = \
             ds0.params['result_component_key']
 
+        # Providers may ignore the WHERE clause, and pulled enumerations
+        # share one request between datasources with different queries.
+        predicates = dict(
+            (x.params.get('query'), where_predicate(x.params.get('query')))
+            for x in config.datasources)
+
         for result in results:
             result_key_value = None
 
@@ -284,6 +521,10 @@ class WBEMDataSourcePlugin(PythonDataSourcePlugin):
                 if result_component_value != result_key_value:
                     continue
 
+            predicate = predicates.get(datasource.params.get('query'))
+            if predicate is not None and not predicate(result):
+                continue
+
             component_id = prepId(datasource.component)
 
             # Determine the timestamp that the value was collected.
@@ -313,7 +554,8 @@ class WBEMDataSourcePlugin(PythonDataSourcePlugin):
             'summary': 'WBEM: successful collection',
             'device': config.id,
             'eventClass': ds0.eventClass,
-            'severity': ZenEventClasses.Clear
+            'severity': ZenEventClasses.Clear,
+            'wbemTiming': TIMINGS.summary(config.id, ds0.params['classname']),
         })
 
         return data
@@ -334,34 +576,9 @@ class WBEMDataSourcePlugin(PythonDataSourcePlugin):
             'summary': errmsg,
             'device': config.id,
             'severity': ds0.severity,
-            'eventClass': ds0.eventClass
+            'eventClass': ds0.eventClass,
+            'wbemTiming': TIMINGS.summary(config.id, ds0.params['classname']),
         })
 
         return data
 
-
-def add_timeout(factory, seconds):
-    """Return new Deferred that will errback TimeoutError after seconds."""
-    deferred_with_timeout = defer.Deferred()
-    deferred = factory.deferred
-
-    def fire_timeout():
-        deferred.cancel()
-        if not deferred_with_timeout.called:
-            deferred_with_timeout.errback(failure.Failure(TimeoutError()))
-
-    delayed_timeout = reactor.callLater(seconds, fire_timeout)
-    factory.deferred_timeout = delayed_timeout
-
-    def handle_result(result):
-        if delayed_timeout.active():
-            delayed_timeout.cancel()
-
-        if not deferred_with_timeout.called:
-            if isinstance(result, failure.Failure):
-                deferred_with_timeout.errback(result)
-            else:
-                deferred_with_timeout.callback(result)
-
-    deferred.addBoth(handle_result)
-    return deferred_with_timeout
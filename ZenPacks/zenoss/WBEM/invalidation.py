@@ -0,0 +1,409 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2017, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Keep cached WBEM results up to date from lifecycle indications.
+
+Polled datasources enumerate their class on every cycle although devices
+can report each change as a CIM_InstCreation, CIM_InstModification or
+CIM_InstDeletion indication.  For a device subscribed to those
+indications, CacheInvalidator applies each change to the RESPONSE_CACHE
+entries holding the affected class: a modified instance is patched in
+place, a deleted instance is removed and a created instance invalidates
+the entries it may belong to.  Results of subscribed devices can then be
+cached for zWBEMIndicationCacheTTL seconds instead of the datasource's
+cache_ttl.  When the listener drops indications of a device, all of its
+entries are invalidated so that they are polled again.
+
+A single INVALIDATOR is shared by the collector process.  SUBSCRIBER
+keeps it fed: for each device with a zWBEMIndicationCacheTTL, it
+subscribes the device to the lifecycle indications of the classes
+collected from it and starts the IndicationListener receiving them on
+zWBEMIndicationPort.  Subscribed devices are checked again every
+RETRY_INTERVAL seconds, since a device loses its subscriptions when it
+restarts.
+"""
+
+import logging
+import time
+
+from socket import getfqdn
+
+from twisted.internet import reactor
+from twisted.internet.error import CannotListenError
+
+from ZenPacks.zenoss.WBEM.cache import RESPONSE_CACHE
+from ZenPacks.zenoss.WBEM.subscriptions import (
+    Subscription,
+    SubscriptionManager,
+    device_id,
+)
+from ZenPacks.zenoss.WBEM.utils import addLocalLibPath
+addLocalLibPath()
+
+from pywbem.cql import CQLError, compile_where
+from pywbem.tupleparse import parse_embeddedObject
+
+log = logging.getLogger('zen.WBEM')
+
+CREATION_CLASS = 'CIM_InstCreation'
+DELETION_CLASS = 'CIM_InstDeletion'
+MODIFICATION_CLASS = 'CIM_InstModification'
+
+LIFECYCLE_CLASSES = (CREATION_CLASS, MODIFICATION_CLASS, DELETION_CLASS)
+
+STATS = ('patched', 'removed', 'invalidated', 'ignored')
+
+# Prefix of the filters and handlers created for lifecycle indications.
+SUBSCRIPTION_PREFIX = 'zenlifecycle'
+
+# Seconds to wait before trying again to subscribe a device, or to
+# listen, after a failure.  Many devices don't support indications.
+# Subscribed devices are checked again at the same interval.
+RETRY_INTERVAL = 3600
+
+# Marker for a query whose WHERE clause can't be evaluated on the
+# collector.
+_UNKNOWN_QUERY = object()
+
+
+def lifecycle_subscriptions(classnames, destination):
+    """Return the Subscriptions for the lifecycle indications of
+    classnames, delivered to the destination URL."""
+    return [
+        Subscription(
+            'SELECT * FROM %s WHERE SourceInstance ISA %s' % (x, classname),
+            destination)
+        for classname in classnames
+        for x in LIFECYCLE_CLASSES]
+
+
+def source_instance(indication):
+    """Return the instance a lifecycle indication is about, or None."""
+    prop = indication.properties.get('SourceInstance')
+    if prop is None or prop.value is None:
+        return None
+
+    # Some CIMOMs leave out the EmbeddedObject qualifier, so the instance
+    # arrives as a string of CIM-XML.
+    if isinstance(prop.value, basestring):
+        try:
+            return parse_embeddedObject(prop.value)
+        except Exception, e:
+            log.debug('Unable to parse SourceInstance: %s', e)
+            return None
+
+    return prop.value
+
+
+def matches(cached, instance):
+    """Return True if instance has the key values of cached's path."""
+    path = getattr(cached, 'path', None)
+    if path is None or not path.keybindings:
+        return False
+
+    if cached.classname.lower() != instance.classname.lower():
+        return False
+
+    for name, value in path.keybindings.items():
+        prop = instance.properties.get(name)
+        if prop is None or prop.value != value:
+            return False
+
+    return True
+
+
+class CacheInvalidator(object):
+    """Applies lifecycle indications to the cached results of devices."""
+
+    def __init__(self, cache=RESPONSE_CACHE):
+        self.cache = cache
+        self.devices = {}
+        self.predicates = {}
+        self.stats = dict((x, 0) for x in STATS)
+
+    def subscribe(self, device, address):
+        """Apply indications sent from address to the entries of device."""
+        self.unsubscribe(device)
+        self.devices[address] = device
+
+    def unsubscribe(self, device):
+        for address, subscribed in self.devices.items():
+            if subscribed == device:
+                del self.devices[address]
+
+    def subscribed(self, device):
+        return device in self.devices.itervalues()
+
+    def indications_received(self, batch):
+        """Handle a batch of (source, indication) pairs in the reactor
+        thread.  Called by IndicationListener worker threads."""
+        reactor.callFromThread(self.handle_batch, batch)
+
+    def indications_dropped(self, dropped):
+        """Invalidate the entries of the devices that sent dropped, a list
+        of (source, indication) pairs the listener had no room for.  The
+        changes they reported are then picked up by polling."""
+        devices = set(self.devices.get(x[0]) for x in dropped)
+        devices.discard(None)
+
+        for key in self.cache.entries.keys():
+            if key[0] in devices:
+                self.invalidate(key)
+
+    def handle_batch(self, batch):
+        for source, indication in batch:
+            device = self.devices.get(source)
+            if device is None:
+                self.stats['ignored'] += 1
+                continue
+
+            self.handle(device, indication)
+
+    def handle(self, device, indication):
+        """Apply a lifecycle indication from device to its entries."""
+        kind = indication.classname.lower()
+        instance = source_instance(indication)
+
+        if kind not in [x.lower() for x in LIFECYCLE_CLASSES] or \
+                instance is None:
+            self.stats['ignored'] += 1
+            return
+
+        keys = self.affected(device, instance.classname)
+
+        if kind == CREATION_CLASS.lower():
+            # Without the class hierarchy, an instance of a class not seen
+            # before may belong to any entry of the device.
+            if not keys:
+                keys = [x for x in self.cache.entries if x[0] == device]
+            for key in keys:
+                self.invalidate(key)
+            return
+
+        for key in keys:
+            results = self.cache.get(key, count=False)
+            if results is None:
+                continue
+
+            if not isinstance(results, list):
+                self.invalidate(key)
+                continue
+
+            for i, cached in enumerate(results):
+                if matches(cached, instance):
+                    break
+            else:
+                # A modified instance may only now match the query.
+                if kind == MODIFICATION_CLASS.lower():
+                    self.invalidate(key)
+                continue
+
+            results = list(results)
+            if kind == DELETION_CLASS.lower():
+                del results[i]
+                self.stats['removed'] += 1
+            else:
+                match = self.matches_query(key, instance)
+                if match is None:
+                    self.invalidate(key)
+                    continue
+                elif match:
+                    results[i] = self.patch(results[i], instance)
+                    self.stats['patched'] += 1
+                else:
+                    # The instance no longer matches the query.
+                    del results[i]
+                    self.stats['removed'] += 1
+
+            self.cache.update(key, results)
+
+    def affected(self, device, classname):
+        """Return the keys of the entries of device that are for classname
+        or hold an instance of it."""
+        classname = classname.lower()
+        keys = []
+
+        for key, entry in self.cache.entries.items():
+            if key[0] != device:
+                continue
+
+            if key[2].lower() == classname:
+                keys.append(key)
+                continue
+
+            results = entry[2]
+            if not isinstance(results, list):
+                results = [results]
+            for cached in results:
+                if getattr(cached, 'classname', '').lower() == classname:
+                    keys.append(key)
+                    break
+
+        return keys
+
+    def matches_query(self, key, instance):
+        """Return whether instance satisfies the WHERE clause of the query
+        key was cached for, or None if that can't be told from instance."""
+        query = key[3]
+        if query not in self.predicates:
+            try:
+                self.predicates[query] = compile_where(query)
+            except CQLError:
+                self.predicates[query] = _UNKNOWN_QUERY
+
+        predicate = self.predicates[query]
+        if predicate is None:
+            return True
+        if predicate is _UNKNOWN_QUERY:
+            return None
+
+        if not predicate(instance):
+            return False
+
+        # A condition on a property the indication left out is unknown
+        # rather than satisfied.
+        for name in predicate.properties:
+            if name not in instance.properties:
+                return None
+
+        return True
+
+    def patch(self, cached, instance):
+        """Return a copy of cached with the values of instance for the
+        properties cached already holds."""
+        patched = cached.copy()
+        for name in cached.properties.keys():
+            prop = instance.properties.get(name)
+            if prop is not None:
+                patched.properties[name] = prop.copy()
+        return patched
+
+    def invalidate(self, key):
+        self.cache.invalidate(key)
+        self.stats['invalidated'] += 1
+
+
+class IndicationSubscriber(object):
+    """Subscribes devices to the lifecycle indications of the classes
+    collected from them, delivered to an IndicationListener passing them
+    to invalidator.
+
+    The collector has a single listener, started on the port of the
+    first device watched.
+    """
+
+    def __init__(self, invalidator, manager=None, host=None,
+                 clock=time.time):
+        self.invalidator = invalidator
+        self.manager = manager
+        self.host = host
+        self.clock = clock
+        self.listener = None
+        self.port = None
+        self.listen_failed = None
+        self.classnames = {}
+        self.synced = {}
+        self.checked = {}
+        self.failed = {}
+        self.pending = set()
+
+    def destination(self):
+        if self.host is None:
+            self.host = getfqdn()
+        return 'http://%s:%d' % (self.host, self.port)
+
+    def listen(self, port):
+        """Start the listener on port unless it is running.  Return
+        whether it is."""
+        if self.listener is not None:
+            return True
+
+        if self.listen_failed is not None and \
+                self.clock() < self.listen_failed + RETRY_INTERVAL:
+            return False
+
+        from pywbem.indication_listener import IndicationListener
+
+        listener = IndicationListener(
+            self.invalidator.indications_received,
+            dropped=self.invalidator.indications_dropped)
+        try:
+            listener.listen(http_port=port)
+        except CannotListenError, e:
+            log.error('Unable to listen for indications: %s', e)
+            listener.stop()
+            self.listen_failed = self.clock()
+            return False
+
+        self.listener = listener
+        self.port = port
+        return True
+
+    def watch(self, config, classname):
+        """Subscribe the device of config, a datasource config, to the
+        lifecycle indications of classname and of the other classes
+        watched on it.
+
+        Return a Deferred firing once the subscriptions have been updated,
+        or None if nothing was sent.  Failures are logged, and the device
+        isn't tried again for RETRY_INTERVAL seconds.  A subscribed device
+        is synced again, from freshly enumerated state, RETRY_INTERVAL
+        seconds after it was last checked.
+        """
+        device = device_id(config)
+        classnames = self.classnames.setdefault(device, set())
+        classnames.add(classname)
+
+        if device in self.pending:
+            return None
+
+        recheck = self.clock() >= \
+            self.checked.get(device, 0) + RETRY_INTERVAL
+        if self.synced.get(device) == classnames and not recheck:
+            return None
+
+        failed = self.failed.get(device)
+        if failed is not None and self.clock() < failed + RETRY_INTERVAL:
+            return None
+
+        if not self.listen(config.zWBEMIndicationPort):
+            return None
+
+        if self.manager is None:
+            self.manager = SubscriptionManager(prefix=SUBSCRIPTION_PREFIX)
+
+        if device in self.synced and recheck:
+            self.manager.forget(device)
+
+        wanted = frozenset(classnames)
+        self.pending.add(device)
+
+        def synced(changes):
+            self.pending.discard(device)
+            self.synced[device] = wanted
+            self.checked[device] = self.clock()
+            self.failed.pop(device, None)
+            self.invalidator.subscribe(device, config.manageIp)
+
+        def failed(failure):
+            self.pending.discard(device)
+            self.synced.pop(device, None)
+            self.failed[device] = self.clock()
+            self.invalidator.unsubscribe(device)
+            log.warn('%s unable to subscribe to lifecycle indications: %s',
+                     device, failure.getErrorMessage())
+
+        d = self.manager.sync(config, lifecycle_subscriptions(
+            sorted(wanted), self.destination()))
+        d.addCallbacks(synced, failed)
+        return d
+
+
+INVALIDATOR = CacheInvalidator()
+SUBSCRIBER = IndicationSubscriber(INVALIDATOR)
@@ -39,6 +39,15 @@ from ZenPacks.zenoss.WBEM.utils import (
     result_errmsg,
     create_connection,
 )
+from ZenPacks.zenoss.WBEM.results import (
+    ResultsLimit,
+    ResultsLimitExceeded,
+    ResultsRepr,
+    SpilledResults,
+    spill_results,
+)
+from ZenPacks.zenoss.WBEM.schema import collect_classes
+from ZenPacks.zenoss.WBEM.timing import TIMINGS
 
 from ZenPacks.zenoss.WBEM.patches import (
     EnumerateClassNames,
@@ -80,6 +89,27 @@ class WBEMPlugin(PythonPlugin):
 
     wbemQueries = {}
 
+    # Seconds a namespace's classes fetched by an 'ec' query are served
+    # from the on-disk schema cache before being enumerated again in
+    # full. Added, removed and changed classes are detected, except for
+    # changes to qualifiers alone. 0 disables the cache.
+    schemaCacheMaxAge = 24 * 60 * 60
+
+    # Bounded-memory results. A query result with more instances than
+    # resultsSpillThreshold is moved to a temporary file as soon as the
+    # query completes, and passed to process() as a SpilledResults
+    # sequence. Once the queries completed so far have returned more than
+    # resultsMaxInstances instances in total, the others are cancelled and
+    # modeling fails with an error instead. 0 disables either limit.
+    resultsSpillThreshold = 0
+    resultsMaxInstances = 0
+
+    # Incremental processing. Each query's result is passed to
+    # process_query() as soon as it arrives, and the data maps it returns
+    # are collected for process(). Queries still running when the
+    # collector times out are cancelled, but maps already built are kept.
+    incrementalProcess = False
+
     def collect(self, device, log):
         if not device.manageIp:
             log.error('%s has no management IP address', device.id)
@@ -100,6 +130,11 @@ class WBEMPlugin(PythonPlugin):
             return None
 
         deferreds = []
+        queries = []
+
+        limit = None
+        if self.resultsMaxInstances > 0:
+            limit = ResultsLimit(self.resultsMaxInstances, self.name())
 
         for wbemnamespace, wbemclass in self.wbemQueries.items():
             namespaces = wbemnamespace.split(":")
@@ -109,6 +144,16 @@ class WBEMPlugin(PythonPlugin):
 
             userCreds = (device.zWBEMUsername, device.zWBEMPassword)
 
+            if wbemclass == 'ec' and self.schemaCacheMaxAge > 0:
+                d = collect_classes(device, namespace, self.schemaCacheMaxAge)
+                d.addCallback(check_if_complete, device, namespace, None)
+                if limit is not None:
+                    limit.watch(d)
+                d.addCallback(spill_results, self.resultsSpillThreshold)
+                deferreds.append(d)
+                queries.append((wbemnamespace, wbemclass))
+                continue
+
             if wbemclass == 'ec':
                 wbemClass = EnumerateClasses(
                     userCreds, namespace=namespace)
@@ -134,9 +179,18 @@ class WBEMPlugin(PythonPlugin):
 
             wbemClass.deferred.addCallback(check_if_complete,
                                            device, namespace, classname)
+            if limit is not None:
+                limit.watch(wbemClass.deferred)
+            wbemClass.deferred.addCallback(spill_results,
+                                           self.resultsSpillThreshold)
             deferreds.append(wbemClass.deferred)
+            queries.append((wbemnamespace, wbemclass))
             create_connection(device, wbemClass)
 
+        if self.incrementalProcess:
+            return self.collect_incremental(
+                zip(queries, deferreds), device, log)
+
         # Execute the deferreds and return the results to the callback.
         d = DeferredList(deferreds, consumeErrors=True)
         add_collector_timeout(
@@ -149,6 +203,13 @@ class WBEMPlugin(PythonPlugin):
     def check_results(self, results, device, log):
         """Check results for errors."""
 
+        log.debug('%s WBEM timings: %s', device.id, TIMINGS.summary(device.id))
+
+        errmsg = limit_errmsg(results)
+        if errmsg:
+            log.error('%s WBEM: %s', device.id, errmsg)
+            return "ERROR", errmsg
+
         # If all results are failures we have a problem to report.
         if len(results) and True not in set(x[0] for x in results):
             log.error('%s WBEM: %s', device.id, result_errmsg(results[0][1]))
@@ -158,23 +219,109 @@ class WBEMPlugin(PythonPlugin):
 
             return results
 
-        try:
-            results_new = []
-            for success, instances in results:
-                if success:
-                    inst = []
-                    for instance in instances:
-                        inst.append(instance.__dict__)
-                    results_new.append((success, inst))
-                else:
-                    results_new.append((success, instances))
-
-            log.debug('Results: {0}'.format(results_new))
-        except:
-            pass
+        log.debug('Results: %s', ResultsRepr(results))
 
         return results
 
+    def collect_incremental(self, queries, device, log):
+        """Process each (query, deferred) pair as its result arrives."""
+        maps = []
+        deferreds = []
+
+        for query, deferred in queries:
+            deferred.addCallback(
+                self.deliver_query, query, device, log, maps)
+            deferreds.append(deferred)
+
+        d = DeferredList(deferreds, consumeErrors=True)
+        add_query_timeouts(
+            d, deferreds, device.zCollectorClientTimeout
+        )
+        d.addCallback(
+            self.check_incremental_results, [x[0] for x in queries],
+            maps, device, log)
+
+        return d
+
+    def deliver_query(self, result, query, device, log, maps):
+        """Pass one query's result to process_query() and keep the maps.
+
+        The raw result is dropped once processed so that it can be freed
+        while other queries are still running.
+        """
+        try:
+            processed = self.process_query(device, query, result, log)
+        finally:
+            if isinstance(result, SpilledResults):
+                result.close()
+
+        if isinstance(processed, list):
+            maps.extend(processed)
+        elif processed is not None:
+            maps.append(processed)
+
+    def check_incremental_results(self, results, queries, maps, device, log):
+        """Check incremental results for errors."""
+
+        log.debug('%s WBEM timings: %s', device.id, TIMINGS.summary(device.id))
+
+        errmsg = limit_errmsg(results)
+        if errmsg:
+            log.error('%s WBEM: %s', device.id, errmsg)
+            return "ERROR", errmsg
+
+        if len(results) and True not in set(x[0] for x in results):
+            log.error('%s WBEM: %s', device.id, result_errmsg(results[0][1]))
+            return "ERROR", result_errmsg(results[0][1])
+
+        failed = []
+        for query, (success, result) in zip(queries, results):
+            if not success:
+                failed.append(query)
+                log.warn('%s WBEM: %s %s failed: %s', device.id,
+                         query[1], query[0], result_errmsg(result))
+
+        return IncrementalResults(maps, failed)
+
+    def process_query(self, device, query, result, log):
+        """Return the data maps for a single query in incremental mode.
+
+        query is the (namespace, method) item of wbemQueries and result is
+        what the query returned.  Return a list of maps, a single map, or
+        None.
+        """
+        return None
+
+    def process(self, device, results, log):
+        """Return the maps collected in incremental mode."""
+        if isinstance(results, IncrementalResults):
+            return results.maps
+
+        return PythonPlugin.process(self, device, results, log)
+
+
+class IncrementalResults(object):
+    """Data maps built by process_query(), and the queries that failed
+    or were cancelled by the collector timeout."""
+
+    def __init__(self, maps, failed):
+        self.maps = maps
+        self.failed = failed
+
+    def __repr__(self):
+        return '<IncrementalResults: %d maps, %d failed queries>' % (
+            len(self.maps), len(self.failed))
+
+
+def limit_errmsg(results):
+    """Return the error of a query that went over resultsMaxInstances, if
+    one did, from the results of a DeferredList."""
+    for success, result in results:
+        if not success and result.check(ResultsLimitExceeded):
+            return result.getErrorMessage()
+
+    return None
+
 
 def add_collector_timeout(deferred, seconds):
     """Raise error on deferred when modeler is timed out."""
@@ -186,7 +333,9 @@ def add_collector_timeout(deferred, seconds):
     def handle_result(result):
         if timeout_d.active():
             timeout_d.cancel()
-        if isinstance(result, list):
+        # Queries cancelled for going over resultsMaxInstances are
+        # reported by check_results.
+        if isinstance(result, list) and not limit_errmsg(result):
             for item in result:
                 if not item[0] and item[1].check(CancelledError):
                     raise error
@@ -207,8 +356,33 @@ def add_collector_timeout(deferred, seconds):
     return deferred
 
 
+def add_query_timeouts(deferred, deferreds, seconds):
+    """Cancel the queries in deferreds that are still running when the
+    modeler is timed out, leaving the results of completed queries."""
+
+    def handle_timeout():
+        for d in deferreds:
+            # Cancelling a deferred that has already fired does nothing.
+            d.cancel()
+
+    def handle_result(result):
+        if timeout_d.active():
+            timeout_d.cancel()
+        return result
+
+    timeout_d = reactor.callLater(seconds, handle_timeout)
+    deferred.addBoth(handle_result)
+
+    return deferred
+
+
 def check_if_complete(results, device, namespace, classname,
-                      results_aggregator=None, **kwargs):
+                      results_aggregator=None, max_object_count=None,
+                      factories=None, **kwargs):
+    """Pull the rest of an enumeration until it is complete.
+
+    Each PullInstances request is appended to factories, if given.
+    """
     if not results_aggregator:
         results_aggregator = []
 
@@ -225,7 +399,7 @@ def check_if_complete(results, device, namespace, classname,
             credentials,
             namespace,
             enumeration_context,
-            device.zWBEMMaxObjectCount,
+            max_object_count or device.zWBEMMaxObjectCount,
             classname,
             **kwargs
         )
@@ -235,8 +409,12 @@ def check_if_complete(results, device, namespace, classname,
             namespace,
             classname,
             results_aggregator=results_aggregator,
+            max_object_count=max_object_count,
+            factories=factories,
             **kwargs
         )
+        if factories is not None:
+            factories.append(wbemClass)
         create_connection(device, wbemClass)
         return wbemClass.deferred
 
@@ -33,6 +33,7 @@ class HandleResponseMixin():
                     0, 'Incorrect XML response for {0}'.format(self.classname)
                 )
             )
+            self.finishTiming('error')
             return
 
         error = xml.find('.//ERROR')
@@ -46,7 +47,7 @@ class HandleResponseMixin():
                           "zWBEMMaxObjectCount properties".format(self.classname)
                 )
         else:
-            self.deferred.callback(self.parseResponse(xml))
+            self.deliverResponse(xml)
             return
 
         try:
@@ -55,6 +56,7 @@ class HandleResponseMixin():
             code = 0
 
         self.deferred.errback(CIMError(code, error.attrib['DESCRIPTION']))
+        self.finishTiming('error')
 
 
 class EnumerateInstances(HandleResponseMixin, twisted_client.EnumerateInstances):
@@ -73,25 +75,29 @@ class EnumerateClassNames(HandleResponseMixin, twisted_client.EnumerateClassName
     pass
 
 
-class PullInstances(HandleResponseMixin, twisted_client.PullInstances):
+class GetClass(HandleResponseMixin, twisted_client.GetClass):
     pass
 
 
-class OpenEnumerateInstances(HandleResponseMixin, twisted_client.OpenEnumerateInstances):
+class GetInstance(HandleResponseMixin, twisted_client.GetInstance):
+    pass
+
+
+class CreateInstance(HandleResponseMixin, twisted_client.CreateInstance):
+    pass
+
+
+class DeleteInstance(HandleResponseMixin, twisted_client.DeleteInstance):
     pass
 
 
-class NewWBEMClient(object, twisted_client.WBEMClient):
+class ModifyInstance(HandleResponseMixin, twisted_client.ModifyInstance):
+    pass
 
-    def rawDataReceived(self, data):
-        """
-        Override this method to cancel deferred timeout
-        in case we got some response from resource side.
-        """
-        if hasattr(self.factory, 'deferred_timeout'):
-            if self.factory.deferred_timeout.active():
-                self.factory.deferred_timeout.cancel()
-        super(NewWBEMClient, self).rawDataReceived(data)
 
+class PullInstances(HandleResponseMixin, twisted_client.PullInstances):
+    pass
 
-twisted_client.WBEMClient = NewWBEMClient
+
+class OpenEnumerateInstances(HandleResponseMixin, twisted_client.OpenEnumerateInstances):
+    pass
@@ -0,0 +1,149 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2017, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Helpers that bound the memory used by modeler results."""
+
+import cPickle
+import itertools
+import os
+import tempfile
+
+
+class SpilledResults(object):
+    """Read-only sequence of query results stored in a temporary file.
+
+    Instances are pickled one at a time and read back one at a time while
+    iterating, so only the instance being processed is kept in memory.
+    The file is removed when the object is closed or garbage collected.
+    """
+
+    path = None
+
+    def __init__(self, items, directory=None):
+        fd, self.path = tempfile.mkstemp(
+            prefix='wbem-results-', suffix='.pickle', dir=directory)
+
+        self.count = 0
+        with os.fdopen(fd, 'wb') as f:
+            pickler = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+            for item in items:
+                pickler.dump(item)
+                pickler.clear_memo()
+                self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        if self.path is None:
+            raise ValueError('Results have been closed')
+
+        with open(self.path, 'rb') as f:
+            for _ in xrange(self.count):
+                yield cPickle.load(f)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(itertools.islice(
+                self, *index.indices(self.count)))
+
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('SpilledResults index out of range')
+
+        return next(itertools.islice(self, index, None))
+
+    def __repr__(self):
+        return '<SpilledResults: %d results in %s>' % (self.count, self.path)
+
+    def close(self):
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+    def __del__(self):
+        self.close()
+
+
+def spill_results(results, threshold, directory=None):
+    """Return results moved to a SpilledResults if it is a list with
+    more than threshold items.  A threshold of 0 disables spilling."""
+    if threshold > 0 and isinstance(results, list) and \
+            len(results) > threshold:
+        return SpilledResults(results, directory)
+
+    return results
+
+
+class ResultsLimitExceeded(Exception):
+    """Raised when a device's queries return more instances than the
+    limit of a ResultsLimit."""
+
+
+class ResultsLimit(object):
+    """Running total of the instances returned by a device's queries.
+
+    Each query's result is counted as soon as it arrives. Once the total
+    goes over limit, that query fails with ResultsLimitExceeded and the
+    queries still running are cancelled, so no further results are held
+    in memory.
+    """
+
+    def __init__(self, limit, name):
+        self.limit = limit
+        self.name = name
+        self.total = 0
+        self.deferreds = []
+
+    def watch(self, deferred):
+        """Count the result deferred fires with."""
+        self.deferreds.append(deferred)
+        deferred.addCallback(self.count)
+
+    def count(self, results):
+        if hasattr(results, '__len__'):
+            self.total += len(results)
+
+        if self.total > self.limit:
+            for deferred in self.deferreds:
+                # Cancelling a deferred that has already fired does
+                # nothing.
+                deferred.cancel()
+            raise ResultsLimitExceeded(
+                '%d instances returned, more than the limit of %d for %s' % (
+                    self.total, self.limit, self.name))
+
+        return results
+
+
+def count_results(results):
+    """Return the number of instances in successful modeler results."""
+    return sum(len(x) for success, x in results
+               if success and hasattr(x, '__len__'))
+
+
+class ResultsRepr(object):
+    """Render modeler results for debug logging only when formatted."""
+
+    def __init__(self, results):
+        self.results = results
+
+    def __str__(self):
+        rendered = []
+        for success, instances in self.results:
+            if success and hasattr(instances, '__iter__') and \
+                    not isinstance(instances, dict):
+                instances = [getattr(x, '__dict__', x) for x in instances]
+            rendered.append((success, instances))
+
+        return str(rendered)
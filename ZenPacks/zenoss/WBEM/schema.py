@@ -0,0 +1,221 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2017, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""On-disk cache of class definitions returned by EnumerateClasses.
+
+Pulling every class definition with qualifiers for a namespace is the most
+expensive query a modeler plugin can make, and the result rarely changes.
+collect_classes() first enumerates the classes without their qualifiers,
+which are the bulk of a definition, and digests the superclass, properties
+and methods of each.  If the digests match the cached schema the classes
+are served from disk.  If only a few classes were added or changed, just
+those are fetched with GetClass.  Otherwise the whole namespace is
+enumerated again.  A change to qualifiers alone isn't seen, so cached
+schemas older than max_age are always refreshed in full.
+"""
+
+import cPickle
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+from twisted.internet import defer
+
+from ZenPacks.zenoss.WBEM.utils import addLocalLibPath, create_connection
+addLocalLibPath()
+
+from ZenPacks.zenoss.WBEM.patches import EnumerateClasses, GetClass
+
+log = logging.getLogger('zen.WBEM')
+
+# Enumerate the whole namespace again rather than issuing GetClass for
+# each new or changed class when more than this fraction of classes is.
+MAX_MISSING_FRACTION = 0.5
+
+
+def default_directory():
+    from Products.ZenUtils.Utils import zenPath
+    return zenPath('var', 'wbem_schema_cache')
+
+
+def _element(x):
+    return '%s:%s:%s:%s' % (
+        x.name.lower(), x.type, bool(getattr(x, 'is_array', False)),
+        (getattr(x, 'reference_class', None) or '').lower())
+
+
+def class_digest(klass):
+    """Return a digest of the superclass, properties and methods of a
+    CIMClass, leaving out qualifiers."""
+    lines = [(klass.superclass or '').lower()]
+    lines.extend(sorted(_element(x) for x in klass.properties.values()))
+
+    for method in sorted(klass.methods.values(), key=lambda x: x.name.lower()):
+        lines.append('%s(%s):%s' % (
+            method.name.lower(),
+            ','.join(sorted(_element(x) for x in method.parameters.values())),
+            method.return_type))
+
+    return hashlib.md5('\n'.join(lines)).hexdigest()
+
+
+def class_digests(classes):
+    """Return the digest of each class keyed by lowercase class name."""
+    return dict((x.classname.lower(), class_digest(x)) for x in classes)
+
+
+def schema_fingerprint(digests):
+    """Return a digest identifying a schema from its class_digests()."""
+    return hashlib.md5('\n'.join(
+        '%s %s' % x for x in sorted(digests.items()))).hexdigest()
+
+
+class SchemaCache(object):
+    """Class definitions cached on disk for one device and namespace."""
+
+    def __init__(self, device, namespace, directory=None):
+        self.device = device
+        self.namespace = namespace
+        self.directory = directory or default_directory()
+
+    @property
+    def path(self):
+        key = hashlib.md5('%s\0%s' % (self.device, self.namespace))
+        return os.path.join(self.directory, key.hexdigest() + '.pickle')
+
+    def load(self):
+        """Return the cached entry, or None if there is no usable one.
+
+        An entry is a dictionary with the schema fingerprint, the time the
+        namespace was last enumerated in full, and dictionaries of the
+        CIMClass objects and of their digests keyed by lowercase class name.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                entry = cPickle.load(f)
+        except (IOError, OSError):
+            return None
+        except Exception as e:
+            log.warn('Ignoring unreadable WBEM schema cache %s: %s',
+                     self.path, e)
+            return None
+
+        if entry.get('device') != self.device or \
+                entry.get('namespace') != self.namespace or \
+                'digests' not in entry:
+            return None
+
+        return entry
+
+    def save(self, classes, timestamp=None):
+        """Write classes to the cache, replacing any previous entry."""
+        digests = class_digests(classes)
+        entry = {
+            'device': self.device,
+            'namespace': self.namespace,
+            'fingerprint': schema_fingerprint(digests),
+            'timestamp': timestamp or time.time(),
+            'classes': dict((x.classname.lower(), x) for x in classes),
+            'digests': digests,
+            }
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                cPickle.dump(entry, f, cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self.path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+        return entry
+
+
+def collect_classes(device, namespace, max_age, directory=None):
+    """Return a Deferred firing with the classes EnumerateClasses would
+    return for namespace, served from the schema cache where possible."""
+    creds = (device.zWBEMUsername, device.zWBEMPassword)
+    cache = SchemaCache(device.id, namespace, directory)
+
+    def enumerate_all():
+        factory = EnumerateClasses(creds, namespace=namespace)
+        factory.deferred.addCallback(save_all)
+        create_connection(device, factory)
+        return factory.deferred
+
+    def save_all(classes):
+        try:
+            cache.save(classes)
+        except Exception as e:
+            log.warn('%s unable to save WBEM schema cache: %s', device.id, e)
+        return classes
+
+    def fetch_missing(missing, entry, classnames):
+        deferreds = []
+        for classname in missing:
+            factory = GetClass(creds, classname, namespace=namespace)
+            create_connection(device, factory)
+            deferreds.append(factory.deferred)
+
+        d = defer.DeferredList(
+            deferreds, fireOnOneErrback=True, consumeErrors=True)
+
+        def merge(results):
+            classes = entry['classes']
+            for _, klass in results:
+                classes[klass.classname.lower()] = klass
+
+            result = [classes[x.lower()] for x in classnames]
+            try:
+                cache.save(result, timestamp=entry['timestamp'])
+            except Exception as e:
+                log.warn('%s unable to save WBEM schema cache: %s',
+                         device.id, e)
+            return result
+
+        d.addCallback(merge)
+        d.addErrback(lambda failure: failure.value.subFailure)
+        return d
+
+    def compare(outlines):
+        classnames = [x.classname for x in outlines]
+        entry = cache.load()
+
+        if entry is None or time.time() - entry['timestamp'] > max_age:
+            return enumerate_all()
+
+        digests = class_digests(outlines)
+
+        if entry['fingerprint'] == schema_fingerprint(digests):
+            log.debug('%s using cached WBEM schema for %s',
+                      device.id, namespace)
+            return [entry['classes'][x.lower()] for x in classnames]
+
+        missing = [x for x in classnames
+                   if entry['digests'].get(x.lower()) != digests[x.lower()]]
+
+        if len(missing) > len(classnames) * MAX_MISSING_FRACTION:
+            return enumerate_all()
+
+        log.debug('%s fetching %d changed WBEM classes for %s',
+                  device.id, len(missing), namespace)
+
+        return fetch_missing(missing, entry, classnames)
+
+    factory = EnumerateClasses(
+        creds, namespace=namespace, IncludeQualifiers=False)
+    factory.deferred.addCallback(compare)
+    create_connection(device, factory)
+
+    return factory.deferred
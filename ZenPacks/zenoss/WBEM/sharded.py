@@ -0,0 +1,236 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2017, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Collect huge classes with EnumerateInstanceNames and GetInstance.
+
+Some providers time out enumerating every instance of a huge class but
+return the instance names quickly.  collect_sharded() enumerates the
+names, splits them into shards and fetches the instances of each shard
+with GetInstance requests sent one after another over one keep-alive
+connection, with no more than a fixed number of shards in flight.  Failed
+requests are retried per shard.  The whole collection is bound by the
+same timeout as the full enumeration it replaces.  ShardSelector decides
+per device and class when to use it, based on how long full enumerations
+of the class took before.
+"""
+
+import logging
+
+from twisted.internet import defer, reactor
+from twisted.internet.error import TimeoutError
+from twisted.python import failure
+
+from ZenPacks.zenoss.WBEM.utils import (
+    addLocalLibPath,
+    add_timeout,
+    create_connection,
+)
+addLocalLibPath()
+
+from pywbem import CIMError
+from pywbem.cim_constants import CIM_ERR_NOT_FOUND
+from pywbem.twisted_client import RequestQueue
+
+from ZenPacks.zenoss.WBEM.patches import EnumerateInstanceNames, GetInstance
+
+log = logging.getLogger('zen.WBEM')
+
+# Number of times the failed requests of a shard are sent again.
+MAX_SHARD_RETRIES = 2
+
+
+def shards(items, size):
+    """Return items split into lists of at most size items."""
+    return [items[i:i + size] for i in xrange(0, len(items), size)]
+
+
+def collect_sharded(device, namespace, classname, shard_size, concurrency,
+                    timeout, retries=MAX_SHARD_RETRIES, request_timeout=None):
+    """Return a Deferred firing with every instance of classname, fetched
+    one GetInstance request at a time after enumerating their names.
+
+    The requests of a shard share one connection, and no more than
+    concurrency shards are in flight at once.  Each request times out
+    after request_timeout seconds, by default timeout.  If the whole
+    collection takes longer than timeout, the requests in flight are
+    cancelled and the Deferred fails with TimeoutError.  Instances deleted
+    between the two steps are skipped.
+    """
+    creds = (device.zWBEMUsername, device.zWBEMPassword)
+    semaphore = defer.DeferredSemaphore(concurrency)
+    queues = set()
+    expired = []
+
+    def get_instance(name):
+        instancename = name.copy()
+        instancename.host = None
+        instancename.namespace = None
+
+        factory = GetInstance(
+            creds, instancename, namespace=namespace, LocalOnly=False)
+        factory.classname = classname
+        return factory
+
+    def set_path(instance, name):
+        instance.path = name
+        return instance
+
+    def send_shard(names):
+        if expired:
+            return defer.fail(TimeoutError())
+
+        factories = [get_instance(x) for x in names]
+        deferreds = [x.deferred for x in factories]
+        for d, name in zip(deferreds, names):
+            d.addCallback(set_path, name)
+
+        queue = RequestQueue(factories, request_timeout or timeout)
+        queues.add(queue)
+        create_connection(device, queue)
+
+        def done(results):
+            queues.discard(queue)
+            return results
+
+        d = defer.DeferredList(deferreds, consumeErrors=True)
+        d.addCallback(done)
+        return d
+
+    def fetch_shard(names, attempt=0):
+        d = semaphore.run(send_shard, names)
+        d.addCallback(check_shard, names, attempt)
+        return d
+
+    def check_shard(results, names, attempt):
+        instances = []
+        failed = []
+        error = None
+
+        for name, (success, result) in zip(names, results):
+            if success:
+                instances.append(result)
+            elif result.check(CIMError) and \
+                    result.value.args[0] == CIM_ERR_NOT_FOUND:
+                continue
+            else:
+                failed.append(name)
+                error = result
+
+        if not failed:
+            return instances
+
+        if attempt >= retries or expired:
+            return error
+
+        log.debug('%s retrying %d of %d %s GetInstance requests',
+                  device.id, len(failed), len(names), classname)
+
+        d = fetch_shard(failed, attempt + 1)
+        d.addCallback(lambda retried: instances + retried)
+        return d
+
+    def fetch_all(names):
+        log.debug('%s fetching %d %s instances in shards of %d',
+                  device.id, len(names), classname, shard_size)
+
+        d = defer.DeferredList(
+            [fetch_shard(x) for x in shards(names, shard_size)],
+            fireOnOneErrback=True, consumeErrors=True)
+        d.addCallback(lambda results: [y for x in results for y in x[1]])
+        d.addErrback(lambda failure: failure.value.subFailure)
+        return d
+
+    factory = EnumerateInstanceNames(creds, classname, namespace=namespace)
+    create_connection(device, factory)
+
+    d = add_timeout(factory, request_timeout or timeout)
+    d.addCallback(fetch_all)
+
+    deferred_with_deadline = defer.Deferred()
+
+    def expire():
+        expired.append(True)
+        if not deferred_with_deadline.called:
+            log.debug('%s sharded collection of %s timed out',
+                      device.id, classname)
+            deferred_with_deadline.errback(failure.Failure(TimeoutError()))
+        for queue in list(queues):
+            queue.stop()
+
+    deadline = reactor.callLater(timeout, expire)
+
+    def handle_result(result):
+        if deadline.active():
+            deadline.cancel()
+
+        if not deferred_with_deadline.called:
+            if isinstance(result, failure.Failure):
+                deferred_with_deadline.errback(result)
+            else:
+                deferred_with_deadline.callback(result)
+
+    d.addBoth(handle_result)
+    return deferred_with_deadline
+
+
+class ShardSelector(object):
+    """Chooses per device and class between full enumeration and
+    collect_sharded().
+
+    A class is collected in shards while its last full enumeration timed
+    out, or full enumerations took longer than threshold times the request
+    timeout on average.  A full enumeration is tried again every
+    recheck_cycles cycles in case the device has recovered.
+    """
+
+    def __init__(self, threshold=0.5, recheck_cycles=10, weight=0.3):
+        self.threshold = threshold
+        self.recheck_cycles = recheck_cycles
+        self.weight = weight
+        self.history = {}
+
+    def use_sharded(self, device, classname, timeout):
+        entry = self.history.get((device, classname))
+        if entry is None:
+            return False
+
+        if not entry['timed_out'] and \
+                entry['average'] <= timeout * self.threshold:
+            return False
+
+        entry['cycles'] += 1
+        if entry['cycles'] >= self.recheck_cycles:
+            entry['cycles'] = 0
+            return False
+
+        return True
+
+    def record(self, device, classname, seconds, timed_out=False):
+        """Record the duration of a full enumeration of classname."""
+        entry = self.history.setdefault(
+            (device, classname), {'average': None, 'cycles': 0})
+
+        if entry['average'] is None:
+            entry['average'] = seconds
+        else:
+            entry['average'] = self.weight * seconds + \
+                (1 - self.weight) * entry['average']
+
+        entry['timed_out'] = timed_out
+
+    def clear(self, device=None):
+        if device is None:
+            self.history.clear()
+            return
+
+        for key in [x for x in self.history if x[0] == device]:
+            del self.history[key]
+
+
+SHARD_SELECTOR = ShardSelector()
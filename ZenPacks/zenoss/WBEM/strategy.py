@@ -0,0 +1,155 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2017, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Choose between ExecQuery and pulled enumerations per device and class.
+
+Datasources use a pulled OpenEnumerateInstances when zWBEMMaxObjectCount
+is set and ExecQuery otherwise.  StrategySelector remembers which of the
+two each device supports.  A method is probed by its first request and the
+result is cached for capability_ttl seconds.  If a device answers
+CIM_ERR_NOT_SUPPORTED the other method is used instead.  With automatic
+selection enabled, the other method is also tried every explore_cycles
+cycles.  The faster of the two is then used for the class, with the
+smaller payload breaking near ties.
+"""
+
+import time
+
+from ZenPacks.zenoss.WBEM.utils import addLocalLibPath
+addLocalLibPath()
+
+from pywbem import CIMError
+from pywbem.cim_constants import (
+    CIM_ERR_NOT_SUPPORTED,
+    CIM_ERR_QUERY_LANGUAGE_NOT_SUPPORTED,
+)
+
+EXEC_QUERY = 'ExecQuery'
+PULLED = 'OpenEnumerateInstances'
+
+METHODS = (EXEC_QUERY, PULLED)
+
+# CIM status codes returned by devices that don't implement a method.
+UNSUPPORTED_ERRORS = (
+    CIM_ERR_NOT_SUPPORTED,
+    CIM_ERR_QUERY_LANGUAGE_NOT_SUPPORTED,
+)
+
+
+def is_unsupported(failure):
+    """Return True if failure means the device doesn't support a method."""
+    return failure.check(CIMError) is not None and \
+        failure.value.args[0] in UNSUPPORTED_ERRORS
+
+
+class StrategySelector(object):
+    """Capabilities and measured costs of the collection methods."""
+
+    def __init__(self, capability_ttl=24 * 60 * 60, explore_cycles=20,
+                 margin=0.1, weight=0.3):
+        self.capability_ttl = capability_ttl
+        self.explore_cycles = explore_cycles
+        self.margin = margin
+        self.weight = weight
+        self.capabilities = {}
+        self.measurements = {}
+        self.cycles = {}
+
+    def supported(self, device, method):
+        """Return True or False once method has been probed on device, or
+        None if it hasn't been or the result has expired."""
+        entry = self.capabilities.get((device, method))
+        if entry is None:
+            return None
+
+        supported, timestamp = entry
+        if time.time() - timestamp > self.capability_ttl:
+            del self.capabilities[(device, method)]
+            return None
+
+        return supported
+
+    def set_supported(self, device, method, supported):
+        self.capabilities[(device, method)] = (supported, time.time())
+
+    def choose(self, device, classname, preferred, auto=False):
+        """Return the method to collect classname with."""
+        candidates = [x for x in METHODS
+                      if self.supported(device, x) is not False]
+
+        if preferred not in candidates:
+            return candidates[0] if candidates else preferred
+
+        if not auto or len(candidates) < 2:
+            return preferred
+
+        key = (device, classname)
+        cycle = self.cycles.get(key, 0) + 1
+        self.cycles[key] = cycle
+
+        measured = dict(
+            (x, self.measurements[(device, classname, x)])
+            for x in candidates
+            if (device, classname, x) in self.measurements)
+
+        if preferred not in measured:
+            return preferred
+
+        if len(measured) < len(candidates):
+            if cycle % self.explore_cycles == 0:
+                return [x for x in candidates if x not in measured][0]
+            return preferred
+
+        return min(measured, key=lambda x: self.cost(measured, x))
+
+    def cost(self, measured, method):
+        """Return a sort key favouring lower latency, then smaller
+        payloads when latencies are within margin of each other."""
+        fastest = min(x['seconds'] for x in measured.itervalues())
+        entry = measured[method]
+
+        if entry['seconds'] <= fastest * (1 + self.margin):
+            return (0, entry['size'])
+
+        return (1, entry['seconds'])
+
+    def record(self, device, classname, method, seconds, size):
+        """Record a successful collection of classname with method, which
+        took seconds and returned responses of size bytes in all."""
+        self.set_supported(device, method, True)
+
+        key = (device, classname, method)
+        entry = self.measurements.get(key)
+        if entry is None:
+            self.measurements[key] = {'seconds': seconds, 'size': size}
+            return
+
+        for name, value in (('seconds', seconds), ('size', size)):
+            entry[name] = self.weight * value + \
+                (1 - self.weight) * entry[name]
+
+    def fallback(self, device, method):
+        """Mark method as unsupported by device and return the method to
+        use instead, or None if there is none left to try."""
+        self.set_supported(device, method, False)
+
+        for alternative in METHODS:
+            if alternative != method and \
+                    self.supported(device, alternative) is not False:
+                return alternative
+
+        return None
+
+    def clear(self, device=None):
+        for attr in (self.capabilities, self.measurements, self.cycles):
+            for key in [x for x in attr if device in (None, x[0])]:
+                del attr[key]
+
+
+STRATEGIES = StrategySelector()
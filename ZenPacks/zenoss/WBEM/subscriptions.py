@@ -0,0 +1,382 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2017, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Keep indication subscriptions on many devices up to date.
+
+Creating a filter, a handler and a subscription with one blocking request
+after another makes subscribing thousands of devices slow, and listing
+what exists before every change repeats the same enumerations.
+SubscriptionManager caches the filters, handlers and subscriptions it
+owns on each device.  sync() compares the desired subscriptions with the
+cache and sends only the requests needed to create or delete the
+difference.  renew() extends the leases of every cached subscription.
+Requests for all devices share one limit on the number in flight.
+
+Filters and handlers are named after a digest of their definition, so a
+changed query or destination is a new filter or handler, and the names of
+the cached objects are all that is needed to compare states.
+"""
+
+import hashlib
+import logging
+
+from socket import getfqdn
+
+from twisted.internet import defer
+
+from ZenPacks.zenoss.WBEM.utils import addLocalLibPath, create_connection
+addLocalLibPath()
+
+from pywbem import CIMError, CIMInstance, CIMInstanceName, Uint64
+from pywbem.cim_constants import CIM_ERR_ALREADY_EXISTS, CIM_ERR_NOT_FOUND
+
+from ZenPacks.zenoss.WBEM.patches import (
+    CreateInstance,
+    DeleteInstance,
+    EnumerateInstanceNames,
+    ModifyInstance,
+)
+
+log = logging.getLogger('zen.WBEM')
+
+INTEROP_NAMESPACE = 'root/interop'
+
+FILTER_CLASS = 'CIM_IndicationFilter'
+HANDLER_CLASS = 'CIM_ListenerDestinationCIMXML'
+SUBSCRIPTION_CLASS = 'CIM_IndicationSubscription'
+
+
+def digest(*values):
+    return hashlib.md5('\0'.join(values)).hexdigest()[:16]
+
+
+def device_id(device):
+    """Return the id of a device, or of the device of a datasource
+    config."""
+    return getattr(device, 'device', None) or device.id
+
+
+class Subscription(object):
+    """Indications matching query, delivered to the destination URL."""
+
+    def __init__(self, query, destination, query_language='WQL',
+                 source_namespace='root/cimv2'):
+        self.query = query
+        self.destination = destination
+        self.query_language = query_language
+        self.source_namespace = source_namespace
+
+
+class DeviceState(object):
+    """Paths of the filters, handlers and subscriptions owned on a device.
+
+    Filters and handlers are keyed by name, subscriptions by the names of
+    their filter and handler.
+    """
+
+    def __init__(self):
+        self.filters = {}
+        self.handlers = {}
+        self.subscriptions = {}
+
+
+class SubscriptionManager(object):
+    """Creates, deletes and renews the subscriptions of many devices."""
+
+    def __init__(self, concurrency=20, lease=None, prefix='zenoss',
+                 namespace=INTEROP_NAMESPACE, system_name=None):
+        self.semaphore = defer.DeferredSemaphore(concurrency)
+        self.lease = lease
+        self.prefix = prefix
+        self.namespace = namespace
+        self.system_name = system_name or getfqdn()
+        self.states = {}
+
+    def filter_name(self, subscription):
+        return '%s-filter-%s' % (self.prefix, digest(
+            subscription.query_language,
+            subscription.source_namespace,
+            subscription.query))
+
+    def handler_name(self, subscription):
+        return '%s-handler-%s' % (
+            self.prefix, digest(subscription.destination))
+
+    def owned(self, name):
+        return name.startswith(self.prefix + '-')
+
+    def system_path(self, classname, name):
+        return CIMInstanceName(classname, keybindings={
+            'CreationClassName': classname,
+            'SystemCreationClassName': 'CIM_ComputerSystem',
+            'SystemName': self.system_name,
+            'Name': name,
+            })
+
+    def subscription_path(self, filter_path, handler_path):
+        return CIMInstanceName(SUBSCRIPTION_CLASS, keybindings={
+            'Filter': filter_path,
+            'Handler': handler_path,
+            })
+
+    def request(self, device, factory_class, classname, *args, **kwargs):
+        """Return a Deferred firing with the result of a request, sent when
+        fewer than concurrency requests are in flight."""
+        creds = (device.zWBEMUsername, device.zWBEMPassword)
+
+        def send():
+            factory = factory_class(
+                creds, *args, namespace=self.namespace, **kwargs)
+            factory.classname = classname
+            create_connection(device, factory)
+            return factory.deferred
+
+        return self.semaphore.run(send)
+
+    def forget(self, device=None):
+        """Drop cached state, so that it is enumerated again."""
+        if device is None:
+            self.states.clear()
+        else:
+            self.states.pop(device, None)
+
+    def load(self, device):
+        """Return a Deferred firing with the DeviceState of device, from
+        the cache or by enumerating the instance names."""
+        state = self.states.get(device_id(device))
+        if state is not None:
+            return defer.succeed(state)
+
+        d = defer.gatherResults([
+            self.request(device, EnumerateInstanceNames, x, x)
+            for x in (FILTER_CLASS, HANDLER_CLASS, SUBSCRIPTION_CLASS)],
+            consumeErrors=True)
+        d.addCallback(self.loaded, device)
+        d.addErrback(lambda failure: failure.value.subFailure)
+        return d
+
+    def loaded(self, results, device):
+        filters, handlers, subscriptions = results
+        state = DeviceState()
+
+        for attr, names in (('filters', filters), ('handlers', handlers)):
+            for name in names:
+                if self.owned(name['Name']):
+                    name.namespace = None
+                    getattr(state, attr)[name['Name']] = name
+
+        for name in subscriptions:
+            filter_name = name['Filter']['Name']
+            handler_name = name['Handler']['Name']
+            if self.owned(filter_name) and self.owned(handler_name):
+                name.namespace = None
+                state.subscriptions[(filter_name, handler_name)] = name
+
+        self.states[device_id(device)] = state
+        return state
+
+    def sync(self, device, subscriptions):
+        """Make the subscriptions owned on device match subscriptions.
+
+        Return a Deferred firing with the number of instances created and
+        deleted.  If any request fails, the cached state of the device is
+        dropped and the Deferred fails with the first error.
+        """
+        d = self.load(device)
+        d.addCallback(self.apply, device, subscriptions)
+        return d
+
+    def apply(self, state, device, subscriptions):
+        filters = {}
+        handlers = {}
+        for subscription in subscriptions:
+            filters[self.filter_name(subscription)] = subscription
+            handlers[self.handler_name(subscription)] = subscription
+        wanted = set(
+            (self.filter_name(x), self.handler_name(x))
+            for x in subscriptions)
+
+        changes = {'created': 0, 'deleted': 0}
+
+        def create_filters_and_handlers():
+            deferreds = []
+            for name, subscription in filters.iteritems():
+                if name not in state.filters:
+                    deferreds.append(self.create(
+                        device, state.filters, name,
+                        self.filter_instance(name, subscription),
+                        self.system_path(FILTER_CLASS, name), changes))
+            for name, subscription in handlers.iteritems():
+                if name not in state.handlers:
+                    deferreds.append(self.create(
+                        device, state.handlers, name,
+                        self.handler_instance(name, subscription),
+                        self.system_path(HANDLER_CLASS, name), changes))
+            return deferreds
+
+        def update_subscriptions():
+            deferreds = []
+            for key in wanted:
+                if key not in state.subscriptions:
+                    filter_path = state.filters[key[0]]
+                    handler_path = state.handlers[key[1]]
+                    deferreds.append(self.create(
+                        device, state.subscriptions, key,
+                        self.subscription_instance(filter_path, handler_path),
+                        self.subscription_path(filter_path, handler_path),
+                        changes))
+            for key in set(state.subscriptions) - wanted:
+                deferreds.append(self.delete(
+                    device, state.subscriptions, key, changes))
+            return deferreds
+
+        def delete_filters_and_handlers():
+            deferreds = []
+            for name in set(state.filters) - set(filters):
+                deferreds.append(
+                    self.delete(device, state.filters, name, changes))
+            for name in set(state.handlers) - set(handlers):
+                deferreds.append(
+                    self.delete(device, state.handlers, name, changes))
+            return deferreds
+
+        d = self.run_phase(device, create_filters_and_handlers)
+        d.addCallback(
+            lambda _: self.run_phase(device, update_subscriptions))
+        d.addCallback(
+            lambda _: self.run_phase(device, delete_filters_and_handlers))
+        d.addCallback(lambda _: changes)
+        return d
+
+    def run_phase(self, device, phase):
+        """Wait for every request of a phase and fail with the first error
+        once they have all finished."""
+        d = defer.DeferredList(phase(), consumeErrors=True)
+
+        def check(results):
+            for success, result in results:
+                if not success:
+                    log.warn('%s indication subscription update failed: %s',
+                             device_id(device), result.getErrorMessage())
+                    self.forget(device_id(device))
+                    return result
+
+        d.addCallback(check)
+        return d
+
+    def create(self, device, cache, key, instance, path, changes):
+        d = self.request(
+            device, CreateInstance, instance.classname, instance)
+
+        def created(result):
+            cache[key] = path
+            changes['created'] += 1
+
+        def exists(failure):
+            failure.trap(CIMError)
+            if failure.value.args[0] != CIM_ERR_ALREADY_EXISTS:
+                return failure
+            cache[key] = path
+
+        d.addCallbacks(created, exists)
+        return d
+
+    def delete(self, device, cache, key, changes):
+        path = cache[key]
+        d = self.request(device, DeleteInstance, path.classname, path)
+
+        def deleted(result):
+            cache.pop(key, None)
+            changes['deleted'] += 1
+
+        def missing(failure):
+            failure.trap(CIMError)
+            if failure.value.args[0] != CIM_ERR_NOT_FOUND:
+                return failure
+            cache.pop(key, None)
+
+        d.addCallbacks(deleted, missing)
+        return d
+
+    def renew(self, devices):
+        """Extend the lease of every cached subscription on devices.
+
+        Return a Deferred firing with the number of subscriptions renewed.
+        Subscriptions that no longer exist are dropped from the cache.
+        """
+        if not self.lease:
+            return defer.succeed(0)
+
+        deferreds = []
+        for device in devices:
+            state = self.states.get(device_id(device))
+            if state is None:
+                continue
+            for key, path in state.subscriptions.items():
+                deferreds.append(self.renew_subscription(
+                    device, state, key, path))
+
+        d = defer.DeferredList(deferreds, consumeErrors=True)
+
+        def count(results):
+            for success, result in results:
+                if not success:
+                    log.warn('Unable to renew indication subscription: %s',
+                             result.getErrorMessage())
+            return len([x for x in results if x[0] and x[1]])
+
+        d.addCallback(count)
+        return d
+
+    def renew_subscription(self, device, state, key, path):
+        instance = CIMInstance(SUBSCRIPTION_CLASS, {
+            'SubscriptionDuration': Uint64(self.lease)})
+
+        d = self.request(
+            device, ModifyInstance, SUBSCRIPTION_CLASS, path, instance,
+            PropertyList=['SubscriptionDuration'])
+
+        def missing(failure):
+            failure.trap(CIMError)
+            if failure.value.args[0] != CIM_ERR_NOT_FOUND:
+                return failure
+            state.subscriptions.pop(key, None)
+            return False
+
+        d.addCallbacks(lambda _: True, missing)
+        return d
+
+    def filter_instance(self, name, subscription):
+        return CIMInstance(FILTER_CLASS, {
+            'CreationClassName': FILTER_CLASS,
+            'SystemCreationClassName': 'CIM_ComputerSystem',
+            'SystemName': self.system_name,
+            'Name': name,
+            'Query': subscription.query,
+            'QueryLanguage': subscription.query_language,
+            'SourceNamespace': subscription.source_namespace,
+            })
+
+    def handler_instance(self, name, subscription):
+        return CIMInstance(HANDLER_CLASS, {
+            'CreationClassName': HANDLER_CLASS,
+            'SystemCreationClassName': 'CIM_ComputerSystem',
+            'SystemName': self.system_name,
+            'Name': name,
+            'Destination': subscription.destination,
+            })
+
+    def subscription_instance(self, filter_path, handler_path):
+        instance = CIMInstance(SUBSCRIPTION_CLASS, {
+            'Filter': filter_path,
+            'Handler': handler_path,
+            })
+        if self.lease:
+            instance['SubscriptionDuration'] = Uint64(self.lease)
+        return instance
@@ -0,0 +1,64 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2017, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+import time
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.WBEM.cache import ResponseCache, cache_key
+
+
+class TestResponseCache(BaseTestCase):
+
+    def test_ttl(self):
+        cache = ResponseCache()
+        key = cache_key('dev1', 'root/cimv2', 'CIM_Foo')
+
+        cache.put(key, ['result'], 60)
+        self.assertEqual(cache.get(key), ['result'])
+
+        cache.entries[key] = (time.time() - 1,) + cache.entries[key][1:]
+        self.assertEqual(cache.get(key), None)
+        self.assertEqual(cache.size, 0)
+
+        cache.put(key, ['result'], 0)
+        self.assertFalse(key in cache)
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(max_bytes=1000)
+
+        cache.put('a', [1], 60, size=400)
+        cache.put('b', [1], 60, size=400)
+        cache.get('a')
+        cache.put('c', [1], 60, size=400)
+
+        self.assertEqual(cache.entries.keys(), ['a', 'c'])
+        self.assertEqual(cache.size, 800)
+
+        cache.put('d', [1], 60, size=2000)
+        self.assertFalse('d' in cache.entries)
+
+    def test_invalidate_class(self):
+        cache = ResponseCache()
+        cache.put(cache_key('dev1', 'root/cimv2', 'CIM_Foo'), [1], 60)
+        cache.put(cache_key('dev1', 'root/cimv2', 'CIM_Bar'), [1], 60)
+        cache.put(cache_key('dev2', 'root/cimv2', 'CIM_Foo'), [1], 60)
+
+        cache.invalidate_class('dev1', 'cim_foo')
+        self.assertEqual(len(cache), 2)
+
+        cache.invalidate_class('dev1')
+        self.assertEqual(len(cache), 1)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestResponseCache))
+    return suite
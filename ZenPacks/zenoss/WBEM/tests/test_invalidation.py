@@ -0,0 +1,352 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2017, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from mock import Mock, patch
+
+from twisted.internet import defer
+from twisted.internet.error import CannotListenError
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.WBEM.cache import RESPONSE_CACHE, ResponseCache, cache_key
+from ZenPacks.zenoss.WBEM.datasources.WBEMDataSource import (
+    WBEMDataSourcePlugin,
+)
+from ZenPacks.zenoss.WBEM.invalidation import (
+    RETRY_INTERVAL,
+    CacheInvalidator,
+    IndicationSubscriber,
+    lifecycle_subscriptions,
+)
+from ZenPacks.zenoss.WBEM.utils import addLocalLibPath
+
+addLocalLibPath()
+
+from pywbem import CIMInstance, CIMInstanceName, Uint16
+
+
+def disk(name, status=2, classname='CIM_DiskDrive'):
+    instance = CIMInstance(classname, {
+        'DeviceID': name, 'OperationalStatus': Uint16(status)})
+    instance.path = CIMInstanceName(
+        classname, keybindings={'DeviceID': name})
+    return instance
+
+
+def lifecycle(classname, instance):
+    source = CIMInstance(instance.classname, dict(instance.items()))
+    return CIMInstance(classname, {'SourceInstance': source})
+
+
+class TestCacheInvalidator(BaseTestCase):
+
+    def afterSetUp(self):
+        super(TestCacheInvalidator, self).afterSetUp()
+        self.cache = ResponseCache()
+        self.invalidator = CacheInvalidator(self.cache)
+        self.invalidator.subscribe('dev1', '10.0.0.1')
+
+        self.disks = cache_key('dev1', 'root/cimv2', 'CIM_DiskDrive')
+        self.systems = cache_key('dev1', 'root/cimv2', 'CIM_ComputerSystem')
+        self.cache.put(self.disks, [disk('0'), disk('1')], 3600)
+        self.cache.put(self.systems, [CIMInstance('CIM_ComputerSystem')], 3600)
+
+    def handle(self, classname, instance, source='10.0.0.1'):
+        self.invalidator.handle_batch(
+            [(source, lifecycle(classname, instance))])
+
+    def test_modification(self):
+        changed = disk('1', status=6)
+        changed['Description'] = 'not cached'
+        self.handle('CIM_InstModification', changed)
+
+        results = self.cache.get(self.disks)
+        self.assertEqual(results[1]['OperationalStatus'], 6)
+        self.assertFalse('Description' in results[1])
+        self.assertEqual(results[1].path, disk('1').path)
+        self.assertEqual(self.invalidator.stats['patched'], 1)
+
+        # An instance that isn't cached may only now match the query.
+        self.handle('CIM_InstModification', disk('2'))
+        self.assertFalse(self.disks in self.cache)
+        self.assertTrue(self.systems in self.cache)
+
+    def test_query(self):
+        broken = cache_key(
+            'dev1', 'root/cimv2', 'CIM_DiskDrive',
+            'SELECT * FROM CIM_DiskDrive WHERE OperationalStatus <> 2')
+        self.cache.put(broken, [disk('0', 6), disk('1', 3)], 3600)
+        working = cache_key(
+            'dev1', 'root/cimv2', 'CIM_DiskDrive',
+            'SELECT * FROM CIM_DiskDrive WHERE OperationalStatus = 2')
+        self.cache.put(working, [disk('0'), disk('1')], 3600)
+        unknown = cache_key(
+            'dev1', 'root/cimv2', 'CIM_DiskDrive',
+            'SELECT * FROM CIM_DiskDrive WHERE Name ~ 1')
+        self.cache.put(unknown, [disk('0'), disk('1')], 3600)
+
+        self.handle('CIM_InstModification', disk('1', status=6))
+
+        # Patched where the instance still matches the query, removed
+        # where it no longer does.
+        self.assertEqual(
+            [x['OperationalStatus'] for x in self.cache.get(self.disks)],
+            [2, 6])
+        self.assertEqual(
+            [x['OperationalStatus'] for x in self.cache.get(broken)], [6, 6])
+        self.assertEqual(
+            [x['DeviceID'] for x in self.cache.get(working)], ['0'])
+        self.assertFalse(unknown in self.cache)
+
+        # A condition on a property the indication leaves out can't be
+        # checked.
+        names = cache_key(
+            'dev1', 'root/cimv2', 'CIM_DiskDrive',
+            "SELECT * FROM CIM_DiskDrive WHERE Name = 'disk0'")
+        self.cache.put(names, [disk('0')], 3600)
+        self.handle('CIM_InstModification', disk('0', status=6))
+        self.assertFalse(names in self.cache)
+
+    def test_dropped(self):
+        other = cache_key('dev2', 'root/cimv2', 'CIM_DiskDrive')
+        self.cache.put(other, [disk('0')], 3600)
+
+        self.invalidator.indications_dropped(
+            [('10.0.0.1', lifecycle('CIM_InstModification', disk('0'))),
+             ('10.0.0.9', lifecycle('CIM_InstModification', disk('0')))])
+
+        self.assertFalse(self.disks in self.cache)
+        self.assertFalse(self.systems in self.cache)
+        self.assertTrue(other in self.cache)
+        self.assertEqual(self.invalidator.stats['invalidated'], 2)
+
+    def test_deletion(self):
+        self.handle('CIM_InstDeletion', disk('0'))
+        self.assertEqual(
+            [x['DeviceID'] for x in self.cache.get(self.disks)], ['1'])
+
+        self.handle('CIM_InstDeletion', disk('0'))
+        self.assertEqual(len(self.cache.get(self.disks)), 1)
+        self.assertEqual(self.invalidator.stats['removed'], 1)
+
+    def test_subclasses(self):
+        vendor = disk('2', classname='Vendor_DiskDrive')
+        self.cache.put(self.disks, [disk('0'), vendor], 3600)
+
+        self.handle('CIM_InstModification', disk('2', 6, 'Vendor_DiskDrive'))
+        self.assertEqual(
+            self.cache.get(self.disks)[1]['OperationalStatus'], 6)
+
+        self.handle('CIM_InstCreation', disk('3', classname='Vendor_DiskDrive'))
+        self.assertFalse(self.disks in self.cache)
+        self.assertTrue(self.systems in self.cache)
+
+        # A class not seen before may belong to any entry.
+        self.handle('CIM_InstCreation', disk('0', classname='Other_Disk'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_sources(self):
+        self.handle('CIM_InstDeletion', disk('0'), source='10.0.0.2')
+        self.assertEqual(len(self.cache.get(self.disks)), 2)
+        self.assertEqual(self.invalidator.stats['ignored'], 1)
+
+        self.assertTrue(self.invalidator.subscribed('dev1'))
+        self.invalidator.subscribe('dev1', '10.0.0.2')
+        self.handle('CIM_InstDeletion', disk('0'), source='10.0.0.2')
+        self.assertEqual(len(self.cache.get(self.disks)), 1)
+
+        self.invalidator.unsubscribe('dev1')
+        self.assertFalse(self.invalidator.subscribed('dev1'))
+
+    def test_embedded_string(self):
+        source = CIMInstance('CIM_DiskDrive', dict(disk('0', 6).items()))
+        indication = CIMInstance('CIM_InstModification', {
+            'SourceInstance': source.tocimxml().toxml()})
+        self.invalidator.handle('dev1', indication)
+
+        self.assertEqual(
+            self.cache.get(self.disks)[0]['OperationalStatus'], 6)
+
+    def test_lifecycle_subscriptions(self):
+        subscriptions = lifecycle_subscriptions(
+            ['CIM_DiskDrive'], 'https://collector:5989')
+        self.assertEqual(
+            [x.query for x in subscriptions],
+            ['SELECT * FROM %s WHERE SourceInstance ISA CIM_DiskDrive' % x
+             for x in ('CIM_InstCreation', 'CIM_InstModification',
+                       'CIM_InstDeletion')])
+
+
+class FakeManager(object):
+    """A SubscriptionManager recording what it is asked to sync."""
+
+    def __init__(self):
+        self.synced = []
+        self.errors = []
+        self.forgotten = []
+
+    def forget(self, device=None):
+        self.forgotten.append(device)
+
+    def sync(self, device, subscriptions):
+        self.synced.append((device.device, [x.query for x in subscriptions]))
+        if self.errors:
+            return defer.fail(self.errors.pop(0))
+        return defer.succeed({'created': len(subscriptions), 'deleted': 0})
+
+
+def datasource_config(device='dev1', classname='CIM_DiskDrive'):
+    return Mock(
+        device=device,
+        manageIp='10.0.0.1',
+        zWBEMIndicationPort=5990,
+        zWBEMIndicationCacheTTL=3600,
+        zWBEMMaxObjectCount=0,
+        params={
+            'namespace': 'root/cimv2',
+            'classname': classname,
+            'query': 'SELECT * FROM %s' % classname,
+            'cache_ttl': 0,
+            })
+
+
+class TestIndicationSubscriber(BaseTestCase):
+
+    def afterSetUp(self):
+        super(TestIndicationSubscriber, self).afterSetUp()
+        self.now = 1000.0
+        self.manager = FakeManager()
+        self.invalidator = CacheInvalidator(ResponseCache())
+        self.subscriber = IndicationSubscriber(
+            self.invalidator, self.manager, host='collector',
+            clock=lambda: self.now)
+        self.patcher = patch(
+            'pywbem.indication_listener.IndicationListener')
+        self.listener_class = self.patcher.start()
+
+    def beforeTearDown(self):
+        self.patcher.stop()
+
+    def queries(self, *classnames):
+        return [x.query for x in lifecycle_subscriptions(
+            classnames, 'http://collector:5990')]
+
+    def test_watch(self):
+        self.subscriber.watch(datasource_config(), 'CIM_DiskDrive')
+
+        self.listener_class.assert_called_once_with(
+            self.invalidator.indications_received,
+            dropped=self.invalidator.indications_dropped)
+        self.listener_class.return_value.listen.assert_called_once_with(
+            http_port=5990)
+        self.assertEqual(self.manager.synced,
+                         [('dev1', self.queries('CIM_DiskDrive'))])
+        self.assertTrue(self.invalidator.subscribed('dev1'))
+        self.assertEqual(self.invalidator.devices, {'10.0.0.1': 'dev1'})
+
+        # Nothing is sent again for a class already watched.
+        self.assertEqual(
+            self.subscriber.watch(datasource_config(), 'CIM_DiskDrive'), None)
+        self.assertEqual(len(self.manager.synced), 1)
+
+        # Another class adds to the subscriptions of the device.
+        self.subscriber.watch(datasource_config(), 'CIM_FAN')
+        self.assertEqual(
+            self.manager.synced[-1],
+            ('dev1', self.queries('CIM_DiskDrive', 'CIM_FAN')))
+        self.assertEqual(self.listener_class.call_count, 1)
+
+    def test_recheck(self):
+        self.subscriber.watch(datasource_config(), 'CIM_DiskDrive')
+
+        self.now += RETRY_INTERVAL - 1
+        self.assertEqual(
+            self.subscriber.watch(datasource_config(), 'CIM_DiskDrive'), None)
+
+        # The device is synced again from enumerated state, in case it
+        # lost its subscriptions.
+        self.now += 1
+        self.subscriber.watch(datasource_config(), 'CIM_DiskDrive')
+        self.assertEqual(self.manager.forgotten, ['dev1'])
+        self.assertEqual(len(self.manager.synced), 2)
+
+        self.now += RETRY_INTERVAL - 1
+        self.subscriber.watch(datasource_config(), 'CIM_DiskDrive')
+        self.assertEqual(len(self.manager.synced), 2)
+
+    def test_failure(self):
+        self.manager.errors.append(Exception('not supported'))
+        self.subscriber.watch(datasource_config(), 'CIM_DiskDrive')
+        self.assertFalse(self.invalidator.subscribed('dev1'))
+
+        self.now += RETRY_INTERVAL - 1
+        self.assertEqual(
+            self.subscriber.watch(datasource_config(), 'CIM_DiskDrive'), None)
+
+        self.now += 1
+        self.subscriber.watch(datasource_config(), 'CIM_DiskDrive')
+        self.assertEqual(len(self.manager.synced), 2)
+        self.assertTrue(self.invalidator.subscribed('dev1'))
+
+    def test_listen_failure(self):
+        self.listener_class.return_value.listen.side_effect = \
+            CannotListenError('', 5990, 'in use')
+
+        self.assertEqual(
+            self.subscriber.watch(datasource_config(), 'CIM_DiskDrive'), None)
+        self.assertTrue(self.listener_class.return_value.stop.called)
+        self.assertEqual(self.manager.synced, [])
+
+        self.now += RETRY_INTERVAL
+        self.listener_class.return_value.listen.side_effect = None
+        self.subscriber.watch(datasource_config(), 'CIM_DiskDrive')
+        self.assertTrue(self.invalidator.subscribed('dev1'))
+
+
+class TestCollectSubscribes(BaseTestCase):
+
+    def afterSetUp(self):
+        super(TestCollectSubscribes, self).afterSetUp()
+        self.patcher = patch(
+            'ZenPacks.zenoss.WBEM.datasources.WBEMDataSource.SUBSCRIBER')
+        self.subscriber = self.patcher.start()
+
+    def beforeTearDown(self):
+        self.patcher.stop()
+        RESPONSE_CACHE.clear()
+
+    def collect(self, ds0):
+        config = Mock(id='dev1', datasources=[ds0])
+        plugin = WBEMDataSourcePlugin()
+        ds0.params['cache_ttl'] = 60
+        RESPONSE_CACHE.put(plugin.cacheKey(config), ['cached'], 60)
+
+        results = []
+        plugin.collect(config).addBoth(results.append)
+        return results[0]
+
+    def test_collect(self):
+        ds0 = datasource_config()
+        self.assertEqual(self.collect(ds0), ['cached'])
+        self.subscriber.watch.assert_called_once_with(ds0, 'CIM_DiskDrive')
+
+    def test_disabled(self):
+        ds0 = datasource_config()
+        ds0.zWBEMIndicationCacheTTL = 0
+        self.collect(ds0)
+        self.assertFalse(self.subscriber.watch.called)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestCacheInvalidator))
+    suite.addTest(makeSuite(TestIndicationSubscriber))
+    suite.addTest(makeSuite(TestCollectSubscribes))
+    return suite
@@ -0,0 +1,111 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2017, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+import os
+
+from twisted.internet import defer
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.WBEM.utils import addLocalLibPath
+addLocalLibPath()
+
+from pywbem.cim_obj import CIMInstance
+
+from ZenPacks.zenoss.WBEM.results import (
+    ResultsLimit,
+    ResultsLimitExceeded,
+    ResultsRepr,
+    SpilledResults,
+    count_results,
+    spill_results,
+)
+
+
+def instances(count):
+    return [CIMInstance('CIM_Foo', properties={'Name': 'foo%d' % i})
+            for i in range(count)]
+
+
+class TestSpilledResults(BaseTestCase):
+
+    def test_sequence(self):
+        results = SpilledResults(instances(5))
+        path = results.path
+        self.assertTrue(os.path.exists(path))
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual([x['Name'] for x in results],
+                         ['foo0', 'foo1', 'foo2', 'foo3', 'foo4'])
+        self.assertEqual(list(results), instances(5))
+        self.assertEqual(results[0]['Name'], 'foo0')
+        self.assertEqual(results[-1]['Name'], 'foo4')
+        self.assertEqual([x['Name'] for x in results[1:3]], ['foo1', 'foo2'])
+        self.assertRaises(IndexError, results.__getitem__, 5)
+
+        results.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_spill_threshold(self):
+        small = instances(2)
+        self.assertTrue(spill_results(small, 2) is small)
+        self.assertTrue(spill_results(small, 0) is small)
+        self.assertTrue(isinstance(spill_results(small, 1), SpilledResults))
+
+        failure = Exception('failed')
+        self.assertTrue(spill_results(failure, 1) is failure)
+
+    def test_count_and_repr(self):
+        results = [
+            (True, instances(3)),
+            (True, SpilledResults(instances(4))),
+            (False, Exception('failed')),
+            ]
+
+        self.assertEqual(count_results(results), 7)
+        self.assertTrue("'foo3'" in str(ResultsRepr(results)))
+
+
+class TestResultsLimit(BaseTestCase):
+
+    def test_limit(self):
+        limit = ResultsLimit(4, 'TestPlugin')
+        queries = [defer.Deferred() for i in range(3)]
+        for d in queries:
+            limit.watch(d)
+        spilled = []
+        queries[1].addCallback(spilled.append)
+
+        d = defer.DeferredList(queries, consumeErrors=True)
+        results = []
+        d.addCallback(results.extend)
+
+        queries[0].callback(instances(3))
+        self.assertEqual(limit.total, 3)
+        self.assertEqual(results, [])
+
+        # The query going over the limit fails before its result is
+        # spilled, and the others are cancelled without waiting for them.
+        queries[1].callback(instances(2))
+        self.assertEqual(spilled, [])
+        self.assertEqual(len(results), 3)
+        self.assertEqual(len(results[0][1]), 3)
+        self.assertTrue(results[1][1].check(ResultsLimitExceeded))
+        self.assertEqual(
+            results[1][1].getErrorMessage(),
+            '5 instances returned, more than the limit of 4 for TestPlugin')
+        self.assertTrue(results[2][1].check(defer.CancelledError))
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestSpilledResults))
+    suite.addTest(makeSuite(TestResultsLimit))
+    return suite
@@ -0,0 +1,175 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2017, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+import shutil
+import tempfile
+
+from mock import patch
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.WBEM.utils import addLocalLibPath
+addLocalLibPath()
+
+from pywbem.cim_obj import CIMClass, CIMMethod, CIMProperty, CIMQualifier
+
+from ZenPacks.zenoss.WBEM.schema import (
+    SchemaCache,
+    class_digest,
+    class_digests,
+    collect_classes,
+    schema_fingerprint,
+)
+
+
+def disk_class(size_type='uint64', description='A disk'):
+    return CIMClass(
+        'EMC_Disk', superclass='CIM_A',
+        properties={
+            'Name': CIMProperty('Name', None, type='string'),
+            'Size': CIMProperty('Size', None, type=size_type),
+            },
+        qualifiers={
+            'Description': CIMQualifier('Description', description)})
+
+
+def outline(klass):
+    """Return klass as enumerated without qualifiers."""
+    klass = klass.copy()
+    klass.qualifiers.clear()
+    return klass
+
+
+class FakeDevice(object):
+    """A CIMOM answering class requests as soon as they are sent."""
+
+    id = 'dev1'
+    zWBEMUsername = 'user'
+    zWBEMPassword = 'pass'
+
+    def __init__(self, classes):
+        self.classes = classes
+        self.requests = []
+
+    def create_connection(self, device, factory):
+        if factory.method == 'GetClass':
+            self.requests.append(('GetClass', factory.classname))
+            factory.deferred.callback(
+                [x for x in self.classes
+                 if x.classname == factory.classname][0])
+        elif 'IncludeQualifiers' in factory.payload:
+            self.requests.append(('EnumerateClasses', 'outlines'))
+            factory.deferred.callback([outline(x) for x in self.classes])
+        else:
+            self.requests.append(('EnumerateClasses', 'full'))
+            factory.deferred.callback(list(self.classes))
+
+
+class TestSchemaCache(BaseTestCase):
+
+    def afterSetUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def beforeTearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fingerprint(self):
+        a, b = CIMClass('CIM_A'), disk_class()
+        self.assertEqual(schema_fingerprint(class_digests([a, b])),
+                         schema_fingerprint(class_digests([b, a])))
+        self.assertNotEqual(schema_fingerprint(class_digests([a, b])),
+                            schema_fingerprint(class_digests([a])))
+
+        # Definitions count, qualifiers don't.
+        self.assertEqual(class_digest(disk_class()),
+                         class_digest(outline(disk_class('uint64', 'Other'))))
+        self.assertNotEqual(class_digest(disk_class()),
+                            class_digest(disk_class('uint32')))
+
+        with_method = disk_class()
+        with_method.methods['Reset'] = CIMMethod('Reset', 'uint32')
+        self.assertNotEqual(class_digest(disk_class()),
+                            class_digest(with_method))
+
+    def test_save_load(self):
+        cache = SchemaCache('dev1', 'root/emc', self.directory)
+        self.assertEqual(cache.load(), None)
+
+        classes = [
+            CIMClass('CIM_A'),
+            CIMClass('EMC_B', superclass='CIM_A', properties={
+                'Name': CIMProperty('Name', None, type='string')}),
+            ]
+        cache.save(classes, timestamp=1234)
+
+        entry = SchemaCache('dev1', 'root/emc', self.directory).load()
+        self.assertEqual(entry['timestamp'], 1234)
+        self.assertEqual(entry['fingerprint'],
+                         schema_fingerprint(class_digests(classes)))
+        self.assertEqual(entry['classes']['emc_b'], classes[1])
+
+        self.assertEqual(
+            SchemaCache('dev1', 'root/cimv2', self.directory).load(), None)
+        self.assertEqual(
+            SchemaCache('dev2', 'root/emc', self.directory).load(), None)
+
+
+class TestCollectClasses(BaseTestCase):
+
+    def afterSetUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.device = FakeDevice([CIMClass('CIM_A'), disk_class()])
+        self.patcher = patch('ZenPacks.zenoss.WBEM.schema.create_connection',
+                             self.device.create_connection)
+        self.patcher.start()
+
+    def beforeTearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.directory)
+
+    def collect(self):
+        del self.device.requests[:]
+        results = []
+        collect_classes(self.device, 'root/emc', 3600, self.directory) \
+            .addBoth(results.append)
+        return results[0]
+
+    def test_cached(self):
+        self.collect()
+        self.assertEqual(self.device.requests, [
+            ('EnumerateClasses', 'outlines'), ('EnumerateClasses', 'full')])
+
+        classes = self.collect()
+        self.assertEqual(self.device.requests,
+                         [('EnumerateClasses', 'outlines')])
+        self.assertEqual(classes[1].qualifiers['Description'].value, 'A disk')
+
+    def test_changed_class(self):
+        self.collect()
+
+        self.device.classes[1] = disk_class('uint32', 'A bigger disk')
+        classes = self.collect()
+        self.assertEqual(self.device.requests, [
+            ('EnumerateClasses', 'outlines'), ('GetClass', 'EMC_Disk')])
+        self.assertEqual(classes[1].properties['Size'].type, 'uint32')
+        self.assertEqual(classes[1].qualifiers['Description'].value,
+                         'A bigger disk')
+
+        # The refetched class is cached too.
+        self.collect()
+        self.assertEqual(self.device.requests,
+                         [('EnumerateClasses', 'outlines')])
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestSchemaCache))
+    suite.addTest(makeSuite(TestCollectClasses))
+    return suite
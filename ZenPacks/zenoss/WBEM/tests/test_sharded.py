@@ -0,0 +1,175 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2017, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from mock import patch
+
+from twisted.internet.error import TimeoutError
+from twisted.internet.task import Clock
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.WBEM.sharded import (
+    ShardSelector,
+    collect_sharded,
+    shards,
+)
+from ZenPacks.zenoss.WBEM.utils import addLocalLibPath
+
+addLocalLibPath()
+
+from pywbem import CIMError, CIMInstance, CIMInstanceName
+from pywbem.cim_constants import CIM_ERR_FAILED, CIM_ERR_NOT_FOUND
+from pywbem.twisted_client import RequestQueue
+
+
+class FakeDevice(object):
+    """Answers requests as soon as they are sent, except for the
+    instances named in hung."""
+
+    id = 'dev1'
+    zWBEMUsername = 'user'
+    zWBEMPassword = 'pass'
+
+    def __init__(self, count, errors=None, hung=()):
+        self.names = [
+            CIMInstanceName('CIM_Foo', keybindings={'Name': str(x)},
+                            namespace='root/cimv2')
+            for x in range(count)]
+        self.errors = errors or {}
+        self.hung = hung
+        self.requests = []
+        self.connections = 0
+
+    def create_connection(self, device, factory):
+        self.connections += 1
+
+        if isinstance(factory, RequestQueue):
+            for request in list(factory.pending):
+                self.answer(request)
+        else:
+            self.answer(factory)
+
+    def answer(self, factory):
+        self.requests.append(factory)
+
+        if factory.method == 'EnumerateInstanceNames':
+            factory.deferred.callback(self.names)
+            return
+
+        name = factory.instancename['Name']
+        if name in self.hung:
+            return
+
+        errors = self.errors.get(name)
+        if errors:
+            factory.deferred.errback(errors.pop(0))
+            return
+
+        factory.deferred.callback(CIMInstance('CIM_Foo', {'Name': name}))
+
+
+class TestCollectSharded(BaseTestCase):
+
+    def afterSetUp(self):
+        self.clock = Clock()
+        self.patcher = patch('ZenPacks.zenoss.WBEM.sharded.reactor',
+                             self.clock)
+        self.patcher.start()
+
+    def beforeTearDown(self):
+        self.patcher.stop()
+
+    def collect(self, device, shard_size=3, concurrency=2):
+        results = []
+        with patch('ZenPacks.zenoss.WBEM.sharded.create_connection',
+                   device.create_connection):
+            d = collect_sharded(device, 'root/cimv2', 'CIM_Foo',
+                                shard_size, concurrency, 60)
+            d.addBoth(results.append)
+            self.clock.advance(60)
+        return results[0]
+
+    def test_shards(self):
+        self.assertEqual(shards(range(5), 2), [[0, 1], [2, 3], [4]])
+        self.assertEqual(shards([], 2), [])
+
+    def test_collect(self):
+        device = FakeDevice(7)
+        instances = self.collect(device)
+
+        self.assertEqual([x['Name'] for x in instances],
+                         [str(x) for x in range(7)])
+        self.assertEqual(instances[0].path, device.names[0])
+        self.assertEqual(len(device.requests), 8)
+
+        # One connection for the names and one per shard.
+        self.assertEqual(device.connections, 4)
+
+        # Names are sent without the namespace of the enumeration.
+        self.assertEqual(device.requests[1].instancename.namespace, None)
+
+    def test_retry(self):
+        device = FakeDevice(4, errors={
+            '1': [CIMError(CIM_ERR_FAILED, 'busy')],
+            '2': [CIMError(CIM_ERR_NOT_FOUND, 'gone')],
+            })
+        instances = self.collect(device)
+
+        self.assertEqual([x['Name'] for x in instances], ['0', '1', '3'])
+        self.assertEqual(len(device.requests), 6)
+
+    def test_retries_exhausted(self):
+        device = FakeDevice(4, errors={
+            '1': [CIMError(CIM_ERR_FAILED, 'busy')] * 3,
+            })
+        result = self.collect(device)
+
+        self.assertTrue(result.check(CIMError))
+        result.trap(CIMError)
+
+    def test_deadline(self):
+        device = FakeDevice(7, hung=['1'])
+        result = self.collect(device, concurrency=1)
+        result.trap(TimeoutError)
+
+        # The shard waiting for the hung request is abandoned, and the
+        # shards waiting for a free connection are never sent.
+        self.assertTrue(device.requests[2].deferred.called)
+        self.assertEqual(device.connections, 2)
+
+
+class TestShardSelector(BaseTestCase):
+
+    def test_selection(self):
+        selector = ShardSelector(threshold=0.5, recheck_cycles=3)
+        self.assertFalse(selector.use_sharded('dev1', 'CIM_Foo', 100))
+
+        selector.record('dev1', 'CIM_Foo', 10)
+        self.assertFalse(selector.use_sharded('dev1', 'CIM_Foo', 100))
+
+        selector.record('dev1', 'CIM_Foo', 100, timed_out=True)
+        self.assertEqual(
+            [selector.use_sharded('dev1', 'CIM_Foo', 100) for _ in range(6)],
+            [True, True, False, True, True, False])
+        self.assertFalse(selector.use_sharded('dev2', 'CIM_Foo', 100))
+
+        # Slow enumerations keep the class sharded after they succeed.
+        selector.record('dev1', 'CIM_Foo', 200)
+        self.assertTrue(selector.use_sharded('dev1', 'CIM_Foo', 100))
+
+        selector.clear('dev1')
+        self.assertFalse(selector.use_sharded('dev1', 'CIM_Foo', 100))
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestCollectSharded))
+    suite.addTest(makeSuite(TestShardSelector))
+    return suite
@@ -0,0 +1,114 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2017, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from mock import Mock, patch
+
+from twisted.python.failure import Failure
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.WBEM.datasources.WBEMDataSource import (
+    WBEMDataSourcePlugin,
+)
+from ZenPacks.zenoss.WBEM.strategy import (
+    EXEC_QUERY,
+    PULLED,
+    StrategySelector,
+    is_unsupported,
+)
+from ZenPacks.zenoss.WBEM.utils import addLocalLibPath
+
+addLocalLibPath()
+
+from pywbem import CIMError
+from pywbem.cim_constants import CIM_ERR_FAILED, CIM_ERR_NOT_SUPPORTED
+
+
+class TestStrategySelector(BaseTestCase):
+
+    def test_fallback(self):
+        selector = StrategySelector()
+        self.assertEqual(selector.choose('dev1', 'CIM_Foo', PULLED), PULLED)
+
+        self.assertEqual(selector.fallback('dev1', PULLED), EXEC_QUERY)
+        self.assertEqual(selector.choose('dev1', 'CIM_Foo', PULLED),
+                         EXEC_QUERY)
+        self.assertEqual(selector.choose('dev2', 'CIM_Foo', PULLED), PULLED)
+
+        self.assertEqual(selector.fallback('dev1', EXEC_QUERY), None)
+
+    def test_capability_ttl(self):
+        selector = StrategySelector(capability_ttl=60)
+        selector.fallback('dev1', PULLED)
+        self.assertEqual(selector.supported('dev1', PULLED), False)
+
+        supported, timestamp = selector.capabilities[('dev1', PULLED)]
+        selector.capabilities[('dev1', PULLED)] = (supported, timestamp - 61)
+        self.assertEqual(selector.supported('dev1', PULLED), None)
+
+    def test_manual(self):
+        selector = StrategySelector()
+        selector.record('dev1', 'CIM_Foo', EXEC_QUERY, 10.0, 1000)
+        selector.record('dev1', 'CIM_Foo', PULLED, 1.0, 1000)
+
+        self.assertEqual(
+            selector.choose('dev1', 'CIM_Foo', EXEC_QUERY), EXEC_QUERY)
+
+    def test_auto(self):
+        selector = StrategySelector(explore_cycles=3)
+        choose = lambda: selector.choose(
+            'dev1', 'CIM_Foo', EXEC_QUERY, auto=True)
+
+        self.assertEqual(choose(), EXEC_QUERY)
+        selector.record('dev1', 'CIM_Foo', EXEC_QUERY, 10.0, 1000)
+
+        # The other method is explored every explore_cycles cycles.
+        self.assertEqual([choose(), choose()], [EXEC_QUERY, PULLED])
+        selector.record('dev1', 'CIM_Foo', PULLED, 2.0, 5000)
+        self.assertEqual(choose(), PULLED)
+
+        # Near ties go to the smaller payload.
+        selector.record('dev1', 'CIM_Foo', EXEC_QUERY, 2.0, 1000)
+        selector.measurements[('dev1', 'CIM_Foo', EXEC_QUERY)]['seconds'] = 2.1
+        self.assertEqual(choose(), EXEC_QUERY)
+
+    def test_is_unsupported(self):
+        self.assertTrue(is_unsupported(
+            Failure(CIMError(CIM_ERR_NOT_SUPPORTED, 'no'))))
+        self.assertFalse(is_unsupported(
+            Failure(CIMError(CIM_ERR_FAILED, 'failed'))))
+        self.assertFalse(is_unsupported(Failure(ValueError())))
+
+
+class TestRecordDuration(BaseTestCase):
+
+    @patch('ZenPacks.zenoss.WBEM.datasources.WBEMDataSource.SHARD_SELECTOR')
+    @patch('ZenPacks.zenoss.WBEM.datasources.WBEMDataSource.STRATEGIES')
+    def test_response_size(self, strategies, shard_selector):
+        config = Mock(id='dev1', datasources=[
+            Mock(params={'classname': 'CIM_Foo'})])
+
+        # Every response of a pulled enumeration counts, even when the
+        # instances are the same as ExecQuery would return.
+        factories = [Mock(response_xml='x' * 100), Mock(response_xml='x' * 20),
+                     Mock(response_xml=None)]
+        WBEMDataSourcePlugin().recordDuration(
+            ['instance'], config, PULLED, 0, factories)
+
+        args = strategies.record.call_args[0]
+        self.assertEqual(args[:3], ('dev1', 'CIM_Foo', PULLED))
+        self.assertEqual(args[4], 120)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestStrategySelector))
+    suite.addTest(makeSuite(TestRecordDuration))
+    return suite
@@ -0,0 +1,174 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2017, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from mock import patch
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.WBEM.subscriptions import (
+    FILTER_CLASS,
+    HANDLER_CLASS,
+    SUBSCRIPTION_CLASS,
+    Subscription,
+    SubscriptionManager,
+)
+from ZenPacks.zenoss.WBEM.utils import addLocalLibPath
+
+addLocalLibPath()
+
+from pywbem import CIMError, CIMInstanceName
+from pywbem.cim_constants import CIM_ERR_FAILED, CIM_ERR_NOT_FOUND
+
+
+class FakeDevice(object):
+    """A CIMOM answering requests as soon as they are sent."""
+
+    id = 'dev1'
+    zWBEMUsername = 'user'
+    zWBEMPassword = 'pass'
+
+    def __init__(self):
+        self.instances = {
+            FILTER_CLASS: {}, HANDLER_CLASS: {}, SUBSCRIPTION_CLASS: {}}
+        self.requests = []
+        self.errors = []
+
+    def key(self, path):
+        if path.classname == SUBSCRIPTION_CLASS:
+            return (path['Filter']['Name'], path['Handler']['Name'])
+        return path['Name']
+
+    def create_connection(self, device, factory):
+        self.requests.append((factory.method, factory.classname))
+
+        if self.errors:
+            factory.deferred.errback(self.errors.pop(0))
+            return
+
+        instances = self.instances.get(factory.classname)
+
+        if factory.method == 'EnumerateInstanceNames':
+            factory.deferred.callback([
+                x.copy() for x in instances.values()])
+        elif factory.method == 'CreateInstance':
+            instance = factory.instance
+            path = CIMInstanceName(instance.classname, namespace='root/interop')
+            for name in ('Name', 'CreationClassName', 'SystemName',
+                         'SystemCreationClassName', 'Filter', 'Handler'):
+                if name in instance:
+                    path[name] = instance[name]
+            instances[self.key(path)] = path
+            factory.deferred.callback(path)
+        elif factory.method == 'DeleteInstance':
+            if instances.pop(self.key(factory.instancename), None) is None:
+                factory.deferred.errback(CIMError(CIM_ERR_NOT_FOUND, 'gone'))
+            else:
+                factory.deferred.callback(None)
+        else:
+            factory.deferred.callback(None)
+
+
+def subscription(query, destination='https://collector:5989'):
+    return Subscription(query, destination)
+
+
+class TestSubscriptionManager(BaseTestCase):
+
+    def afterSetUp(self):
+        super(TestSubscriptionManager, self).afterSetUp()
+        self.device = FakeDevice()
+        self.manager = SubscriptionManager(
+            concurrency=2, lease=3600, system_name='collector')
+        self.patcher = patch(
+            'ZenPacks.zenoss.WBEM.subscriptions.create_connection',
+            self.device.create_connection)
+        self.patcher.start()
+
+    def beforeTearDown(self):
+        self.patcher.stop()
+
+    def sync(self, subscriptions):
+        results = []
+        self.manager.sync(self.device, subscriptions).addBoth(results.append)
+        return results[0]
+
+    def test_sync(self):
+        queries = ['SELECT * FROM CIM_AlertIndication',
+                   'SELECT * FROM CIM_InstModification']
+        changes = self.sync([subscription(x) for x in queries])
+
+        self.assertEqual(changes, {'created': 5, 'deleted': 0})
+        self.assertEqual(len(self.device.instances[SUBSCRIPTION_CLASS]), 2)
+        self.assertEqual(len(self.device.instances[HANDLER_CLASS]), 1)
+
+        # Nothing is enumerated or sent again when nothing changed.
+        del self.device.requests[:]
+        changes = self.sync([subscription(x) for x in queries])
+        self.assertEqual(changes, {'created': 0, 'deleted': 0})
+        self.assertEqual(self.device.requests, [])
+
+        # A removed subscription is deleted before its filter.
+        changes = self.sync([subscription(queries[0])])
+        self.assertEqual(changes, {'created': 0, 'deleted': 2})
+        self.assertEqual(self.device.requests, [
+            ('DeleteInstance', SUBSCRIPTION_CLASS),
+            ('DeleteInstance', FILTER_CLASS),
+            ])
+        self.assertEqual(len(self.device.instances[FILTER_CLASS]), 1)
+
+    def test_existing_state(self):
+        self.sync([subscription('SELECT * FROM CIM_AlertIndication')])
+
+        # Another manager finds the instances on the device.
+        self.manager = SubscriptionManager(system_name='collector')
+        del self.device.requests[:]
+        changes = self.sync(
+            [subscription('SELECT * FROM CIM_AlertIndication')])
+
+        self.assertEqual(changes, {'created': 0, 'deleted': 0})
+        self.assertEqual(
+            [x[0] for x in self.device.requests],
+            ['EnumerateInstanceNames'] * 3)
+
+    def test_failure(self):
+        alerts = subscription('SELECT * FROM CIM_AlertIndication')
+        created = subscription('SELECT * FROM CIM_InstCreation')
+
+        self.device.errors.append(CIMError(CIM_ERR_FAILED, 'busy'))
+        result = self.sync([alerts])
+        self.assertTrue(result.check(CIMError))
+        self.assertFalse(self.device.id in self.manager.states)
+
+        self.sync([alerts])
+        self.assertTrue(self.device.id in self.manager.states)
+
+        # A failed change drops the cached state.
+        self.device.errors.append(CIMError(CIM_ERR_FAILED, 'busy'))
+        result = self.sync([alerts, created])
+        self.assertTrue(result.check(CIMError))
+        self.assertFalse(self.device.id in self.manager.states)
+
+    def test_renew(self):
+        self.sync([subscription('SELECT * FROM CIM_AlertIndication'),
+                   subscription('SELECT * FROM CIM_InstCreation')])
+        del self.device.requests[:]
+
+        results = []
+        self.manager.renew([self.device]).addBoth(results.append)
+
+        self.assertEqual(results, [2])
+        self.assertEqual(self.device.requests,
+                         [('ModifyInstance', SUBSCRIPTION_CLASS)] * 2)
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestSubscriptionManager))
+    return suite
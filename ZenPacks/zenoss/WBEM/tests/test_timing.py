@@ -0,0 +1,66 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2017, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.WBEM.utils import addLocalLibPath
+addLocalLibPath()
+
+from pywbem.twisted_client import EnumerateInstances
+
+from ZenPacks.zenoss.WBEM.timing import TIMINGS, track_timings
+
+
+class TestTimings(BaseTestCase):
+
+    def afterSetUp(self):
+        TIMINGS.clear()
+
+    def test_durations(self):
+        factory = EnumerateInstances(('user', 'pass'), 'CIM_Foo')
+        factory.timings = {
+            'connect_start': 10.0,
+            'connected': 10.5,
+            'request_sent': 10.5,
+            'first_byte': 12.0,
+            'last_byte': 13.0,
+            }
+
+        durations = factory.durations()
+        self.assertEqual(durations['connect'], 0.5)
+        self.assertEqual(durations['wait'], 1.5)
+        self.assertEqual(durations['transfer'], 1.0)
+        self.assertEqual(durations['total'], 3.0)
+        self.assertFalse('parse' in durations)
+        self.assertEqual(factory.lastSpan(), 'last_byte')
+
+    def test_aggregation(self):
+        for outcome in ('success', 'success', 'timeout'):
+            factory = track_timings(
+                EnumerateInstances(('user', 'pass'), 'CIM_Foo'), 'dev1')
+            factory.timings = {'connect_start': 1.0, 'connected': 2.0}
+            factory.finishTiming(outcome)
+            factory.finishTiming('error')
+
+        stats = TIMINGS.get('dev1', 'CIM_Foo')
+        self.assertEqual(stats.count, 3)
+        self.assertEqual(stats.outcomes, {'success': 2, 'timeout': 1})
+        self.assertEqual(stats.average('connect'), 1.0)
+
+        summary = TIMINGS.summary('dev1', 'CIM_Foo')
+        self.assertTrue(summary.startswith('3 requests'))
+        self.assertTrue('last timeout after connected' in summary)
+        self.assertEqual(TIMINGS.summary('dev2', 'CIM_Foo'), '')
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestTimings))
+    return suite
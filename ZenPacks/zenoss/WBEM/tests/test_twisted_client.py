@@ -7,17 +7,29 @@
 #
 ##############################################################################
 
-from mock import Mock, sentinel
+from mock import Mock, patch, sentinel
 
 from xml.etree.ElementTree import fromstring, tostring
 
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
+
 from Products.ZenTestCase.BaseTestCase import BaseTestCase
 
 from ZenPacks.zenoss.WBEM.utils import addLocalLibPath
 addLocalLibPath()
 
-from pywbem.twisted_client import EnumerateInstances
-from pywbem.cim_obj import CIMInstance
+from pywbem.twisted_client import (
+    EnumerateInstances,
+    GetInstance,
+    InstanceFingerprints,
+    OpenEnumerateInstances,
+    RequestQueue,
+    WBEMClient,
+)
+from pywbem.cim_obj import CIMInstance, CIMInstanceName
+from pywbem.cql import compile_where
 
 class TestParseResponse(BaseTestCase):
     def test_parses(self):
@@ -61,9 +73,214 @@ class TestParseResponse(BaseTestCase):
         self.assertEqual(res[0].properties['OtherInterconnectType'].value, '')
 
 
+PULL_RESPONSE = '''<IMETHODRESPONSE NAME="OpenEnumerateInstances">
+<IRETURNVALUE>
+%s
+</IRETURNVALUE>
+<PARAMVALUE NAME="EndOfSequence"><VALUE>TRUE</VALUE></PARAMVALUE>
+<PARAMVALUE NAME="EnumerationContext"><VALUE>ctx</VALUE></PARAMVALUE>
+</IMETHODRESPONSE>'''
+
+PULL_INSTANCE = '''<VALUE.INSTANCEWITHPATH>
+<INSTANCEPATH><NAMESPACEPATH><HOST>localhost</HOST>
+<LOCALNAMESPACEPATH><NAMESPACE NAME="root"/></LOCALNAMESPACEPATH>
+</NAMESPACEPATH>
+<INSTANCENAME CLASSNAME="CIM_Foo">
+<KEYBINDING NAME="Name"><KEYVALUE VALUETYPE="string">%s</KEYVALUE></KEYBINDING>
+</INSTANCENAME></INSTANCEPATH>
+<INSTANCE CLASSNAME="CIM_Foo">
+<PROPERTY NAME="Name" TYPE="string"><VALUE>%s</VALUE></PROPERTY>
+<PROPERTY NAME="Size" TYPE="uint32"><VALUE>%s</VALUE></PROPERTY>
+</INSTANCE>
+</VALUE.INSTANCEWITHPATH>'''
+
+
+def parse_pull_response(sizes, **kwargs):
+    instances = ''.join(
+        PULL_INSTANCE % (name, name, size) for name, size in sizes)
+    factory = OpenEnumerateInstances(('user', 'pass'), 'CIM_Foo', **kwargs)
+    return factory.parseResponse(fromstring(PULL_RESPONSE % instances))
+
+
+class TestWhere(BaseTestCase):
+
+    def test_filtered(self):
+        where = compile_where(
+            "SELECT * FROM CIM_Foo WHERE Size > 1 AND Name IN ('a', 'c')")
+        res = parse_pull_response([('a', 1), ('b', 2), ('c', 3)], Where=where)
+        self.assertEqual([x['Name'] for x in res], ['c'])
+
+
+class TestInstanceFingerprints(BaseTestCase):
+
+    def parse(self, fingerprints, sizes):
+        return parse_pull_response(sizes, Fingerprints=fingerprints)
+
+    def test_unchanged_instances_skipped(self):
+        fingerprints = InstanceFingerprints()
+
+        fingerprints.begin()
+        res = self.parse(fingerprints, [('a', 1), ('b', 2)])
+        fingerprints.commit()
+        self.assertEqual(len(res), 2)
+
+        fingerprints.begin()
+        res = self.parse(fingerprints, [('a', 1), ('b', 3)])
+        fingerprints.commit()
+        self.assertEqual([x['Name'] for x in res], ['b'])
+        self.assertEqual(fingerprints.skipped, 1)
+
+        fingerprints.begin(full=True)
+        res = self.parse(fingerprints, [('a', 1), ('b', 3)])
+        self.assertEqual(len(res), 2)
+
+    def test_abort_keeps_previous_digests(self):
+        fingerprints = InstanceFingerprints()
+
+        fingerprints.begin()
+        self.parse(fingerprints, [('a', 1)])
+        fingerprints.commit()
+
+        fingerprints.begin()
+        self.parse(fingerprints, [('a', 2)])
+        fingerprints.abort()
+
+        fingerprints.begin()
+        res = self.parse(fingerprints, [('a', 2)])
+        self.assertEqual(len(res), 1)
+
+
+class TestWBEMClient(BaseTestCase):
+
+    def test_response_cancels_timeout(self):
+        client = WBEMClient()
+        client.factory = Mock()
+        client.handleResponsePart = Mock()
+        client.length = None
+
+        client.rawDataReceived('<CIM>')
+        self.assertTrue(client.factory.deferred_timeout.cancel.called)
+        client.handleResponsePart.assert_called_with('<CIM>')
+
+        client.factory.deferred_timeout.active.return_value = False
+        client.factory.deferred_timeout.cancel.reset_mock()
+        client.rawDataReceived('</CIM>')
+        self.assertFalse(client.factory.deferred_timeout.cancel.called)
+
+
+def get_instance_response(name, headers):
+    body = (
+        '<?xml version="1.0" encoding="utf-8" ?><CIM CIMVERSION="2.0" '
+        'DTDVERSION="2.0"><MESSAGE ID="1001" PROTOCOLVERSION="1.0">'
+        '<SIMPLERSP><IMETHODRESPONSE NAME="GetInstance"><IRETURNVALUE>'
+        '<INSTANCE CLASSNAME="CIM_Foo"><PROPERTY NAME="Name" TYPE="string">'
+        '<VALUE>%s</VALUE></PROPERTY></INSTANCE></IRETURNVALUE>'
+        '</IMETHODRESPONSE></SIMPLERSP></MESSAGE></CIM>' % name)
+    return '%s\r\nContent-Length: %d\r\n\r\n%s' % (
+        headers, len(body), body)
+
+
+class TestRequestQueue(BaseTestCase):
+
+    def afterSetUp(self):
+        self.factories = [
+            GetInstance(None, CIMInstanceName('CIM_Foo', {'Name': str(x)}))
+            for x in range(3)]
+        self.results = []
+        for factory in self.factories:
+            factory.deferred.addBoth(self.results.append)
+        self.queue = RequestQueue(self.factories)
+        self.connector = Mock()
+
+    def connect(self):
+        client = self.queue.buildProtocol(None)
+        transport = StringTransport()
+        transport.addr = ('10.0.0.1', 5988)
+        client.makeConnection(transport)
+        return client, transport
+
+    def lose(self, client):
+        reason = Failure(Exception('closed'))
+        client.connectionLost(reason)
+        self.queue.clientConnectionLost(self.connector, reason)
+
+    def test_keep_alive(self):
+        client, transport = self.connect()
+        self.assertIn('Connection: Keep-Alive', transport.value())
+        self.assertIn('>0</KEYVALUE>', transport.value())
+
+        transport.clear()
+        client.dataReceived(
+            get_instance_response('0', 'HTTP/1.1 200 OK'))
+        self.assertEqual(self.results[0]['Name'], '0')
+        self.assertIn('>1</KEYVALUE>', transport.value())
+        self.assertFalse(transport.disconnecting)
+
+        # A server keeping HTTP/1.0 connections alive says so.
+        transport.clear()
+        client.dataReceived(get_instance_response(
+            '1', 'HTTP/1.0 200 OK\r\nConnection: Keep-Alive'))
+        self.assertIn('>2</KEYVALUE>', transport.value())
+
+        client.dataReceived(get_instance_response(
+            '2', 'HTTP/1.1 200 OK\r\nConnection: close'))
+        self.assertEqual([x['Name'] for x in self.results], ['0', '1', '2'])
+        self.assertTrue(transport.disconnecting)
+
+        self.lose(client)
+        self.assertFalse(self.connector.connect.called)
+
+    def test_closed(self):
+        client, transport = self.connect()
+        client.dataReceived(get_instance_response('0', 'HTTP/1.0 200 OK'))
+        self.assertTrue(transport.disconnecting)
+
+        # The rest are sent over a new connection.
+        self.lose(client)
+        self.assertTrue(self.connector.connect.called)
+
+        client, transport = self.connect()
+        self.assertIn('>1</KEYVALUE>', transport.value())
+
+    def test_closed_before_answering(self):
+        client, transport = self.connect()
+        client.dataReceived(get_instance_response('0', 'HTTP/1.1 200 OK'))
+
+        # A reused connection closed by the server before it started
+        # answering doesn't fail the request.
+        self.lose(client)
+        self.assertEqual(len(self.results), 1)
+
+        client, transport = self.connect()
+        self.assertIn('>1</KEYVALUE>', transport.value())
+
+        # On a new connection it does.
+        clock = Clock()
+        with patch('pywbem.twisted_client.reactor', clock):
+            self.lose(client)
+        clock.advance(0)
+        self.assertEqual(len(self.results), 2)
+        self.results[1].trap(Exception)
+
+    def test_stop(self):
+        client, transport = self.connect()
+        self.queue.stop()
+        self.assertEqual(len(self.results), 3)
+        self.assertTrue(transport.disconnecting)
+
+        self.lose(client)
+        self.assertFalse(self.connector.connect.called)
+        for result in self.results:
+            result.trap(Exception)
+
+
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
     suite.addTest(makeSuite(TestParseResponse))
+    suite.addTest(makeSuite(TestWhere))
+    suite.addTest(makeSuite(TestInstanceFingerprints))
+    suite.addTest(makeSuite(TestWBEMClient))
+    suite.addTest(makeSuite(TestRequestQueue))
     return suite
 
@@ -7,11 +7,29 @@
 #
 ##############################################################################
 
-from mock import Mock, sentinel
+import logging
+
+from mock import Mock, patch, sentinel
+
+from twisted.internet import defer, task
 
 from Products.ZenTestCase.BaseTestCase import BaseTestCase
 
-from ZenPacks.zenoss.WBEM.modeler.wbem import WBEMPlugin
+from ZenPacks.zenoss.WBEM.modeler.wbem import (
+    IncrementalResults,
+    WBEMPlugin,
+    add_collector_timeout,
+)
+from ZenPacks.zenoss.WBEM.results import ResultsLimit
+
+log = logging.getLogger('zen.WBEM.tests')
+
+
+class IncrementalPlugin(WBEMPlugin):
+    incrementalProcess = True
+
+    def process_query(self, device, query, result, log):
+        return [(query[1], x) for x in result]
 
 
 class TestWBEMPlugin(BaseTestCase):
@@ -20,9 +38,102 @@ class TestWBEMPlugin(BaseTestCase):
         self.assertTrue(WBEMPlugin)
 
 
+class TestIncrementalProcess(BaseTestCase):
+
+    def afterSetUp(self):
+        super(TestIncrementalProcess, self).afterSetUp()
+        self.clock = task.Clock()
+        self.device = Mock(id='dev1', zCollectorClientTimeout=30)
+        self.plugin = IncrementalPlugin()
+
+    def collect(self, queries):
+        with patch('ZenPacks.zenoss.WBEM.modeler.wbem.reactor', self.clock):
+            d = self.plugin.collect_incremental(queries, self.device, log)
+
+        results = []
+        d.addCallback(results.append)
+        return results
+
+    def test_results_processed_as_they_arrive(self):
+        fast, slow = defer.Deferred(), defer.Deferred()
+        results = self.collect([(('root/cimv2', 'ec'), fast),
+                                (('root/cimv2:CIM_Foo', 'ei'), slow)])
+
+        fast.callback(['a', 'b'])
+        self.assertEqual(results, [])
+        self.assertEqual(fast.result, None)
+
+        slow.callback(['c'])
+        self.assertTrue(isinstance(results[0], IncrementalResults))
+        self.assertEqual(
+            self.plugin.process(self.device, results[0], log),
+            [('ec', 'a'), ('ec', 'b'), ('ei', 'c')])
+        self.assertEqual(results[0].failed, [])
+        self.assertFalse(self.clock.getDelayedCalls())
+
+    def test_timeout_keeps_completed_results(self):
+        fast, slow = defer.Deferred(), defer.Deferred()
+        results = self.collect([(('root/cimv2', 'ec'), fast),
+                                (('root/cimv2:CIM_Foo', 'ei'), slow)])
+
+        fast.callback(['a'])
+        self.clock.advance(30)
+
+        self.assertEqual(results[0].maps, [('ec', 'a')])
+        self.assertEqual(results[0].failed, [('root/cimv2:CIM_Foo', 'ei')])
+
+    def test_all_failed(self):
+        query = defer.Deferred()
+        results = self.collect([(('root/cimv2', 'ec'), query)])
+
+        self.clock.advance(30)
+        self.assertEqual(results[0][0], 'ERROR')
+
+
+class TestResultsLimit(BaseTestCase):
+
+    def afterSetUp(self):
+        super(TestResultsLimit, self).afterSetUp()
+        self.clock = task.Clock()
+        self.device = Mock(id='dev1', zCollectorClientTimeout=30)
+        self.queries = [defer.Deferred(), defer.Deferred()]
+        limit = ResultsLimit(2, 'TestPlugin')
+        for d in self.queries:
+            limit.watch(d)
+
+    def test_collect(self):
+        d = defer.DeferredList(self.queries, consumeErrors=True)
+        with patch('ZenPacks.zenoss.WBEM.modeler.wbem.reactor', self.clock):
+            add_collector_timeout(d, 30)
+        d.addCallback(WBEMPlugin().check_results, self.device, log)
+        results = []
+        d.addCallback(results.append)
+
+        # Reported as going over the limit, not as a timeout.
+        self.queries[0].callback(['a', 'b', 'c'])
+        self.assertEqual(results[0][0], 'ERROR')
+        self.assertTrue('more than the limit of 2' in results[0][1])
+        self.assertFalse(self.clock.getDelayedCalls())
+
+    def test_incremental(self):
+        with patch('ZenPacks.zenoss.WBEM.modeler.wbem.reactor', self.clock):
+            d = IncrementalPlugin().collect_incremental(
+                [(('root/cimv2', 'ec'), self.queries[0]),
+                 (('root/cimv2:CIM_Foo', 'ei'), self.queries[1])],
+                self.device, log)
+        results = []
+        d.addCallback(results.append)
+
+        self.queries[0].callback(['a', 'b', 'c'])
+        self.assertEqual(results[0][0], 'ERROR')
+        self.assertTrue('more than the limit of 2' in results[0][1])
+
+
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
     suite.addTest(makeSuite(TestWBEMPlugin))
+    suite.addTest(makeSuite(TestIncrementalProcess))
+    suite.addTest(makeSuite(TestResultsLimit))
     return suite
 
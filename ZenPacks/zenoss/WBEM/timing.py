@@ -0,0 +1,129 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2017, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""Per-request timing statistics for WBEM client factories.
+
+Each pywbem.twisted_client factory records when it started connecting,
+connected, sent its request, received the first and last response byte,
+finished parsing and finished running its callbacks.  The functions here
+log those timings as structured records and aggregate them per device and
+CIM class so collection events can carry a short summary.
+"""
+
+import logging
+log = logging.getLogger('zen.WBEM.timing')
+
+from ZenPacks.zenoss.WBEM.utils import addLocalLibPath
+addLocalLibPath()
+
+from pywbem.twisted_client import TIMING_PHASES
+
+
+class TimingStats(object):
+    """Aggregated request timings for a single device and class."""
+
+    def __init__(self):
+        self.count = 0
+        self.outcomes = {}
+        self.totals = {}
+        self.maximums = {}
+        self.last = None
+
+    def add(self, record):
+        self.count += 1
+        self.outcomes[record['outcome']] = \
+            self.outcomes.get(record['outcome'], 0) + 1
+
+        for phase, seconds in record['durations'].items():
+            self.totals[phase] = self.totals.get(phase, 0.0) + seconds
+            self.maximums[phase] = max(self.maximums.get(phase, 0.0), seconds)
+
+        self.last = record
+
+    def average(self, phase):
+        if not self.count or phase not in self.totals:
+            return None
+        return self.totals[phase] / self.count
+
+    def summary(self):
+        """Return a one-line description of the average phase times."""
+        phases = ['%s %.3fs' % (phase, self.average(phase))
+                  for phase in [x[0] for x in TIMING_PHASES] + ['total']
+                  if phase in self.totals]
+
+        outcomes = ', '.join('%d %s' % (n, outcome)
+                             for outcome, n in sorted(self.outcomes.items()))
+
+        text = '%d requests (%s)' % (self.count, outcomes)
+        if phases:
+            text += ', avg ' + ', '.join(phases)
+
+        if self.last and self.last['outcome'] != 'success':
+            text += ', last %s after %s' % (
+                self.last['outcome'], self.last['last_span'])
+
+        return text
+
+
+class TimingRegistry(object):
+    """Timing statistics keyed by (device, classname)."""
+
+    def __init__(self):
+        self.stats = {}
+
+    def record(self, device, classname, record):
+        key = (device, classname)
+        if key not in self.stats:
+            self.stats[key] = TimingStats()
+        self.stats[key].add(record)
+
+    def get(self, device, classname):
+        return self.stats.get((device, classname))
+
+    def summary(self, device, classname=None):
+        """Return a summary for one class, or every class on device."""
+        if classname is not None:
+            stats = self.get(device, classname)
+            return stats.summary() if stats else ''
+
+        return '; '.join(
+            '%s: %s' % (key[1], stats.summary())
+            for key, stats in sorted(self.stats.items())
+            if key[0] == device)
+
+    def clear(self, device=None):
+        if device is None:
+            self.stats.clear()
+            return
+
+        for key in [x for x in self.stats if x[0] == device]:
+            del self.stats[key]
+
+
+TIMINGS = TimingRegistry()
+
+
+def track_timings(factory, device, classname=None):
+    """Log and aggregate the timings of factory once its request is done."""
+    if classname is None:
+        classname = getattr(factory, 'classname', None) or factory.method
+
+    def observer(factory, record):
+        record = dict(record, device=device, classname=classname)
+
+        log.debug(
+            '%s %s %s %s: %s', device, record['method'], classname,
+            record['outcome'], record['durations'],
+            extra={'wbem_timing': record})
+
+        TIMINGS.record(device, classname, record)
+
+    factory.timing_observers.append(observer)
+
+    return factory
@@ -9,8 +9,9 @@
 
 import calendar
 
-from twisted.internet import ssl, reactor
+from twisted.internet import defer, ssl, reactor
 from twisted.internet.error import ConnectionRefusedError, TimeoutError
+from twisted.python import failure
 
 
 def addLocalLibPath():
@@ -26,7 +27,7 @@ def addLocalLibPath():
 def result_errmsg(result):
     """Return a useful error message string given a twisted errBack result."""
     try:
-        from pywbem.cim_operations import CIMError
+        from pywbem import CIMError
 
         if result.type == ConnectionRefusedError:
             return 'connection refused. Check IP and zWBEMPort'
@@ -47,6 +48,12 @@ def result_errmsg(result):
 
 def create_connection(config, wbemClass):
     """Create SSL or TCP connection to collect data for monitoring and modeling."""
+    from ZenPacks.zenoss.WBEM.timing import track_timings
+
+    # A RequestQueue sends several requests over one connection.
+    for factory in getattr(wbemClass, 'pending', None) or [wbemClass]:
+        track_timings(factory, getattr(config, 'device', None) or config.id)
+
     if config.zWBEMUseSSL is True:
         reactor.connectSSL(
             host=config.manageIp,
@@ -64,3 +71,30 @@ def convert_to_timestamp(object):
     """Convert value of CIMDateTime object to timestamp."""
     return calendar.timegm(object.datetime.utctimetuple())
 
+
+def add_timeout(factory, seconds):
+    """Return new Deferred that will errback TimeoutError after seconds."""
+    deferred_with_timeout = defer.Deferred()
+    deferred = factory.deferred
+
+    def fire_timeout():
+        factory.finishTiming('timeout')
+        deferred.cancel()
+        if not deferred_with_timeout.called:
+            deferred_with_timeout.errback(failure.Failure(TimeoutError()))
+
+    delayed_timeout = reactor.callLater(seconds, fire_timeout)
+    factory.deferred_timeout = delayed_timeout
+
+    def handle_result(result):
+        if delayed_timeout.active():
+            delayed_timeout.cancel()
+
+        if not deferred_with_timeout.called:
+            if isinstance(result, failure.Failure):
+                deferred_with_timeout.errback(result)
+            else:
+                deferred_with_timeout.callback(result)
+
+    deferred.addBoth(handle_result)
+    return deferred_with_timeout
@@ -38,7 +38,74 @@ applications.
 
 from cim_types import *
 from cim_constants import *
-from cim_operations import *
 from cim_obj import *
-from tupleparse import ParseError
+
+# The operations, HTTP and parsing submodules pull in socket, ssl, httplib
+# and ElementTree, which users of the CIM objects alone never need.  They
+# are imported on first use of one of their names instead.
+
+import sys
+from importlib import import_module
+from types import ModuleType
+
+_LAZY_SUBMODULES = ('cim_operations', 'cim_http', 'tupleparse', 'tupletree')
+
+# The names each lazy module provides, including those "from pywbem import
+# *" has always exported along with them.  Modules outside the package
+# are given by their full name.
+
+_LAZY_NAMES = {
+    'DEFAULT_NAMESPACE': 'cim_operations',
+    'ClassHierarchy': 'cim_operations',
+    'WBEMConnection': 'cim_operations',
+    'is_subclass': 'cim_operations',
+    'PegasusUDSConnection': 'cim_operations',
+    'SFCBUDSConnection': 'cim_operations',
+    'OpenWBEMUDSConnection': 'cim_operations',
+    'ElementTree': 'cim_operations',
+    'parse_cim': 'cim_operations',
+    'xml_to_tupletree': 'cim_operations',
+    'ele_to_tupletree': 'cim_operations',
+    'ParseError': 'tupleparse',
+    'xml': 'xml.dom.minidom',
+    'Document': 'xml.dom.minidom',
+    }
+
+class _LazyModule(ModuleType):
+    """The pywbem package, importing the submodules of _LAZY_NAMES and
+    _LAZY_SUBMODULES when one of their names is first looked up."""
+
+    def __getattr__(self, name):
+        if name in _LAZY_SUBMODULES:
+            return import_module('%s.%s' % (self.__name__, name))
+
+        modname = _LAZY_NAMES.get(name)
+        if modname is None:
+            raise AttributeError(name)
+
+        if modname in _LAZY_SUBMODULES:
+            module = getattr(self, modname)
+        else:
+            module = import_module(modname)
+
+        for x, y in _LAZY_NAMES.items():
+            if y == modname:
+                setattr(self, x, getattr(module, x))
+
+        return self.__dict__[name]
+
+def _install():
+    package = sys.modules[__name__]
+    module = _LazyModule(__name__, __doc__)
+    module.__dict__.update(package.__dict__)
+    module.__all__ = [x for x in package.__dict__ if not x.startswith('_')
+                      and x not in ('import_module', 'ModuleType')] + \
+                     list(_LAZY_SUBMODULES) + _LAZY_NAMES.keys()
+
+    # Python 2 clears the globals of a module when it is freed, and the
+    # methods of _LazyModule still use those of the package.
+    module._package = package
+    sys.modules[__name__] = module
+
+_install()
 
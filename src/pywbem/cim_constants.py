@@ -38,6 +38,15 @@ CIM_ERR_QUERY_LANGUAGE_NOT_SUPPORTED = 14 # Query language not supported
 CIM_ERR_INVALID_QUERY                = 15 # Query not valid
 CIM_ERR_METHOD_NOT_AVAILABLE         = 16 # Extrinsic method not executed
 CIM_ERR_METHOD_NOT_FOUND             = 17 # Extrinsic method does not exist
+CIM_ERR_INVALID_ENUMERATION_CONTEXT  = 21 # Enumeration context not valid
+
+# CIMError is defined here rather than in cim_operations so that catching
+# it doesn't import the HTTP and parsing modules.
+
+class CIMError(Exception):
+    """Raised when something bad happens.  The associated value is a
+    tuple of (error_code, description).  An error code of zero
+    indicates an XML parsing error in PyWBEM."""
 
 # Provider types
 
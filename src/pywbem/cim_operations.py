@@ -27,10 +27,12 @@ import sys, string
 from types import StringTypes
 from xml.etree import cElementTree as ElementTree
 import cim_obj, cim_xml, cim_http, cim_types
-from cim_obj import CIMClassName, CIMInstanceName, CIMInstance, CIMClass
+from cim_obj import CIMClassName, CIMInstanceName, CIMInstance, CIMClass, \
+     NocaseDict
 from datetime import datetime, timedelta
 from tupletree import ele_to_tupletree, xml_to_tupletree
 from tupleparse import parse_cim
+from cim_constants import CIMError
 
 """CIM-XML/HTTP operations.
 
@@ -50,10 +52,96 @@ def _check_classname(val):
         raise ValueError("string expected for classname, not %s" % `val`)
 
 
-class CIMError(Exception):
-    """Raised when something bad happens.  The associated value is a
-    tuple of (error_code, description).  An error code of zero
-    indicates an XML parsing error in PyWBEM."""
+class ClassHierarchy(object):
+    """Cache of the superclass of each class in a namespace.
+
+    Answers subclass checks and ancestor lists from memory instead of
+    issuing a GetClass call per ancestor.  Classes are added either in
+    bulk by load(), which issues a single EnumerateClasses call, or
+    lazily by fetching unknown classes through a CIMOM handle.  Call
+    invalidate() when the schema of the namespace changes."""
+
+    def __init__(self, namespace = None):
+        self.namespace = namespace
+        self.superclasses = NocaseDict()
+        self.loaded = False
+
+    def __len__(self):
+        return len(self.superclasses)
+
+    def add(self, klass):
+        """Record the superclass of a CIMClass."""
+        self.superclasses[klass.classname] = klass.superclass
+
+    def add_classes(self, classes):
+        for klass in classes:
+            self.add(klass)
+
+    def load(self, ch):
+        """Populate the cache with every class in the namespace."""
+
+        self.superclasses = NocaseDict()
+        self.add_classes(ch.EnumerateClasses(self.namespace,
+                                             DeepInheritance=True,
+                                             LocalOnly=True,
+                                             IncludeQualifiers=False,
+                                             IncludeClassOrigin=False))
+        self.loaded = True
+
+    def invalidate(self):
+        self.superclasses = NocaseDict()
+        self.loaded = False
+
+    def superclass(self, classname, ch = None):
+        """Return the name of the superclass of classname, or None for
+        a root class.  Unknown classes are fetched with ch.GetClass(),
+        or raise KeyError if ch is None."""
+
+        try:
+            return self.superclasses[classname]
+        except KeyError:
+            if ch is None:
+                raise
+
+        klass = ch.GetClass(classname,
+                            self.namespace,
+                            LocalOnly=True,
+                            IncludeQualifiers=False,
+                            PropertyList=[],
+                            IncludeClassOrigin=False)
+        self.add(klass)
+
+        return klass.superclass
+
+    def ancestors(self, classname, ch = None):
+        """Return the names of the superclasses of classname, nearest
+        first."""
+
+        result = []
+        superclass = self.superclass(classname, ch)
+
+        while superclass is not None:
+            result.append(superclass)
+            superclass = self.superclass(superclass, ch)
+
+        return result
+
+    def is_subclass(self, super, sub, ch = None):
+        """Return True if sub is super or one of its subclasses."""
+
+        lsuper = super.lower()
+
+        if sub.lower() == lsuper:
+            return True
+
+        superclass = self.superclass(sub, ch)
+
+        while superclass is not None:
+            if superclass.lower() == lsuper:
+                return True
+            superclass = self.superclass(superclass, ch)
+
+        return False
 
 class WBEMConnection(object):
     """Class representing a client's connection to a WBEM server.
@@ -102,6 +190,7 @@ class WBEMConnection(object):
         self.last_request = self.last_reply = ''
         self.default_namespace = default_namespace
         self.debug = False
+        self.class_hierarchies = {}
 
     def __repr__(self):
         if self.creds is None:
@@ -111,6 +200,35 @@ class WBEMConnection(object):
         return "%s(%s, %s, namespace=%s)" % (self.__class__.__name__, `self.url`,
                                              user, `self.default_namespace`)
 
+    def class_hierarchy(self, namespace = None, load = False):
+        """Return the ClassHierarchy cached for a namespace.  If load is
+        true and the cache is not populated yet, fetch every class in
+        the namespace with a single EnumerateClasses call."""
+
+        if namespace is None:
+            namespace = self.default_namespace
+
+        key = namespace.strip('/').lower()
+
+        if key not in self.class_hierarchies:
+            self.class_hierarchies[key] = ClassHierarchy(namespace)
+
+        hierarchy = self.class_hierarchies[key]
+
+        if load and not hierarchy.loaded:
+            hierarchy.load(self)
+
+        return hierarchy
+
+    def invalidate_class_hierarchy(self, namespace = None):
+        """Forget cached class relationships for a namespace, or for
+        every namespace if none is given."""
+
+        if namespace is None:
+            self.class_hierarchies.clear()
+        else:
+            self.class_hierarchies.pop(namespace.strip('/').lower(), None)
+
     def imethodcall(self, methodname, namespace, **params):
         """Make an intrinsic method call.
 
@@ -610,6 +728,8 @@ class WBEMConnection(object):
             ClassName = CIMClassName(ClassName),
             **params)            
 
+        self.invalidate_class_hierarchy(namespace)
+
     def ModifyClass(self, ModifiedClass, namespace = None, **params):
         """Modify a CIM class."""
 
@@ -624,6 +744,8 @@ class WBEMConnection(object):
             ModifiedClass = ModifiedClass,
             **params)
 
+        self.invalidate_class_hierarchy(namespace)
+
     def CreateClass(self, NewClass, namespace = None, **params):
         """Create a CIM class."""
 
@@ -638,6 +760,8 @@ class WBEMConnection(object):
             NewClass = NewClass,
             **params)
 
+        self.invalidate_class_hierarchy(namespace)
+
     #
     # Association provider API
     # 
@@ -900,6 +1024,9 @@ def is_subclass(ch, ns, super, sub):
     super -- A string containing the super class name.
     sub -- The subclass.  This can either be a string or a pywbem.CIMClass.
 
+    If ch keeps a ClassHierarchy cache (as WBEMConnection does), the
+    answer comes from the cache and only unknown classes are fetched.
+
     """
 
     lsuper = super.lower()
@@ -911,6 +1038,11 @@ def is_subclass(ch, ns, super, sub):
         subclass = None
     if subname.lower() == lsuper:
         return True
+    if hasattr(ch, 'class_hierarchy'):
+        hierarchy = ch.class_hierarchy(ns)
+        if subclass is not None:
+            hierarchy.add(subclass)
+        return hierarchy.is_subclass(super, subname, ch)
     if subclass is None:
         subclass = ch.GetClass(subname,
                                ns,
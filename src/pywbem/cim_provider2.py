@@ -224,6 +224,35 @@ def _paths_equal(lhs, rhs):
                 pywbem.cmpname(rhs.namespace, lhs.namespace))
 
 
+def _batches(gen, model, batch_size):
+    """Group the instances generated by gen into lists of at most
+    batch_size instances.
+
+    Providers commonly yield the model itself, setting new values on it
+    before yielding it again.  The model is copied only when gen is
+    resumed while it is held in a batch that hasn't been yielded yet, so
+    that it isn't overwritten.  With a batch_size of 1 nothing is copied.
+
+    """
+
+    batch = []
+    for inst in gen:
+        batch.append(inst)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+        elif inst is model:
+            batch[-1] = inst.copy()
+    if batch:
+        yield batch
+
+
+def _flatten(batches):
+    for batch in batches:
+        for inst in batch:
+            yield inst
+
+
 class CIMProvider2(object):
     """Base class for CIM Providers.  
 
@@ -277,8 +306,17 @@ class CIMProvider2(object):
     described above.  These will not normally be overridden or extended 
     by a subclass. 
 
+    Instances are requested from enum_instances_batch in lists of
+    batch_size instances.  A provider backed by a database or a file can
+    override it to fetch instances in bulk.  The next batch is not 
+    requested until the CIMOM has consumed the previous one.  Likewise,
+    MI_associators resolves associated objects with get_instances_batch,
+    up to batch_size names of one class at a time. 
+
     """
 
+    batch_size = 100
+
     def get_instance (self, env, model):
         """Return an instance.
 
@@ -327,6 +365,76 @@ class CIMProvider2(object):
         """
         pass
 
+    def enum_instances_batch(self, env, model, keys_only, batch_size):
+        """Enumerate instances in batches.
+
+        The WBEM operations EnumerateInstances and EnumerateInstanceNames
+        are both mapped to this method.  
+        This method is a python generator yielding lists of instances. 
+
+        The default implementation groups the instances generated by 
+        enum_instances.  Override it to fetch many instances at once from
+        the underlying resource.  Each yielded list must hold its own
+        instances, rather than the model or other objects reused for
+        later instances. 
+
+        Keyword arguments:
+        env -- Provider Environment (pycimmb.ProviderEnvironment)
+        model -- A template of the pywbem.CIMInstances to be generated, 
+            as passed to enum_instances. 
+        keys_only -- A boolean.  True if only the key properties should be
+            set on the generated instances.
+        batch_size -- The preferred number of instances per list. 
+
+        Possible Errors:
+        CIM_ERR_FAILED (some other unspecified error occurred)
+
+        """
+        gen = self.enum_instances(env=env, model=model, keys_only=keys_only)
+        if gen is None:
+            return iter(())
+        return _batches(gen, model, batch_size)
+
+    def get_instances_batch(self, env, instance_names, property_list):
+        """Return the instances named by a list of instance names.
+
+        The WBEM operation Associators is mapped to this method, which
+        is called with the names of associated objects of one class. 
+
+        The default implementation calls GetInstance on the CIMOM handle
+        for each name.  Override it to fetch many instances at once, for
+        example with a single query or from the underlying resource of
+        this provider's own classes. 
+
+        Keyword arguments:
+        env -- Provider Environment (pycimmb.ProviderEnvironment)
+        instance_names -- A list of pywbem.CIMInstanceName objects of 
+            the same class and namespace. 
+        property_list -- A list of the property names to return, or None
+            for all of them. 
+
+        Return a list of pywbem.CIMInstance objects.  Names of objects
+        that don't exist are left out.
+
+        Possible Errors:
+        CIM_ERR_FAILED (some other unspecified error occurred)
+
+        """
+        ch = env.get_cimom_handle()
+        instances = []
+        for instance_name in instance_names:
+            try:
+                inst = ch.GetInstance(instance_name, property_list)
+            except pywbem.CIMError, (num, msg):
+                if num == pywbem.CIM_ERR_NOT_FOUND:
+                    continue
+                else:
+                    raise
+            if inst.path is None:
+                inst.path = instance_name
+            instances.append(inst)
+        return instances
+
     def set_instance(self, env, instance, modify_existing):
         """Return a newly created or modified instance.
 
@@ -443,7 +551,8 @@ class CIMProvider2(object):
     def simple_refs(self, env, object_name, model, 
                    result_class_name, role, result_role, keys_only):
 
-        gen = self.enum_instances(env, model, keys_only)
+        gen = _flatten(self.enum_instances_batch(env, model, keys_only,
+                                                 self.batch_size))
         for inst in gen:
             for prop in inst.properties.values():
                 if prop.type != 'reference':
@@ -485,17 +594,19 @@ class CIMProvider2(object):
         logger.log_debug('CIMProvider2 MI_enumInstanceNames called...')
         model = pywbem.CIMInstance(classname=objPath.classname, 
                                    path=objPath)
-        gen = self.enum_instances(env=env,
-                                       model=model,
-                                       keys_only=True)
+        batches = self.enum_instances_batch(env=env,
+                                            model=model,
+                                            keys_only=True,
+                                            batch_size=self.batch_size)
         try:
-            iter(gen)
+            iter(batches)
         except TypeError:
             logger.log_debug('CIMProvider2 MI_enumInstanceNames returning')
             return
 
-        for inst in gen:
-            yield inst.path
+        for batch in batches:
+            for inst in batch:
+                yield inst.path
         logger.log_debug('CIMProvider2 MI_enumInstanceNames returning')
     
     def MI_enumInstances(self, 
@@ -514,15 +625,16 @@ class CIMProvider2(object):
 
         model = pywbem.CIMInstance(classname=objPath.classname,
                                    path=objPath)
-        gen = self.enum_instances(env=env,
-                                       model=model,
-                                       keys_only=False)
+        batches = self.enum_instances_batch(env=env,
+                                            model=model,
+                                            keys_only=False,
+                                            batch_size=self.batch_size)
         try:
-            iter(gen)
+            iter(batches)
         except TypeError:
             logger.log_debug('CIMProvider2 MI_enumInstances returning')
             return
-        return gen
+        return _flatten(batches)
 
     def MI_getInstance(self, 
                        env, 
@@ -647,7 +759,6 @@ class CIMProvider2(object):
         if not assocClassName:
             raise pywbem.CIMError(pywbem.CIM_ERR_FAILED, 
                     "Empty assocClassName passed to Associators")
-        ch = env.get_cimom_handle()
         model = pywbem.CIMInstance(classname=assocClassName)
         model.path = pywbem.CIMInstanceName(classname=assocClassName, 
                                             namespace=objectName.namespace)
@@ -661,6 +772,10 @@ class CIMProvider2(object):
         if gen is None:
             logger.log_debug('references() returned None instead of generator object')
             return
+
+        # Names of associated objects, grouped by class and namespace, 
+        # and resolved batch_size at a time. 
+        pending = {}
         for inst in gen:
             for prop in inst.properties.values():
                 lpname = prop.name.lower()
@@ -675,18 +790,20 @@ class CIMProvider2(object):
                 if resultClassName and \
                         resultClassName.lower() != prop.value.classname.lower():
                     continue
-                try:
-                    if prop.value.namespace is None:
-                        prop.value.namespace = objectName.namespace
-                    inst = ch.GetInstance(prop.value, propertyList)
-                except pywbem.CIMError, (num, msg):
-                    if num == pywbem.CIM_ERR_NOT_FOUND:
-                        continue
-                    else:
-                        raise
-                if inst.path is None:
-                    inst.path = prop.value
-                yield inst
+                if prop.value.namespace is None:
+                    prop.value.namespace = objectName.namespace
+                key = (prop.value.classname.lower(), 
+                       prop.value.namespace.lower())
+                names = pending.setdefault(key, [])
+                names.append(prop.value)
+                if len(names) >= self.batch_size:
+                    del pending[key]
+                    for assoc in self.get_instances_batch(env, names, 
+                                                          propertyList):
+                        yield assoc
+        for names in pending.values():
+            for assoc in self.get_instances_batch(env, names, propertyList):
+                yield assoc
         logger.log_debug('CIMProvider2 MI_associators returning')
 
     def MI_associatorNames(self, 
@@ -1256,6 +1373,8 @@ class %(classname)s(CIMProvider2):
         ''' % format_desc('th.update('+str(keydict)+')', 12).strip()
 
     code+= '''
+        # If the resource can return many instances at once, override 
+        # enum_instances_batch instead of calling get_instance per model.
         while False: # TODO more instances?
             # TODO fetch system resource
             # Key properties''' 
@@ -1657,30 +1776,40 @@ instance of PG_ProviderCapabilities
     return code, mof
 
 class ProviderProxy(object):
-    """Wraps a provider module, and routes requests into the module """
+    """Wraps a provider module, and routes requests into the module 
+
+    A provider module given by file name is not imported until the first
+    request for it, and is reloaded when the file's modification time 
+    changes.  The callables found for each CIM class name and operation
+    are cached until the module is reloaded. 
+
+    """
 
     def __init__ (self, env, provid):
         self.env = env
+        self.provregs = {}
+        self.callables = {}
         if isinstance(provid, types.ModuleType):
             self.provmod = provid
             self.provid = provid.__name__
+            self.provider_module_name = None
             self.filename = provid.__file__
+            self._init_provider(env)
         else:
-            logger = env.get_logger()
-            logger.log_debug('Loading python provider at %s' %provid)
+            self.provmod = None
             self.provid = provid
-            self._load_provider_source()
-        self._init_provider(env)
+            self.provider_module_name = os.path.basename(self.provid)[:-3]
+            self.filename = provid
 
     def _init_provider (self, env):
         self.provregs = {}
+        self.callables = {}
         if hasattr(self.provmod, 'init'):
             self.provmod.init(env)
         if hasattr(self.provmod, 'get_providers'):
             self.provregs = pywbem.NocaseDict(self.provmod.get_providers(env))
 
     def _load_provider_source (self):
-        self.provider_module_name = os.path.basename(self.provid)[:-3]
         # let providers import other providers in the same directory
         provdir = dirname(self.provid)
         if provdir not in sys.path:
@@ -1718,6 +1847,12 @@ class ProviderProxy(object):
 
         """
 
+        key = (classname.lower(), cname)
+        try:
+            return self.callables[key]
+        except KeyError:
+            pass
+
         callable = None
         if classname in self.provregs:
             provClass = self.provregs[classname]
@@ -1730,18 +1865,32 @@ class ProviderProxy(object):
                     "No provider registered for %s or no callable for %s:%s on provider %s"%(classname, classname,
                                                             cname, 
                                                             self.provid))
+        self.callables[key] = callable
         return callable
 
     def _reload_if_necessary (self, env):
-        """Check timestamp of loaded python provider module, and if it has
+        """Load the python provider module on first use.  Afterwards check
+        timestamp of loaded python provider module, and if it has
         changed since load, then reload the provider module.
         """
+        if self.provider_module_name is None:
+            # the provider module was passed in; there is no source to load
+            return
+
+        if self.provmod is None:
+            logger = env.get_logger()
+            logger.log_debug('Loading python provider at %s' % self.provid)
+            self._load_provider_source()
+            self._init_provider(env)
+            return
+
         try:
             mod = sys.modules[self.provider_module_name]
         except KeyError:
             mod = None
         if (mod is None or \
-                mod.provmod_timestamp != os.path.getmtime(self.provid)):
+                getattr(mod, 'provmod_timestamp', None) != \
+                    os.path.getmtime(self.provid)):
             print "Need to reload provider at %s" %self.provid
 
             #first unload the module
@@ -1757,7 +1906,7 @@ class ProviderProxy(object):
                 self._init_provider(env)
             except IOError, arg:
                 raise pywbem.CIMError(pywbem.CIM_ERR_FAILED, 
-                        "Error loading provider %s: %s" % (provid, arg))
+                        "Error loading provider %s: %s" % (self.provid, arg))
 
 
 ##############################################################################
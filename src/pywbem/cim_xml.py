@@ -37,9 +37,10 @@ constructors take builtin Python types, or other cim_xml classes where
 child elements are required.
 
 Every class is a subclass of the Element class and so shares the same
-attributes and methods, and can be used with the built-in Python XML
-handling routines.  In particular you can call the toxml() and
-toprettyxml() methods to generate XML.
+attributes and methods.  Element implements the part of the
+xml.dom.minidom.Element interface needed to build and serialize a
+document.  In particular you can call the toxml() and toprettyxml()
+methods to generate XML, with the same output minidom would give.
 
 Note that converting using toprettyxml() inserts whitespace which may
 corrupt the data in the XML (!!) so you should only do this when
@@ -48,20 +49,194 @@ always passes through all non-markup whitespace.
 
 """
 
-import sys, xml.dom.minidom
-from xml.dom.minidom import Document, Element
+import sys
+
+# Node types, with the values used by xml.dom.
+
+ELEMENT_NODE = 1
+TEXT_NODE = 3
+
+# Not a DOM node type: markup serialized by other means, written out as
+# it is.
+
+MARKUP_NODE = -1
+
+def _escape(data):
+    """Escape character data or an attribute value exactly as
+    xml.dom.minidom does."""
+
+    return data.replace('&', '&amp;').replace('<', '&lt;'). \
+           replace('"', '&quot;').replace('>', '&gt;')
+
+class TextNode(object):
+    """Character data inside an element."""
+
+    nodeType = TEXT_NODE
+
+    def __init__(self, data):
+        self.data = data
+
+    def writexml(self, writer, indent = '', addindent = '', newl = ''):
+        data = '%s%s%s' % (indent, self.data, newl)
+        if data:
+            writer.write(_escape(data))
 
 def Text(data):
-    """Grr.  The API for the minidom text node function has changed in
-    Python 2.3.  This function allows the code to run under older
-    versions of the intepreter."""
-    
-    if sys.version_info[0] == 2 and sys.version_info[1] >= 3:
-        t = xml.dom.minidom.Text()
-        t.data = data
-        return t
-    
-    return xml.dom.minidom.Text(data)
+    """Return a text node holding data."""
+
+    return TextNode(data)
+
+class Markup(object):
+    """XML already serialized, such as by instancexml, written out
+    unescaped."""
+
+    nodeType = MARKUP_NODE
+
+    def __init__(self, data):
+        self.data = data
+
+    def writexml(self, writer, indent = '', addindent = '', newl = ''):
+        writer.write('%s%s%s' % (indent, self.data, newl))
+
+class _ListWriter(list):
+    """File-like object collecting written strings in a list."""
+
+    write = list.append
+
+    def getvalue(self):
+        return ''.join(self)
+
+class Element(object):
+    """A lightweight replacement for xml.dom.minidom.Element.
+
+    Building a request used to create a DOM node, an attribute map and
+    an Attr node per attribute, all linked to an owner document, only to
+    walk them once to produce a string.  Elements here just hold their
+    tag, attributes and children, and serialize straight into a list
+    buffer.  The output is identical to minidom's toxml() and
+    toprettyxml()."""
+
+    nodeType = ELEMENT_NODE
+
+    def __init__(self, tagName):
+        self.tagName = tagName
+        self.attributes = {}
+        self.childNodes = []
+
+    @property
+    def nodeName(self):
+        return self.tagName
+
+    def setAttribute(self, name, value):
+        self.attributes[name] = value
+
+    def getAttribute(self, name):
+        return self.attributes.get(name, '')
+
+    def hasAttribute(self, name):
+        return name in self.attributes
+
+    def appendChild(self, node):
+        self.childNodes.append(node)
+        return node
+
+    def writexml(self, writer, indent = '', addindent = '', newl = ''):
+        """Write the element to writer, indenting as minidom does."""
+
+        writer.write(indent + '<' + self.tagName)
+
+        attributes = self.attributes
+        for name in sorted(attributes):
+            writer.write(' %s="' % name)
+            value = attributes[name]
+            if value:
+                writer.write(_escape(value))
+            writer.write('"')
+
+        children = self.childNodes
+
+        if not children:
+            writer.write('/>%s' % newl)
+            return
+
+        writer.write('>')
+
+        if len(children) == 1 and children[0].nodeType == TEXT_NODE:
+            children[0].writexml(writer)
+        else:
+            writer.write(newl)
+            for child in children:
+                child.writexml(writer, indent + addindent, addindent, newl)
+            writer.write(indent)
+
+        writer.write('</%s>%s' % (self.tagName, newl))
+
+    def serialize(self, write):
+        """Pass the compact XML for the element to write, piece by
+        piece, without recursion."""
+
+        stack = [self]
+        pop = stack.pop
+        push = stack.append
+
+        while stack:
+            node = pop()
+
+            if node.__class__ is str:
+                write(node)
+                continue
+
+            if node.nodeType == TEXT_NODE:
+                data = '%s' % (node.data,)
+                if data:
+                    write(_escape(data))
+                continue
+
+            if node.nodeType == MARKUP_NODE:
+                write(node.data)
+                continue
+
+            write('<' + node.tagName)
+
+            attributes = node.attributes
+            for name in sorted(attributes):
+                value = attributes[name]
+                if value:
+                    write(' %s="%s"' % (name, _escape(value)))
+                else:
+                    write(' %s=""' % name)
+
+            children = node.childNodes
+
+            if not children:
+                write('/>')
+                continue
+
+            write('>')
+            push('</%s>' % node.tagName)
+
+            for child in reversed(children):
+                push(child)
+
+    def toxml(self, encoding = None):
+        buf = []
+        self.serialize(buf.append)
+        xml = ''.join(buf)
+
+        if encoding is not None:
+            return xml.encode(encoding)
+
+        return xml
+
+    def toprettyxml(self, indent = '\t', newl = '\n', encoding = None):
+        writer = _ListWriter()
+        self.writexml(writer, '', indent, newl)
+        xml = writer.getvalue()
+
+        if encoding is not None:
+            return xml.encode(encoding)
+
+        return xml
 
 class CIMElement(Element):
     """A base class that has a few bonus helper methods."""
@@ -82,7 +257,7 @@ class CIMElement(Element):
 
     def appendChildren(self, children):
         """Append a list or tuple of children."""
-        [self.appendChild(child) for child in children]
+        self.childNodes.extend(children)
 
 # Root element
 
@@ -370,6 +545,21 @@ class VALUE_OBJECTWITHPATH(CIMElement):
         self.appendChild(data1)
         self.appendChild(data2)
 
+class VALUE_INSTANCEWITHPATH(CIMElement):
+    """
+    The VALUE.INSTANCEWITHPATH element is used to define a value that
+    comprises a single CIM Instance definition with additional
+    information that defines the absolute path to that Instance.  It is
+    returned by the pulled enumeration operations.
+
+    <!ELEMENT VALUE.INSTANCEWITHPATH (INSTANCEPATH, INSTANCE)>
+    """
+
+    def __init__(self, instancepath, instance):
+        Element.__init__(self, 'VALUE.INSTANCEWITHPATH')
+        self.appendChild(instancepath)
+        self.appendChild(instance)
+
 class VALUE_NULL(CIMElement):
     """
     The VALUE.NULL element is used to represent a TABLECELL that has
@@ -0,0 +1,476 @@
+#
+# (C) Copyright 2017 Zenoss, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""
+cql - Evaluate CQL WHERE clauses on the client.
+
+Many providers ignore or reject the WHERE clause of an ExecQuery
+request.  compile_where() turns the clause into a predicate that can be
+applied to CIMInstance objects after parsing, or to the INSTANCE element
+of a response before the instance is built, so rejected instances cost
+no more than a few attribute lookups.
+
+The supported subset is:
+
+  condition [AND|OR condition ...], NOT condition, ( condition )
+  property =|<>|!=|<|<=|>|>= literal
+  property [NOT] IN (literal, ...)
+  property [NOT] LIKE 'pattern'     (% and _ wildcards)
+  property IS [NOT] NULL
+
+Literals are single quoted strings, integers, reals, TRUE, FALSE and
+NULL.  Property names may be qualified with a class name.  A comparison
+against an array property is true if any element satisfies it.  Quoted
+literals compared with numeric, boolean or datetime properties are
+converted to the property's type.  A comparison between values that
+can't be converted to the same type is unknown.
+
+A condition on a property missing from the instance, as when the query
+selects only some properties, is unknown.  NOT leaves it unknown, AND
+and OR combine it as in SQL, and an instance whose clause is unknown
+is accepted since there is nothing to reject it on.
+"""
+
+import re
+
+from cim_obj import tocimobj
+from cim_types import CIMDateTime
+
+class CQLError(Exception):
+    """Raised when a WHERE clause cannot be compiled."""
+    pass
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+      (?P<string>'(?:[^']|'')*')
+    | (?P<number>[-+]?\d+\.\d*(?:[eE][-+]?\d+)?|[-+]?\d+(?:[eE][-+]?\d+)?)
+    | (?P<op><>|!=|<=|>=|=|<|>)
+    | (?P<punct>[(),])
+    | (?P<ident>[A-Za-z_][\w]*(?:\.[A-Za-z_][\w]*)?)
+    )""", re.VERBOSE)
+
+_WHERE = re.compile(r'\bwhere\b(.*)$', re.I | re.S)
+
+_KEYWORDS = ('AND', 'OR', 'NOT', 'IN', 'LIKE', 'IS', 'NULL', 'TRUE', 'FALSE')
+
+# Marker for a property missing from an instance, as opposed to one
+# present with a NULL value.
+
+_MISSING = object()
+
+def tokenize(text):
+    """Return a list of (kind, value) tuples for a WHERE clause."""
+
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+
+    while pos < len(text):
+        m = _TOKEN.match(text, pos)
+        if m is None or m.end() == pos:
+            raise CQLError('Unexpected text at "%s"' % text[pos:pos + 20])
+        pos = m.end()
+
+        kind = m.lastgroup
+        value = m.group(kind)
+
+        if kind == 'string':
+            value = value[1:-1].replace("''", "'")
+        elif kind == 'number':
+            if '.' in value or 'e' in value or 'E' in value:
+                value = float(value)
+            else:
+                value = long(value)
+        elif kind == 'ident' and value.upper() in _KEYWORDS:
+            kind, value = 'keyword', value.upper()
+        elif kind == 'ident':
+            value = value.split('.')[-1]
+
+        tokens.append((kind, value))
+
+    return tokens
+
+def _number(text, _type):
+    """Convert text to _type, or to a float if it isn't integral.
+    Return text unchanged if it isn't a number."""
+
+    try:
+        return _type(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return text
+
+def _coerce(value, literal):
+    """Return value and literal converted so that they can be compared,
+    or None if their types can't be.  A quoted literal takes the type of
+    a numeric, boolean or datetime value, and a string value takes the
+    type of a numeric or boolean literal."""
+
+    if isinstance(literal, basestring):
+        if isinstance(value, bool):
+            return value, literal.lower() == 'true'
+        if isinstance(value, float):
+            literal = _number(literal, float)
+        elif isinstance(value, (int, long)):
+            literal = _number(literal, long)
+        elif isinstance(value, CIMDateTime):
+            try:
+                literal = CIMDateTime(literal)
+            except ValueError:
+                return None
+            if literal.is_interval != value.is_interval:
+                return None
+            return value, literal
+        elif not isinstance(value, basestring):
+            return None
+        if isinstance(literal, basestring) and \
+           not isinstance(value, basestring):
+            return None
+        return value, literal
+
+    if isinstance(literal, bool):
+        if isinstance(value, basestring):
+            return value.lower() == 'true', literal
+        if isinstance(value, (int, long, float)):
+            return bool(value), literal
+        return None
+
+    if isinstance(literal, (int, long, float)):
+        if isinstance(value, basestring):
+            value = _number(value, type(literal))
+            if isinstance(value, basestring):
+                return None
+        elif not isinstance(value, (int, long, float)):
+            return None
+
+    return value, literal
+
+def _like_regex(pattern):
+    parts = []
+    for c in pattern:
+        if c == '%':
+            parts.append('.*')
+        elif c == '_':
+            parts.append('.')
+        else:
+            parts.append(re.escape(c))
+    return re.compile(''.join(parts) + '$', re.S)
+
+_COMPARE = {
+    '=': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    }
+
+def _any(results):
+    """Combine results as OR does: True if any is, else None if any is
+    unknown, else False."""
+
+    result = False
+    for value in results:
+        if value:
+            return True
+        if value is None:
+            result = None
+    return result
+
+def _test(name, check):
+    """Return a predicate applying check to a property value.  Array
+    values match if any element does.  The predicate returns None, for
+    unknown, if the property is missing."""
+
+    def predicate(values):
+        value = values.get(name, _MISSING)
+        if value is _MISSING:
+            return None
+        if isinstance(value, list):
+            return _any(check(x) for x in value)
+        return check(value)
+
+    return predicate
+
+class _Parser(object):
+    """Recursive descent parser that builds nested closures."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+        self.properties = set()
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def accept(self, kind, value=None):
+        token = self.peek()
+        if token[0] == kind and (value is None or token[1] == value):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, kind, value=None):
+        if not self.accept(kind, value):
+            raise CQLError('Expecting %s, got %r' %
+                           (value or kind, self.peek()[1]))
+
+    def parse(self):
+        predicate = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise CQLError('Unexpected %r' % (self.peek()[1],))
+        return predicate
+
+    def parse_or(self):
+        terms = [self.parse_and()]
+        while self.accept('keyword', 'OR'):
+            terms.append(self.parse_and())
+        if len(terms) == 1:
+            return terms[0]
+
+        def predicate(values):
+            return _any(term(values) for term in terms)
+
+        return predicate
+
+    def parse_and(self):
+        terms = [self.parse_not()]
+        while self.accept('keyword', 'AND'):
+            terms.append(self.parse_not())
+        if len(terms) == 1:
+            return terms[0]
+
+        def predicate(values):
+            result = True
+            for term in terms:
+                value = term(values)
+                if value is None:
+                    result = None
+                elif not value:
+                    return False
+            return result
+
+        return predicate
+
+    def parse_not(self):
+        if self.accept('keyword', 'NOT'):
+            term = self.parse_not()
+
+            def predicate(values):
+                value = term(values)
+                if value is None:
+                    return None
+                return not value
+
+            return predicate
+        if self.accept('punct', '('):
+            term = self.parse_or()
+            self.expect('punct', ')')
+            return term
+        return self.parse_comparison()
+
+    def parse_literal(self):
+        kind, value = self.next()
+        if kind in ('string', 'number'):
+            return value
+        if kind == 'keyword' and value in ('TRUE', 'FALSE'):
+            return value == 'TRUE'
+        if kind == 'keyword' and value == 'NULL':
+            return None
+        raise CQLError('Expecting a literal, got %r' % (value,))
+
+    def parse_comparison(self):
+        kind, name = self.next()
+        if kind != 'ident':
+            raise CQLError('Expecting a property name, got %r' % (name,))
+        self.properties.add(name)
+
+        negate = False
+
+        if self.accept('keyword', 'IS'):
+            negate = self.accept('keyword', 'NOT')
+            self.expect('keyword', 'NULL')
+
+            def predicate(values):
+                value = values.get(name, _MISSING)
+                if value is _MISSING:
+                    return None
+                return (value is None) != negate
+
+            return predicate
+
+        if self.accept('keyword', 'NOT'):
+            negate = True
+            if self.peek() not in (('keyword', 'IN'), ('keyword', 'LIKE')):
+                raise CQLError('Expecting IN or LIKE after NOT')
+
+        if self.accept('keyword', 'IN'):
+            self.expect('punct', '(')
+            literals = [self.parse_literal()]
+            while self.accept('punct', ','):
+                literals.append(self.parse_literal())
+            self.expect('punct', ')')
+
+            def check(value):
+                if value is None:
+                    return False
+                result = _any(pair and pair[0] == pair[1] for pair in
+                              (_coerce(value, x) for x in literals))
+                if result is None:
+                    return None
+                return result != negate
+
+            return _test(name, check)
+
+        if self.accept('keyword', 'LIKE'):
+            regex = _like_regex(self.parse_literal() or '')
+
+            def check(value):
+                if value is None:
+                    return False
+                return (regex.match(unicode(value)) is not None) != negate
+
+            return _test(name, check)
+
+        kind, op = self.next()
+        if kind != 'op':
+            raise CQLError('Expecting a comparison operator, got %r' % (op,))
+
+        literal = self.parse_literal()
+        compare = _COMPARE[op]
+
+        def check(value):
+            if value is None or literal is None:
+                return False
+            pair = _coerce(value, literal)
+            if pair is None:
+                return None
+            return compare(*pair)
+
+        return _test(name, check)
+
+class CQLPredicate(object):
+    """A compiled WHERE clause.
+
+    The predicate can be called with a CIMInstance or a dictionary of
+    property values, or matched against an ElementTree INSTANCE element
+    with match_element()."""
+
+    def __init__(self, where):
+        self.where = where
+        parser = _Parser(tokenize(where))
+        self._predicate = parser.parse()
+        self.properties = frozenset(parser.properties)
+        self._lower = dict((x.lower(), x) for x in self.properties)
+
+    def __repr__(self):
+        return 'CQLPredicate(%r)' % self.where
+
+    def __call__(self, instance):
+        if hasattr(instance, 'properties'):
+            values = dict((name, instance.properties[name].value)
+                          for name in self.properties
+                          if name in instance.properties)
+        else:
+            values = instance
+
+        return self._predicate(values) is not False
+
+    def match_element(self, element):
+        """Evaluate the predicate against an INSTANCE element, only
+        converting the values of referenced properties."""
+
+        values = {}
+
+        for prop in element:
+            name = self._lower.get((prop.get('NAME') or '').lower())
+            if name is None:
+                continue
+
+            _type = prop.get('TYPE')
+
+            # A value that doesn't convert is left missing, so it makes
+            # its conditions unknown rather than failing the response.
+
+            if prop.tag == 'PROPERTY':
+                value = prop.find('VALUE')
+                if value is None:
+                    values[name] = None
+                else:
+                    try:
+                        values[name] = tocimobj(_type, value.text or '')
+                    except ValueError:
+                        pass
+
+            elif prop.tag == 'PROPERTY.ARRAY':
+                array = prop.find('VALUE.ARRAY')
+                if array is None:
+                    values[name] = None
+                else:
+                    try:
+                        values[name] = [tocimobj(_type, x.text or '')
+                                        for x in array.findall('VALUE')]
+                    except ValueError:
+                        pass
+
+            elif prop.tag == 'PROPERTY.REFERENCE':
+                # References are not compared; leave them missing so
+                # conditions on them never reject an instance.
+                pass
+
+        return self._predicate(values) is not False
+
+def where_clause(query):
+    """Return the WHERE clause of a CQL query, or None."""
+
+    m = _WHERE.search(query or '')
+    if m is None:
+        return None
+
+    return m.group(1).strip() or None
+
+def compile_where(query):
+    """Compile the WHERE clause of query into a CQLPredicate.  Return
+    None if the query has no WHERE clause."""
+
+    where = where_clause(query)
+    if where is None:
+        return None
+
+    return CQLPredicate(where)
+
+def any_of(predicates):
+    """Return a predicate matching when any of predicates does, or None
+    if a predicate is missing and so everything must be accepted."""
+
+    predicates = list(predicates)
+    if not predicates or None in predicates:
+        return None
+    if len(predicates) == 1:
+        return predicates[0]
+
+    return CQLPredicate(' OR '.join('(%s)' % x.where for x in predicates))
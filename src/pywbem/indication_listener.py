@@ -0,0 +1,423 @@
+#
+# (C) Copyright 2017 Zenoss, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""
+indication_listener - Receive CIM indications at high rates.
+
+irecv.CIMListener parses each export request into a complete tupletree
+and calls its callback for every indication from the reactor thread, so
+one slow callback holds up every other request.  IndicationListener
+parses requests incrementally, puts the indications on a bounded queue
+and answers the request at once.  A pool of worker threads takes the
+indications off the queue and passes them to the callback in lists of up
+to batch_size indications.
+
+When the queue is full, further indications are dropped rather than
+delaying the sender, and counted in the listener's statistics.  A
+dropped callback lets the application make up for them, for example by
+polling what they were about.
+
+Devices often send bursts of identical alerts for the same element.  With
+a coalescing window, IndicationCoalescer passes on the first of them and
+holds back the repeats until the window ends, then passes on the last
+repeat with the number of repeats held back.
+"""
+
+import Queue
+import threading
+import time
+
+from collections import OrderedDict
+
+from twisted.internet import reactor, ssl, task
+from twisted.internet.threads import deferToThread
+from twisted.python import log
+from twisted.web import resource, server
+
+from cim_types import Uint32
+from tupleparse import parse_instance
+from tupletree import ElementTree, ele_to_tupletree
+
+# Statistics kept by IndicationListener.
+
+STATS = ('requests', 'received', 'delivered', 'dropped', 'overflows',
+         'parse_errors', 'callback_errors', 'coalesced')
+
+# Properties identifying the element an indication is about, in order of
+# preference.
+
+ELEMENT_PROPERTIES = ('IndicationIdentifier', 'AlertingManagedElement',
+                      'SourceInstanceModelPath')
+
+def iter_indications(stream):
+    """Yield the indications in the CIM-XML export request read from
+    stream, as CIMInstance objects.
+
+    The request is parsed incrementally.  Each INSTANCE of an
+    EXPPARAMVALUE is converted as soon as it ends and then discarded, so
+    requests carrying many indications are never held in memory as a
+    whole tree.  Both SIMPLEEXPREQ and MULTIEXPREQ requests are accepted.
+    """
+
+    tags = []
+
+    for event, elem in ElementTree.iterparse(stream, ('start', 'end')):
+        if event == 'start':
+            tags.append(elem.tag)
+            continue
+
+        tags.pop()
+
+        if elem.tag == 'INSTANCE' and tags and tags[-1] == 'EXPPARAMVALUE':
+            yield parse_instance(ele_to_tupletree(elem))
+            elem.clear()
+        elif elem.tag == 'EXPMETHODCALL':
+            elem.clear()
+
+def value(indication, name):
+    prop = indication.properties.get(name)
+    if prop is None:
+        return None
+    return prop.value
+
+def coalesce_key(source, indication):
+    """Return the key identifying repeats of indication from source, or
+    None if it doesn't name the element it is about."""
+
+    for name in ELEMENT_PROPERTIES:
+        element = value(indication, name)
+        if element is not None:
+            break
+    else:
+        return None
+
+    return (source, indication.classname.lower(), element,
+            value(indication, 'AlertType'),
+            value(indication, 'PerceivedSeverity'))
+
+class IndicationCoalescer(object):
+    """Holds back repeated indications for window seconds.
+
+    The first indication with a given key is passed on at once.  Repeats
+    of it arriving within window seconds are counted instead.  When the
+    window ends, the last repeat is passed on with a CoalescedCount
+    property holding the number of repeats.  No more than max_keys keys
+    are remembered; the oldest window is ended early to make room.
+    """
+
+    def __init__(self, window=10, max_keys=10000, clock=time.time):
+        self.window = window
+        self.max_keys = max_keys
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.coalesced = 0
+
+    def add(self, source, indications):
+        """Return the (source, indication) pairs to pass on in place of
+        indications."""
+
+        now = self.clock()
+        result = self.expire(now)
+
+        for indication in indications:
+            key = coalesce_key(source, indication)
+            if key is None:
+                result.append((source, indication))
+                continue
+
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry[1] += 1
+                entry[2] = indication
+                self.coalesced += 1
+                continue
+
+            if len(self.entries) >= self.max_keys:
+                result.extend(self.summary(*self.entries.popitem(False)))
+
+            self.entries[key] = [now, 0, None]
+            result.append((source, indication))
+
+        return result
+
+    def expire(self, now=None):
+        """End the windows started window seconds ago or earlier, and
+        return the (source, indication) pairs summarizing their repeats."""
+
+        if now is None:
+            now = self.clock()
+
+        result = []
+        while self.entries:
+            key, entry = next(self.entries.iteritems())
+            if entry[0] + self.window > now:
+                break
+            del self.entries[key]
+            result.extend(self.summary(key, entry))
+
+        return result
+
+    def summary(self, key, entry):
+        started, count, indication = entry
+        if not count:
+            return []
+
+        indication = indication.copy()
+        indication['CoalescedCount'] = Uint32(count)
+        return [(key[0], indication)]
+
+class IndicationListener(resource.Resource):
+    """A twisted.web resource accepting CIM export requests.
+
+    callback is called from a worker thread with a list of (source,
+    indication) pairs, where source is the address of the sender and
+    indication a CIMInstance.  It may block without delaying the reception of further
+    indications.  Use reactor.callFromThread() to hand results back to
+    the reactor.
+
+    dropped, if given, is called from the reactor thread with the list of
+    (source, indication) pairs dropped because the queue was full.
+    """
+
+    isLeaf = 1
+
+    def __init__(self, callback, max_queue=10000, workers=4,
+                 batch_size=100, coalesce_window=None, max_coalesced=10000,
+                 dropped=None):
+        resource.Resource.__init__(self)
+        self.callback = callback
+        self.dropped = dropped
+        self.coalescer = None
+        self.expiry = None
+        if coalesce_window:
+            self.coalescer = IndicationCoalescer(
+                coalesce_window, max_coalesced)
+        self.queue = Queue.Queue(max_queue)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.threads = []
+        self.lock = threading.Lock()
+        self.stats = dict((x, 0) for x in STATS)
+
+        # Stop markers that didn't fit in the queue, queued by the workers
+        # as they make room.
+        self.unqueued_stops = 0
+
+    def count(self, name, n=1):
+        self.lock.acquire()
+        try:
+            self.stats[name] += n
+        finally:
+            self.lock.release()
+
+    def listen(self, http_port=5988, https_port=None,
+               ssl_key=None, ssl_cert=None, shutdown_timeout=30):
+        """Start the workers and listen for requests on the given ports.
+
+        Before the reactor shuts down, the workers deliver the queued
+        indications for up to shutdown_timeout seconds.
+        """
+
+        self.start()
+
+        site = server.Site(self)
+        ports = []
+
+        if http_port:
+            ports.append(reactor.listenTCP(http_port, site))
+        if https_port:
+            ports.append(reactor.listenSSL(
+                https_port, site,
+                ssl.DefaultOpenSSLContextFactory(ssl_key, ssl_cert)))
+
+        reactor.addSystemEventTrigger('before', 'shutdown',
+                                      self.shutdown, shutdown_timeout)
+
+        # Windows are ended within half a window of their end.
+        if self.coalescer is not None:
+            self.expiry = task.LoopingCall(self.expire)
+            self.expiry.start(self.coalescer.window / 2.0, now=False)
+
+        return ports
+
+    def start(self):
+        """Start the worker threads."""
+
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self.work,
+                                      name='IndicationListener worker')
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Deliver the queued indications and stop the worker threads,
+        waiting up to timeout seconds for them.
+
+        Queueing the stop markers never blocks: those that don't fit in a
+        full queue are queued by the workers once they have taken
+        indications off it.  Waiting for the workers does, so the reactor
+        thread uses shutdown() instead.
+        """
+
+        self.join(self.queue_stops(), timeout)
+
+    def shutdown(self, timeout=None):
+        """Stop the worker threads without blocking the reactor thread.
+
+        Return a Deferred firing once the workers have delivered the
+        queued indications and stopped, or after timeout seconds.  They
+        are waited for in a thread of the reactor's pool, so callbacks
+        using blockingCallFromThread() keep working meanwhile.
+        """
+
+        return deferToThread(self.join, self.queue_stops(), timeout)
+
+    def queue_stops(self):
+        """Queue the summaries of all coalescing windows, then a stop
+        marker for each worker thread, and return the threads."""
+
+        if self.expiry is not None and self.expiry.running:
+            self.expiry.stop()
+        if self.coalescer is not None:
+            self.enqueue(self.coalescer.expire(now=float('inf')))
+
+        threads, self.threads = self.threads, []
+        for thread in threads:
+            self.queue_stop()
+        return threads
+
+    def join(self, threads, timeout=None):
+        """Wait until threads have stopped, for up to timeout seconds."""
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+        for thread in threads:
+            if timeout is None:
+                thread.join()
+            else:
+                thread.join(max(deadline - time.time(), 0))
+
+    def queue_stop(self):
+        """Queue a marker stopping one worker, or leave it to the workers
+        if the queue is full."""
+
+        try:
+            self.queue.put_nowait(None)
+        except Queue.Full:
+            self.lock.acquire()
+            try:
+                self.unqueued_stops += 1
+            finally:
+                self.lock.release()
+
+            # The workers may have emptied the queue in the meantime.
+            if not self.queue.full():
+                self.queue_unqueued_stops()
+
+    def queue_unqueued_stops(self):
+        self.lock.acquire()
+        try:
+            count, self.unqueued_stops = self.unqueued_stops, 0
+        finally:
+            self.lock.release()
+
+        for i in range(count):
+            self.queue_stop()
+
+    def render_POST(self, request):
+        self.count('requests')
+
+        try:
+            indications = list(iter_indications(request.content))
+        except Exception, e:
+            self.count('parse_errors')
+            log.msg('Unable to parse CIM export request: %s' % e)
+            request.setResponseCode(400)
+            return ''
+
+        self.count('received', len(indications))
+
+        source = request.getClientIP()
+        if self.coalescer is None:
+            indications = [(source, x) for x in indications]
+        else:
+            coalesced = self.coalescer.coalesced
+            indications = self.coalescer.add(source, indications)
+            self.count('coalesced', self.coalescer.coalesced - coalesced)
+
+        self.enqueue(indications)
+
+        return ''
+
+    def expire(self):
+        """Queue the summaries of coalescing windows that have ended."""
+
+        self.enqueue(self.coalescer.expire())
+
+    def enqueue(self, indications):
+        """Queue (source, indication) pairs for delivery, dropping those
+        that don't fit."""
+
+        for i, indication in enumerate(indications):
+            try:
+                self.queue.put_nowait(indication)
+            except Queue.Full:
+                self.count('overflows')
+                self.count('dropped', len(indications) - i)
+                if self.dropped is not None:
+                    self.dropped(indications[i:])
+                break
+
+    def next_batch(self):
+        """Wait for an indication and return it with any others already
+        queued, up to batch_size, or None once the worker should stop."""
+
+        indication = self.queue.get()
+        if indication is None:
+            return None
+
+        batch = [indication]
+        while len(batch) < self.batch_size:
+            try:
+                indication = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if indication is None:
+                # leave the stop marker for this worker's next call
+                self.queue_stop()
+                break
+            batch.append(indication)
+
+        if self.unqueued_stops:
+            self.queue_unqueued_stops()
+
+        return batch
+
+    def work(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+
+            try:
+                self.callback(batch)
+            except Exception:
+                self.count('callback_errors')
+                log.err(None, 'Indication callback failed')
+
+            self.count('delivered', len(batch))
@@ -0,0 +1,260 @@
+#
+# (C) Copyright 2017 Zenoss, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""
+instancexml - Serialize many CIM instances to CIM-XML quickly.
+
+CIMInstance.tocimxml() builds a CIMProperty and a tree of cim_xml
+elements for every property of every instance.  When many instances of
+the same class are serialized, most of that work is the same each time:
+only the values differ.  InstanceSerializer builds the markup around the
+value of each property once, by serializing a template property through
+tocimxml(), and afterwards only formats and escapes the values.
+
+The output is identical to joining instance.tocimxml().toxml() for each
+instance.  Properties with qualifiers, references and embedded objects
+are rare on instances and are serialized with tocimxml().
+"""
+
+from datetime import datetime, timedelta
+
+from cim_obj import CIMClass, CIMInstance, CIMInstanceName, CIMProperty
+from cim_types import CIMDateTime, CIMInt, atomic_to_cim_xml
+from cim_xml import _escape
+
+# Stands in for the value of a template property, so that the markup
+# before and after it can be found.  Escaping leaves it untouched.
+
+_MARK = u'\x00'
+
+# Value classes whose CIM type can't be inferred from the class alone.
+
+_SLOW_VALUES = (CIMInstanceName, CIMInstance, CIMClass, CIMProperty,
+                type(None))
+
+def _format_bool(value):
+    if value:
+        return 'true'
+    return 'false'
+
+# Functions converting values to text as atomic_to_cim_xml() does, by
+# value class.
+
+_formatters = {}
+
+def formatter(cls):
+    """Return the function converting values of class cls to text."""
+
+    func = _formatters.get(cls)
+
+    if func is None:
+        if issubclass(cls, bool):
+            func = _format_bool
+        elif issubclass(cls, (CIMInt, CIMDateTime, basestring)):
+            func = unicode
+        else:
+            func = atomic_to_cim_xml
+        _formatters[cls] = func
+
+    return func
+
+class _Template(object):
+    """The markup of one property, with holes for its value."""
+
+    def __init__(self, prop):
+        self.null = prop_xml(prop, None)
+
+        if prop.is_array:
+            self.empty = prop_xml(prop, [])
+            full = prop_xml(prop, [_MARK])
+            prefix, suffix = full.split(u'<VALUE>%s</VALUE>' % _MARK)
+        else:
+            prefix, suffix = prop_xml(prop, _MARK).split(_MARK)
+
+        # The marker made the markup unicode.  Keep it a byte string if
+        # the property's own markup is, as tocimxml() would.
+
+        if isinstance(self.null, str):
+            prefix, suffix = str(prefix), str(suffix)
+
+        self.prefix = prefix
+        self.suffix = suffix
+        self.is_array = prop.is_array
+
+    def format(self, value):
+        if value is None:
+            return self.null
+
+        if not self.is_array:
+            text = formatter(value.__class__)(value)
+            return self.prefix + _escape(text) + self.suffix
+
+        if not value:
+            return self.empty
+
+        values = []
+        for item in value:
+            text = formatter(item.__class__)(item)
+            if text is None:
+                values.append('<VALUE/>')
+            elif text:
+                values.append(u'<VALUE>%s</VALUE>' % _escape(text))
+            else:
+                values.append('<VALUE></VALUE>')
+
+        return self.prefix + ''.join(values) + self.suffix
+
+def prop_xml(prop, value):
+    """Return the XML for a copy of prop holding value."""
+
+    return CIMProperty(prop.name, value, type = prop.type,
+                       class_origin = prop.class_origin,
+                       array_size = prop.array_size,
+                       propagated = prop.propagated,
+                       is_array = prop.is_array,
+                       reference_class = prop.reference_class,
+                       embedded_object = prop.embedded_object
+                       ).tocimxml().toxml()
+
+class InstanceSerializer(object):
+    """Serializes instances to CIM-XML, caching the markup of each
+    property of each class."""
+
+    def __init__(self):
+        self.templates = {}
+        self.instance_tags = {}
+
+    def template(self, classname, name, value):
+        """Return the _Template for a property given as a plain value, or
+        None if the property must be serialized with tocimxml()."""
+
+        if value.__class__ is list:
+            if not value or isinstance(value[0], _SLOW_VALUES):
+                return None
+            key = (classname, name, list, value[0].__class__)
+        else:
+            if isinstance(value, _SLOW_VALUES):
+                return None
+            key = (classname, name, value.__class__)
+
+        template = self.templates.get(key)
+        if template is None:
+            template = _Template(CIMProperty(name, value))
+            self.templates[key] = template
+
+        return template
+
+    def property_template(self, classname, prop):
+        """Return the _Template for a CIMProperty, or None if it must be
+        serialized with tocimxml()."""
+
+        if prop.qualifiers or prop.embedded_object is not None or \
+           prop.type == 'reference' or prop.type is None:
+            return None
+
+        key = (classname, prop.name, CIMProperty, prop.type, prop.is_array,
+               prop.class_origin, prop.propagated, prop.array_size)
+
+        template = self.templates.get(key)
+        if template is None:
+            template = _Template(prop)
+            self.templates[key] = template
+
+        return template
+
+    def instance_tag(self, classname):
+        """Return the opening tag and the empty element for classname."""
+
+        tags = self.instance_tags.get(classname)
+        if tags is None:
+            empty = CIMInstance(classname).tocimxml().toxml()
+            tags = (empty[:-2] + '>', empty)
+            self.instance_tags[classname] = tags
+
+        return tags
+
+    def property_xml(self, classname, name, value):
+        if isinstance(value, CIMProperty):
+            template = self.property_template(classname, value)
+            if template is None:
+                return value.tocimxml().toxml()
+            return template.format(value.value)
+
+        if isinstance(value, (datetime, timedelta)):
+            return CIMProperty(name, value).tocimxml().toxml()
+
+        template = self.template(classname, name, value)
+        if template is None:
+            return CIMProperty(name, value).tocimxml().toxml()
+
+        return template.format(value)
+
+    def instance_xml(self, instance, write, with_path = True):
+        """Pass the XML for instance to write, piece by piece.  Unless
+        with_path is false, an instance with a path is written as a
+        VALUE.NAMEDINSTANCE."""
+
+        classname = instance.classname
+        start, empty = self.instance_tag(classname)
+        with_path = with_path and instance.path is not None
+
+        if with_path:
+            write('<VALUE.NAMEDINSTANCE>')
+            write(instance.path.tocimxml().toxml())
+
+        properties = instance.properties.items()
+        qualifiers = instance.qualifiers.values()
+
+        if properties or qualifiers:
+            write(start)
+            for qualifier in qualifiers:
+                write(qualifier.tocimxml().toxml())
+            for name, value in properties:
+                write(self.property_xml(classname, name, value))
+            write('</INSTANCE>')
+        else:
+            write(empty)
+
+        if with_path:
+            write('</VALUE.NAMEDINSTANCE>')
+
+    def toxml(self, instances):
+        """Return the concatenated XML of instances."""
+
+        buf = []
+        write = buf.append
+        for instance in instances:
+            self.instance_xml(instance, write)
+        return ''.join(buf)
+
+    def iterxml(self, instances):
+        """Yield the XML of each instance in turn."""
+
+        for instance in instances:
+            buf = []
+            self.instance_xml(instance, buf.append)
+            yield ''.join(buf)
+
+# A serializer shared by callers that don't need their own cache.
+
+_serializer = InstanceSerializer()
+
+def instances_toxml(instances):
+    """Return the concatenated XML of instances, using a shared cache of
+    property markup."""
+
+    return _serializer.toxml(instances)
@@ -11,6 +11,7 @@ from twisted.internet import reactor
 from twisted.web import server, resource
 import pywbem
 import threading
+from pywbem.indication_listener import iter_indications
 
 from twisted.internet import ssl, reactor
 from twisted.python import log
@@ -66,9 +67,7 @@ class CIMListener(resource.Resource):
         reactor.run()
         
     def render_POST(self, request):
-        tt = pywbem.parse_cim(pywbem.xml_to_tupletree(request.content.read()))
-        insts = [x[1] for x in tt[2][2][0][2][2]]
-        for inst in insts:
+        for inst in iter_indications(request.content):
             self.callback(inst)
         return ''
 
@@ -0,0 +1,350 @@
+#
+# (C) Copyright 2017 Zenoss, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+
+"""
+local_cimom - Serve an in-memory CIM repository over CIM-XML.
+
+LocalCIMOM is a twisted.web resource answering the intrinsic operations
+of CIM-XML requests from a mof_compiler.MOFWBEMConnection, usually
+filled by compiling MOF files.  Together they stand in for a CIMOM when
+testing the collector without real hardware:
+
+  python local_cimom.py -n root/cimv2 -p 5988 -s schema/ devices.mof
+
+It listens on the loopback interface only, unless another address is
+given with -i.
+
+Instance, association, query, class and qualifier operations are
+supported, as are the pulled enumeration operations
+OpenEnumerateInstances, PullInstancesWithPath and CloseEnumeration.
+Extrinsic methods are not.  Credentials are accepted but not checked.
+"""
+
+import itertools
+
+from collections import OrderedDict
+
+from twisted.internet import reactor, ssl
+from twisted.python import log
+from twisted.web import resource, server
+
+import cim_xml
+from cim_constants import CIM_ERR_FAILED, CIM_ERR_INVALID_ENUMERATION_CONTEXT, \
+     CIM_ERR_INVALID_PARAMETER, CIM_ERR_NOT_SUPPORTED, \
+     DEFAULT_ITER_MAXOBJECTCOUNT
+from cim_obj import CIMClassName
+from cim_operations import CIMError
+from instancexml import InstanceSerializer
+from tupleparse import parse_cim
+from tupletree import xml_to_tupletree
+
+# Statistics kept by LocalCIMOM.
+
+STATS = ('requests', 'errors', 'parse_errors')
+
+# How the result of each operation answered by the repository is
+# returned.
+
+RESULTS = {
+    'GetInstance': 'instance',
+    'EnumerateInstances': 'namedinstance',
+    'EnumerateInstanceNames': 'instancename',
+    'CreateInstance': 'instancename',
+    'ModifyInstance': None,
+    'DeleteInstance': None,
+    'ExecQuery': 'objectwithpath',
+    'Associators': 'objectwithpath',
+    'References': 'objectwithpath',
+    'AssociatorNames': 'objectpath',
+    'ReferenceNames': 'objectpath',
+    'GetClass': 'object',
+    'EnumerateClasses': 'object',
+    'EnumerateClassNames': 'classname',
+    'GetQualifier': 'object',
+    'EnumerateQualifiers': 'object',
+    }
+
+# Parameters naming a class, passed to the repository as strings.
+
+CLASSNAME_PARAMS = ('ClassName', 'AssocClass', 'ResultClass')
+
+XML_HEADER = '<?xml version="1.0" encoding="utf-8" ?>\n'
+
+class LocalCIMOM(resource.Resource):
+    """A twisted.web resource answering CIM-XML operation requests from
+    repository, a MOFWBEMConnection.
+
+    Pulled enumerations keep the instances not returned yet under their
+    enumeration context until they have been pulled or the enumeration
+    is closed.  No more than max_contexts are kept; the oldest are
+    dropped to make room.
+    """
+
+    isLeaf = 1
+
+    def __init__(self, repository, host='localhost', max_contexts=1000):
+        resource.Resource.__init__(self)
+        self.repository = repository
+        self.host = host
+        self.max_contexts = max_contexts
+        self.contexts = OrderedDict()
+        self.context_ids = itertools.count(1)
+        self.stats = dict((x, 0) for x in STATS)
+        self.serializer = InstanceSerializer()
+
+    def listen(self, http_port=5988, https_port=None,
+               ssl_key=None, ssl_cert=None, interface='127.0.0.1'):
+        """Listen for requests on the given ports of interface, only the
+        loopback interface by default.  Pass '' to listen on every
+        interface."""
+
+        site = server.Site(self)
+        ports = []
+
+        if http_port:
+            ports.append(reactor.listenTCP(http_port, site,
+                                           interface=interface))
+        if https_port:
+            ports.append(reactor.listenSSL(
+                https_port, site,
+                ssl.DefaultOpenSSLContextFactory(ssl_key, ssl_cert),
+                interface=interface))
+
+        return ports
+
+    def render_POST(self, request):
+        self.stats['requests'] += 1
+
+        try:
+            tt = parse_cim(xml_to_tupletree(request.content.read()))
+            message = tt[2]
+            call = message[2][0][2]
+        except Exception, e:
+            self.stats['parse_errors'] += 1
+            log.msg('Unable to parse CIM-XML request: %s' % e)
+            request.setResponseCode(400)
+            return ''
+
+        request.setHeader('Content-Type', 'application/xml; charset="utf-8"')
+        request.setHeader('CIMOperation', 'MethodResponse')
+
+        if call[0] == 'IMETHODCALL':
+            response = self.imethodcall(call[1]['NAME'], call[2],
+                                        dict(call[3]))
+        else:
+            self.stats['errors'] += 1
+            response = cim_xml.METHODRESPONSE(
+                call[1]['NAME'],
+                cim_xml.ERROR(str(CIM_ERR_NOT_SUPPORTED),
+                              'Extrinsic methods are not supported'))
+
+        return XML_HEADER + cim_xml.CIM(
+            cim_xml.MESSAGE(cim_xml.SIMPLERSP(response),
+                            message[1]['ID'], '1.0'),
+            '2.0', '2.0').toxml('utf-8')
+
+    def imethodcall(self, name, namespace, params):
+        """Return the IMETHODRESPONSE element answering an intrinsic
+        method call."""
+
+        for param in CLASSNAME_PARAMS:
+            if isinstance(params.get(param), CIMClassName):
+                params[param] = params[param].classname
+
+        params = dict((str(k), v) for k, v in params.items())
+
+        try:
+            if name in RESULTS:
+                result = getattr(self.repository, name)(
+                    namespace=namespace, **params)
+                return cim_xml.IMETHODRESPONSE(
+                    name, self.ireturnvalue(namespace, RESULTS[name], result))
+
+            handler = getattr(self, 'pull_' + name, None)
+            if handler is None:
+                raise CIMError(CIM_ERR_NOT_SUPPORTED, name)
+            return handler(namespace, **params)
+
+        except CIMError, ce:
+            self.stats['errors'] += 1
+            return cim_xml.IMETHODRESPONSE(
+                name, cim_xml.ERROR(str(ce.args[0]), ce.args[1]))
+
+        except Exception, e:
+            self.stats['errors'] += 1
+            log.err(None, 'Failed to answer %s' % name)
+            return cim_xml.IMETHODRESPONSE(
+                name, cim_xml.ERROR(str(CIM_ERR_FAILED), str(e)))
+
+    def ireturnvalue(self, namespace, kind, result):
+        if kind is None:
+            return None
+
+        if not isinstance(result, list):
+            result = [result]
+
+        value = cim_xml.IRETURNVALUE(None)
+        value.appendChildren([self.element(namespace, kind, x)
+                              for x in result])
+        return value
+
+    def element(self, namespace, kind, obj):
+        """Return the CIM-XML element returning obj as kind."""
+
+        if kind == 'object':
+            return obj.tocimxml()
+        elif kind == 'classname':
+            return cim_xml.CLASSNAME(obj)
+        elif kind == 'instancename':
+            return self.instancename(obj)
+        elif kind == 'instance':
+            return self.instance(obj)
+        elif kind == 'namedinstance':
+            return cim_xml.VALUE_NAMEDINSTANCE(self.instancename(obj.path),
+                                               self.instance(obj))
+        elif kind == 'objectwithpath':
+            return cim_xml.VALUE_OBJECTWITHPATH(
+                self.instancepath(namespace, obj.path), self.instance(obj))
+        elif kind == 'instancewithpath':
+            return cim_xml.VALUE_INSTANCEWITHPATH(
+                self.instancepath(namespace, obj.path), self.instance(obj))
+        elif kind == 'objectpath':
+            return cim_xml.OBJECTPATH(self.instancepath(namespace, obj))
+
+        raise ValueError('Unknown result kind %s' % kind)
+
+    def instance(self, instance):
+        """Return the INSTANCE element of instance, serialized with the
+        property markup cached for its class."""
+
+        buf = []
+        self.serializer.instance_xml(instance, buf.append, with_path=False)
+        return cim_xml.Markup(''.join(buf))
+
+    def instancename(self, path):
+        path = path.copy()
+        path.host = None
+        path.namespace = None
+        return path.tocimxml()
+
+    def instancepath(self, namespace, path):
+        path = path.copy()
+        path.host = self.host
+        path.namespace = path.namespace or namespace
+        return path.tocimxml()
+
+    def pull_OpenEnumerateInstances(self, namespace, ClassName,
+                                    MaxObjectCount=None, **params):
+        for name in ('FilterQueryLanguage', 'FilterQuery'):
+            if params.pop(name, None):
+                raise CIMError(CIM_ERR_NOT_SUPPORTED, name)
+
+        instances = self.repository.EnumerateInstances(
+            ClassName, namespace=namespace, **params)
+
+        while len(self.contexts) >= self.max_contexts:
+            self.contexts.popitem(False)
+
+        context = 'LocalCIMOM-%d' % next(self.context_ids)
+        self.contexts[context] = (namespace, instances)
+
+        return self.pull('OpenEnumerateInstances', context, MaxObjectCount)
+
+    def pull_PullInstancesWithPath(self, namespace, EnumerationContext,
+                                   MaxObjectCount=None, **params):
+        return self.pull('PullInstancesWithPath', EnumerationContext,
+                         MaxObjectCount)
+
+    def pull_CloseEnumeration(self, namespace, EnumerationContext, **params):
+        if self.contexts.pop(EnumerationContext, None) is None:
+            raise CIMError(CIM_ERR_INVALID_ENUMERATION_CONTEXT,
+                           EnumerationContext)
+        return cim_xml.IMETHODRESPONSE('CloseEnumeration')
+
+    def pull(self, name, context, max_object_count):
+        """Return up to max_object_count instances of an enumeration,
+        with its context and whether the end has been reached."""
+
+        try:
+            namespace, instances = self.contexts[context]
+        except KeyError:
+            raise CIMError(CIM_ERR_INVALID_ENUMERATION_CONTEXT, context)
+
+        if max_object_count is None:
+            max_object_count = DEFAULT_ITER_MAXOBJECTCOUNT
+
+        try:
+            count = int(max_object_count)
+        except ValueError:
+            count = -1
+
+        if count < 0:
+            raise CIMError(CIM_ERR_INVALID_PARAMETER,
+                           'MaxObjectCount %s' % max_object_count)
+
+        batch = instances[:count]
+        del instances[:count]
+
+        end = not instances
+        if end:
+            del self.contexts[context]
+
+        response = cim_xml.IMETHODRESPONSE(
+            name, self.ireturnvalue(namespace, 'instancewithpath', batch))
+        response.appendChildren([
+            cim_xml.PARAMVALUE('EnumerationContext', cim_xml.VALUE(context),
+                               'string'),
+            cim_xml.PARAMVALUE('EndOfSequence',
+                               cim_xml.VALUE(end and 'TRUE' or 'FALSE'),
+                               'boolean')])
+        return response
+
+
+if __name__ == '__main__':
+    import sys
+    from optparse import OptionParser
+    from mof_compiler import MOFCompiler, MOFWBEMConnection
+
+    usage = 'usage: %prog -n <namespace> [options] <MOF file> ...'
+    oparser = OptionParser(usage=usage)
+    oparser.add_option('-n', '--namespace', dest='ns', default='root/cimv2',
+            help='Namespace to compile the MOF files into')
+    oparser.add_option('-s', '--search', dest='search', action='append',
+            default=[], metavar='Path',
+            help='Search path to find missing schema elements.  This option can be present multiple times.')
+    oparser.add_option('-p', '--port', dest='port', type='int', default=5988,
+            help='HTTP port to listen on')
+    oparser.add_option('-i', '--interface', dest='interface',
+            default='127.0.0.1',
+            help='Address to listen on, or "" for every interface')
+    oparser.add_option('-c', '--cache', dest='cache_dir', metavar='Dir',
+            help='Directory to cache compiled MOF files in')
+    (options, args) = oparser.parse_args()
+
+    if not args:
+        oparser.error('No input files given for parsing')
+
+    repository = MOFWBEMConnection()
+    repository.default_namespace = options.ns
+    mofcomp = MOFCompiler(repository, search_paths=options.search,
+                          cache_dir=options.cache_dir)
+    mofcomp.compile_files(args, options.ns)
+
+    log.startLogging(sys.stdout)
+    LocalCIMOM(repository).listen(http_port=options.port,
+                                  interface=options.interface)
+    reactor.run()
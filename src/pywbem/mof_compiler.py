@@ -20,17 +20,28 @@
 
 import sys
 import os
+import copy
+import cPickle
+import hashlib
+import imp
+import multiprocessing
+import re
+import tempfile
 import lex
 import yacc
 from lex import TOKEN
-from cim_operations import CIMError, WBEMConnection
+from cim_operations import CIMError, ClassHierarchy, WBEMConnection
+from cql import CQLError, compile_where
 from cim_obj import *
 from cim_constants import *
+from collections import OrderedDict
 from getpass import getpass
 
-_optimize = 1
 _tabmodule='mofparsetab'
-_lextab='moflextab'
+
+# Version of the compiled MOF cache format.  Bump it when the objects the
+# productions create change.
+_cache_version = 1
 
 
 reserved = {
@@ -159,6 +170,123 @@ def t_error(t):
     t.lexer.parser.log(msg)
     t.lexer.skip(1)
 
+# The lexer rules above, in the order the PLY lexer tries them, for
+# _FastLexer.  Ignored characters and literals are matched by the same
+# expression.
+
+_FAST_RULES = [
+    ('ignore', '[%s]+' % t_ignore),
+    ('COMMENT', t_COMMENT.__doc__),
+    ('MCOMMENT', t_MCOMMENT.__doc__),
+    ('IDENTIFIER', identifier_re),
+    ('newline', t_newline.__doc__),
+    ('stringValue', t_stringValue),
+    ('floatValue', t_floatValue),
+    ('hexValue', t_hexValue),
+    ('decimalValue', t_decimalValue),
+    ('binaryValue', t_binaryValue),
+    ('octalValue', t_octalValue),
+    ('literal', '[%s]' % re.escape(literals)),
+    ]
+
+# Python limits the number of groups in an expression, so the groups
+# within the rules are made non-capturing.
+
+_FAST_RE = re.compile('|'.join(
+    ['(?P<%s>%s)' % (name, re.sub(r'(?<!\\)\((?!\?)', '(?:', regex))
+     for name, regex in _FAST_RULES]))
+
+# Interned identifiers and their token types, keyed by their text.
+
+_identifiers = {}
+
+class _FastLexer(object):
+    """A lexer producing the same tokens as the PLY lexer built from the
+    rules above, faster.
+
+    All rules are tried by one expression whose matching group names the
+    rule, without a function call per token.  Identifiers are looked up
+    in _identifiers, so the type of each distinct identifier is worked
+    out once and all occurrences share one string object.
+    """
+
+    def __init__(self):
+        self.lexdata = None
+        self.lexpos = 0
+        self.lexlen = 0
+        self.lineno = 1
+        self.linestart = 0
+
+    def clone(self):
+        return copy.copy(self)
+
+    def input(self, s):
+        self.lexdata = s
+        self.lexpos = 0
+        self.lexlen = len(s)
+
+    def skip(self, n):
+        self.lexpos += n
+
+    def token(self):
+        lexdata = self.lexdata
+        lexpos = self.lexpos
+        lexlen = self.lexlen
+        match = _FAST_RE.match
+
+        while lexpos < lexlen:
+            m = match(lexdata, lexpos)
+            if m is None:
+                tok = lex.LexToken()
+                tok.type = 'error'
+                tok.value = lexdata[lexpos:]
+                tok.lineno = self.lineno
+                tok.lexpos = lexpos
+                tok.lexer = self
+                self.lexpos = lexpos
+                t_error(tok)
+                lexpos = self.lexpos
+                continue
+
+            rule = m.lastgroup
+            end = m.end()
+
+            if rule == 'ignore' or rule == 'COMMENT' or rule == 'MCOMMENT':
+                lexpos = end
+                continue
+
+            if rule == 'newline':
+                self.lineno += end - lexpos
+                self.linestart = lexpos
+                lexpos = end
+                continue
+
+            tok = lex.LexToken()
+            tok.lineno = self.lineno
+            tok.lexpos = lexpos
+            value = m.group()
+
+            if rule == 'IDENTIFIER':
+                try:
+                    tok.type, tok.value = _identifiers[value]
+                except KeyError:
+                    if isinstance(value, str):
+                        value = intern(value)
+                    tok.type = reserved.get(value.lower(), 'IDENTIFIER')
+                    tok.value = value
+                    _identifiers[value] = (tok.type, value)
+            elif rule == 'literal':
+                tok.type = tok.value = value
+            else:
+                tok.type = rule
+                tok.value = value
+
+            self.lexpos = end
+            return tok
+
+        self.lexpos = lexpos + 1
+        return None
+
 class MOFParseError(ValueError):
     pass
 
@@ -245,6 +373,14 @@ def _create_ns(p, handle, ns):
 
 
 
+def _record(p, kind, value):
+    """Record a production of a file whose compilation is being cached."""
+    if p.parser.records is not None:
+        if hasattr(value, 'copy'):
+            # The handle may change the objects it is given.
+            value = value.copy()
+        p.parser.records.append((kind, value, p.lexer.lineno))
+
 def p_mp_createClass(p):
     """mp_createClass : classDeclaration
                       | assocDeclaration
@@ -252,6 +388,7 @@ def p_mp_createClass(p):
                       """
     ns = p.parser.handle.default_namespace
     cc = p[1]
+    _record(p, 'class', cc)
     try:
         fixedNS = fixedRefs = fixedSuper = False
         while not fixedNS or not fixedRefs or not fixedSuper:
@@ -355,6 +492,7 @@ def p_mp_createClass(p):
 def p_mp_createInstance(p):
     """mp_createInstance : instanceDeclaration"""
     inst = p[1]
+    _record(p, 'instance', inst)
     if p.parser.verbose:
         p.parser.log('Creating instance of %s.' % inst.classname)
     try:
@@ -381,6 +519,7 @@ def p_mp_setQualifier(p):
     """mp_setQualifier : qualifierDeclaration"""
     qualdecl = p[1]
     ns = p.parser.handle.default_namespace
+    _record(p, 'qualifier', qualdecl)
     if p.parser.verbose:
         p.parser.log('Setting qualifier %s' % qualdecl.name)
     try:
@@ -408,8 +547,11 @@ def p_mp_setQualifier(p):
 
 def p_compilerDirective(p): 
     """compilerDirective : '#' PRAGMA pragmaName '(' pragmaParameter ')'"""
-    directive = p[3].lower()
-    param = p[5]
+    _pragma(p, p[3].lower(), p[5])
+    p[0] = None
+
+def _pragma(p, directive, param):
+    _record(p, 'pragma', (directive, param))
     if directive == 'include':
         fname = param
         #if p.parser.file:
@@ -419,8 +561,6 @@ def p_compilerDirective(p):
         p.parser.handle.default_namespace = param
         if param not in p.parser.qualcache:
             p.parser.qualcache[param] = NocaseDict()
-    
-    p[0] = None
 
 def p_pragmaName(p):
     """pragmaName : identifier"""
@@ -487,6 +627,7 @@ def p_classDeclaration(p):
             superclass=superclass, qualifiers=quals)
     if alias:
         p.parser.aliases[alias] = p[0]
+        _record(p, 'alias', (alias, p[0]))
 
 def p_classFeatureList(p):
     """classFeatureList : empty
@@ -549,6 +690,7 @@ def _assoc_or_indic_decl(quals, p):
             superclass=superclass, qualifiers=quals)
     if alias:
         p.parser.aliases[alias] = cc
+        _record(p, 'alias', (alias, cc))
     return cc
 
 def p_qualifierListEmpty(p):
@@ -920,49 +1062,28 @@ def p_constantValueList(p):
     else:
         p[0] = p[1] + [p[3]]
 
-def _fixStringValue(s):
-    s = s[1:-1]
-    rv = ''
-    esc = False
-    i = -1 
-    while i < len(s) -1:
-        i+= 1
-        ch = s[i]
-        if ch == '\\' and not esc:
-            esc = True
-            continue
-        if not esc:
-            rv+= ch
-            continue
+# Escape sequences in string values, and what they stand for.
 
-        if ch == '"'   : rv+= '"'
-        elif ch == 'n' : rv+= '\n'
-        elif ch == 't' : rv+= '\t'
-        elif ch == 'b' : rv+= '\b'
-        elif ch == 'f' : rv+= '\f'
-        elif ch == 'r' : rv+= '\r'
-        elif ch == '\\': rv+= '\\'
-        elif ch in ['x','X']:
-            hexc = 0
-            j = 0
-            i+= 1
-            while j < 4:
-                c = s[i+j]; 
-                c = c.upper()
-                if not c.isdigit() and not c in 'ABCDEF':
-                    break;
-                hexc <<= 4
-                if c.isdigit():
-                    hexc |= ord(c) - ord('0')
-                else:
-                    hexc |= ord(c) - ord('A') + 0XA
-                j+= 1
-            rv+= chr(hexc)
-            i+= j-1
+_ESCAPE_RE = re.compile(r'\\([xX][0-9a-fA-F]{1,4}|.)', re.S)
 
-        esc = False
+_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t',
+            "'": "'", '"': '"', '\\': '\\'}
 
-    return rv
+def _unescape(m):
+    escape = m.group(1)
+    if len(escape) > 1:
+        code = int(escape[1:], 16)
+        if code < 256:
+            return chr(code)
+        return unichr(code)
+    return _ESCAPES.get(escape, '')
+
+def _fixStringValue(s):
+    """Return the value of a stringValue token."""
+    s = s[1:-1]
+    if '\\' not in s:
+        return s
+    return _ESCAPE_RE.sub(_unescape, s)
 
 
 
@@ -1174,30 +1295,12 @@ def p_instanceDeclaration(p):
             props = p[7]
             alias = p[5]
 
-    try:
-        cc = p.parser.handle.GetClass(cname,
-                LocalOnly=False, IncludeQualifiers=True)
-        p.parser.classnames[ns].append(cc.classname.lower())
-    except CIMError, ce:
-        ce.file_line = (p.parser.file, p.lexer.lineno)
-        if ce.args[0] == CIM_ERR_NOT_FOUND:
-            file_ = p.parser.mofcomp.find_mof(cname)
-            if p.parser.verbose:
-                p.parser.log('Class %s does not exist' % cname)
-            if file_:
-                p.parser.mofcomp.compile_file(file_, ns)
-                cc = p.parser.handle.GetClass(cname, LocalOnly=False, 
-                        IncludeQualifiers=True)
-            else:
-                if p.parser.verbose:
-                    p.parser.log("Can't find file to satisfy class")
-                ce = CIMError(CIM_ERR_INVALID_CLASS, cname)
-                ce.file_line = (p.parser.file, p.lexer.lineno)
-                raise ce
-        else:
-            raise
+    cc = _instance_class(p, cname)
     path = CIMInstanceName(cname, namespace=ns)
-    inst = CIMInstance(cname, properties=cc.properties, 
+    # Copy the properties, so that the values set below don't end up in
+    # the class.
+    properties = dict([(x.name, x.copy()) for x in cc.properties.values()])
+    inst = CIMInstance(cname, properties=properties, 
             qualifiers=quals, path=path)
     for prop in props: 
         pname = prop[1]
@@ -1228,8 +1331,36 @@ def p_instanceDeclaration(p):
 
     if alias:
         p.parser.aliases[alias] = inst.path
+        _record(p, 'alias', (alias, inst.path))
     p[0] = inst 
 
+def _instance_class(p, cname):
+    """Return the class of an instance, compiling it first if needed."""
+    ns = p.parser.handle.default_namespace
+    try:
+        cc = p.parser.handle.GetClass(cname,
+                LocalOnly=False, IncludeQualifiers=True)
+        p.parser.classnames[ns].append(cc.classname.lower())
+    except CIMError, ce:
+        ce.file_line = (p.parser.file, p.lexer.lineno)
+        if ce.args[0] == CIM_ERR_NOT_FOUND:
+            file_ = p.parser.mofcomp.find_mof(cname)
+            if p.parser.verbose:
+                p.parser.log('Class %s does not exist' % cname)
+            if file_:
+                p.parser.mofcomp.compile_file(file_, ns)
+                cc = p.parser.handle.GetClass(cname, LocalOnly=False, 
+                        IncludeQualifiers=True)
+            else:
+                if p.parser.verbose:
+                    p.parser.log("Can't find file to satisfy class")
+                ce = CIMError(CIM_ERR_INVALID_CLASS, cname)
+                ce.file_line = (p.parser.file, p.lexer.lineno)
+                raise ce
+        else:
+            raise
+    return cc
+
 def p_valueInitializerList(p):
     """valueInitializerList : valueInitializer
                             | valueInitializerList valueInitializer
@@ -1340,13 +1471,70 @@ def _print_logger(str):
     print str
 
 
+# Query languages understood by MOFWBEMConnection.ExecQuery(), and the
+# form of the queries.
+
+_QUERY_LANGUAGES = ('WQL', 'CQL', 'DMTF:CQL')
+
+_SELECT = re.compile(
+    r'^\s*select\s+(?P<properties>.+?)\s+from\s+(?P<classname>\w+)'
+    r'(?:\s+where\b.*)?\s*$', re.I | re.S)
+
+def _classname(value):
+    """Return the name of a class given as a string or CIMClassName."""
+    if isinstance(value, CIMClassName):
+        return value.classname
+    return value
+
+def _key_value(value):
+    """Return a hashable form of a key value.  References compare by
+    class name and keys, ignoring host and namespace."""
+    if isinstance(value, CIMInstanceName):
+        return (value.classname.lower(), _instance_key(value))
+    if isinstance(value, (basestring, bool, int, long, float)):
+        return value
+    return unicode(value)
+
+def _instance_key(path):
+    """Return the key identifying the instance named by path within its
+    class."""
+    return tuple(sorted([(k.lower(), _key_value(v))
+                         for k, v in path.keybindings.items()]))
+
+def _is_subclass(hierarchy, super, sub):
+    """Return True if sub is super or one of its subclasses.  Classes
+    with an unknown ancestor are not."""
+    try:
+        return hierarchy.is_subclass(super, sub)
+    except KeyError:
+        return False
+
 class MOFWBEMConnection(object):
+    """A CIMOM handle keeping everything created through it in memory.
+
+    With conn, classes and qualifiers not created through the handle are
+    fetched from conn, and rollback() deletes what the compiler created
+    from conn.  Without it, the handle is an in-memory CIM repository:
+    instances are indexed by class and by key, and the instance,
+    association, query and class operations of WBEMConnection are
+    answered from memory.  local_cimom serves such a repository over
+    HTTP.
+    """
+
     def __init__(self, conn=None):
         self.conn = conn
         self.class_names = {}
         self.qualifiers = {}
         self.instances = {}
         self.classes = {}
+        # {namespace: {classname.lower(): OrderedDict(key -> instance)}}
+        self.index = {}
+        # {namespace: {(classname.lower(), key): OrderedDict(
+        #     (assoc classname.lower(), assoc key, role.lower()) -> role)}}
+        self.references = {}
+        self.class_hierarchies = {}
+        self.subclasses = {}
+        self.keyless = 0
         if conn is None:
             self.__default_namespace = 'root/cimv2'
 
@@ -1365,20 +1553,47 @@ class MOFWBEMConnection(object):
     default_namespace = property(getns, setns, None, 
             "default_namespace property")
 
+    def _ns(self, namespace=None):
+        return namespace or self.default_namespace
+
+    def class_hierarchy(self, namespace=None, load=False):
+        """Return the ClassHierarchy of the classes created in a
+        namespace, so that cim_operations.is_subclass() can be used with
+        this handle."""
+        ns = self._ns(namespace)
+        try:
+            return self.class_hierarchies[ns]
+        except KeyError:
+            pass
+        hierarchy = ClassHierarchy(ns)
+        hierarchy.add_classes(self.classes.get(ns, {}).values())
+        hierarchy.loaded = True
+        self.class_hierarchies[ns] = hierarchy
+        return hierarchy
+
+    def invalidate_class_hierarchy(self, namespace=None):
+        if namespace is None:
+            self.class_hierarchies.clear()
+        else:
+            self.class_hierarchies.pop(namespace, None)
+        self.subclasses.clear()
+
     def GetClass(self, *args, **kwargs):
         cname = len(args) > 0 and args[0] or kwargs['ClassName']
+        ns = self._ns(kwargs.get('namespace'))
         try:
-            cc = self.classes[self.default_namespace][cname]
+            cc = self.classes[ns][cname]
         except KeyError:
             if self.conn is None:
                 ce = CIMError(CIM_ERR_NOT_FOUND, cname)
                 raise ce
             cc = self.conn.GetClass(*args, **kwargs)
             try:
-                self.classes[self.default_namespace][cc.classname] = cc
+                self.classes[ns][cc.classname] = cc
             except KeyError:
-                self.classes[self.default_namespace] = \
+                self.classes[ns] = \
                         NocaseDict({cc.classname:cc})
+            self.invalidate_class_hierarchy(ns)
         if 'LocalOnly' in kwargs and not kwargs['LocalOnly']:
             if cc.superclass:
                 try:
@@ -1398,10 +1613,11 @@ class MOFWBEMConnection(object):
 
     def CreateClass(self, *args, **kwargs):
         cc = len(args) > 0 and args[0] or kwargs['NewClass']
+        ns = self._ns(kwargs.get('namespace'))
         if cc.superclass:
             try:
                 super_ = self.GetClass(cc.superclass, LocalOnly=True, 
-                        IncludeQualifiers=False)
+                        IncludeQualifiers=False, namespace=ns)
             except CIMError, ce:
                 if ce.args[0] == CIM_ERR_NOT_FOUND:
                     ce.args = (CIM_ERR_INVALID_SUPERCLASS, cc.superclass)
@@ -1410,31 +1626,63 @@ class MOFWBEMConnection(object):
                     raise
 
         try:
-            self.classes[self.default_namespace][cc.classname] = cc
+            self.classes[ns][cc.classname] = cc
         except KeyError:
-            self.classes[self.default_namespace] = \
+            self.classes[ns] = \
                         NocaseDict({cc.classname:cc})
+        self.invalidate_class_hierarchy(ns)
 
         # TODO: should we see if it exists first with 
         # self.conn.GetClass()?  Do we want to create a class
         # that already existed? 
         try:
-            self.class_names[self.default_namespace].append(cc.classname)
+            self.class_names[ns].append(cc.classname)
         except KeyError:
-            self.class_names[self.default_namespace] = [cc.classname]
+            self.class_names[ns] = [cc.classname]
 
     def ModifyClass(self, *args, **kwargs):
         raise CIMError(CIM_ERR_FAILED, 
                 'This should not happen!')
 
-    def ModifyInstance(self, *args, **kwargs):
-        raise CIMError(CIM_ERR_FAILED, 
-                'This should not happen!')
+    def EnumerateClassNames(self, namespace=None, ClassName=None,
+                            DeepInheritance=False, **params):
+        return [x.classname for x in self.EnumerateClasses(
+            namespace, ClassName=ClassName, DeepInheritance=DeepInheritance)]
+
+    def EnumerateClasses(self, namespace=None, ClassName=None,
+                         DeepInheritance=False, **params):
+        """Return the subclasses of ClassName, or the root classes if it
+        is None, in the order they were created."""
+        ns = self._ns(namespace)
+        classname = _classname(ClassName)
+        classes = self.classes.get(ns, NocaseDict())
+        if classname is not None and classname not in classes:
+            raise CIMError(CIM_ERR_INVALID_CLASS, classname)
+
+        created = self.class_names.get(ns, [])
+        ordered = [classes[x] for x in created if x in classes]
+        if len(ordered) < len(classes):
+            created = set([x.lower() for x in created])
+            ordered += [x for x in classes.values()
+                        if x.classname.lower() not in created]
+
+        if DeepInheritance:
+            hierarchy = self.class_hierarchy(ns)
+            if classname is None:
+                return ordered
+            return [x for x in ordered
+                    if x.classname.lower() != classname.lower() and
+                    _is_subclass(hierarchy, classname, x.classname)]
+
+        parent = classname and classname.lower()
+        return [x for x in ordered
+                if (x.superclass and x.superclass.lower()) == parent]
 
     def GetQualifier(self, *args, **kwargs):
         qualname = len(args) > 0 and args[0] or kwargs['QualifierName']
+        ns = self._ns(kwargs.get('namespace'))
         try:
-            qual = self.qualifiers[self.default_namespace][qualname]
+            qual = self.qualifiers[ns][qualname]
         except KeyError:
             if self.conn is None:
                 raise CIMError(CIM_ERR_NOT_FOUND, qualname)
@@ -1443,10 +1691,11 @@ class MOFWBEMConnection(object):
 
     def SetQualifier(self, *args, **kwargs):
         qual = len(args) > 0 and args[0] or kwargs['QualifierDeclaration']
+        ns = self._ns(kwargs.get('namespace'))
         try:
-            self.qualifiers[self.default_namespace][qual.name] = qual
+            self.qualifiers[ns][qual.name] = qual
         except KeyError:
-            self.qualifiers[self.default_namespace] = \
+            self.qualifiers[ns] = \
                     NocaseDict({qual.name:qual})
 
     def EnumerateQualifiers(self, *args, **kwargs):
@@ -1456,20 +1705,328 @@ class MOFWBEMConnection(object):
         else:
             rv = []
         try:
-            rv+= self.qualifiers[self.default_namespace].values()
+            rv+= self.qualifiers[self._ns(kwargs.get('namespace'))].values()
         except KeyError:
             pass
         return rv
 
+    def _instance_path(self, ns, inst):
+        """Return the path of a new instance, built from the key
+        properties of its class."""
+        try:
+            self.GetClass(inst.classname, namespace=ns)
+        except CIMError:
+            raise CIMError(CIM_ERR_INVALID_CLASS, inst.classname)
+
+        path = CIMInstanceName(inst.classname, namespace=ns)
+        for prop in self._class_properties(ns, inst.classname).values():
+            if 'key' not in prop.qualifiers or not prop.qualifiers['key']:
+                continue
+            if inst.properties.get(prop.name) is None or \
+                    inst.properties[prop.name].value is None:
+                raise CIMError(CIM_ERR_INVALID_PARAMETER,
+                        'Key property %s.%s is not set' % 
+                        (inst.classname, prop.name))
+            path[prop.name] = inst.properties[prop.name].value
+        return path
+
+    def _class_properties(self, ns, classname):
+        """Return the properties of a class including inherited ones, or
+        None if the class is unknown."""
+        classes = self.classes.get(ns, {})
+        if classname not in classes:
+            return None
+        props = NocaseDict()
+        while classname is not None and classname in classes:
+            cc = classes[classname]
+            for prop in cc.properties.values():
+                if prop.name not in props:
+                    props[prop.name] = prop
+            classname = cc.superclass
+        return props
+
+    def _subclasses(self, ns, classname):
+        """Return the lowercased names of classname and of the subclasses
+        that have instances in ns."""
+        lname = classname.lower()
+        try:
+            return self.subclasses[(ns, lname)]
+        except KeyError:
+            pass
+        hierarchy = self.class_hierarchy(ns)
+        result = []
+        for cname, instances in self.index.get(ns, {}).items():
+            if not instances:
+                continue
+            if cname == lname:
+                result.insert(0, cname)
+                continue
+            if _is_subclass(hierarchy, lname, cname):
+                result.append(cname)
+        self.subclasses[(ns, lname)] = result
+        return result
+
+    def _iter_instances(self, ns, classname):
+        index = self.index.get(ns, {})
+        for cname in self._subclasses(ns, classname):
+            for inst in index[cname].itervalues():
+                yield inst
+
+    def _find(self, ns, path):
+        """Return the class, key and stored instance named by path."""
+        index = self.index.get(ns, {})
+        key = _instance_key(path)
+        for cname in [path.classname.lower()] + \
+                self._subclasses(ns, path.classname):
+            inst = index.get(cname, {}).get(key)
+            if inst is not None:
+                return cname, key, inst
+        raise CIMError(CIM_ERR_NOT_FOUND, str(path))
+
+    def _filtered(self, ns, inst, classname=None, IncludeQualifiers=False,
+                  IncludeClassOrigin=False, PropertyList=None):
+        """Return a copy of a stored instance as it is to be returned:
+        limited to PropertyList and, if classname is given, to the
+        properties of that class."""
+        names = None
+        if PropertyList is not None:
+            names = set([x.lower() for x in PropertyList])
+        if classname is not None and \
+                classname.lower() != inst.classname.lower():
+            props = self._class_properties(ns, classname)
+            if props is not None:
+                props = set([x.lower() for x in props.keys()])
+                if names is None:
+                    names = props
+                else:
+                    names = names & props
+
+        result = CIMInstance(inst.classname, path=inst.path.copy())
+        result.path.namespace = ns
+        if IncludeQualifiers:
+            result.qualifiers = inst.qualifiers.copy()
+        for prop in inst.properties.values():
+            if names is not None and prop.name.lower() not in names:
+                continue
+            prop = prop.copy()
+            if not IncludeQualifiers:
+                prop.qualifiers = NocaseDict()
+            if not IncludeClassOrigin:
+                prop.class_origin = None
+            result.properties[prop.name] = prop
+        return result
+
+    def _add_references(self, ns, cname, key, inst):
+        references = self.references.setdefault(ns, {})
+        for prop in inst.properties.values():
+            if isinstance(prop.value, CIMInstanceName):
+                target = (prop.value.classname.lower(),
+                          _instance_key(prop.value))
+                refs = references.setdefault(target, OrderedDict())
+                refs[(cname, key, prop.name.lower())] = prop.name
+
+    def _remove_references(self, ns, cname, key, inst):
+        references = self.references.get(ns, {})
+        for prop in inst.properties.values():
+            if isinstance(prop.value, CIMInstanceName):
+                target = (prop.value.classname.lower(),
+                          _instance_key(prop.value))
+                refs = references.get(target, {})
+                refs.pop((cname, key, prop.name.lower()), None)
+                if not refs:
+                    references.pop(target, None)
+
+    def _store(self, ns, cname, key, inst, old=None):
+        """Store inst under key, replacing old."""
+        classes = self.index.setdefault(ns, OrderedDict())
+        if cname not in classes:
+            classes[cname] = OrderedDict()
+            self.subclasses.clear()
+        instances = self.instances.setdefault(ns, [])
+        if old is None:
+            instances.append(inst)
+        else:
+            self._remove_references(ns, cname, key, old)
+            for i, x in enumerate(instances):
+                if x is old:
+                    instances[i] = inst
+                    break
+        classes[cname][key] = inst
+        self._add_references(ns, cname, key, inst)
 
     def CreateInstance(self, *args, **kwargs):
         inst = len(args) > 0 and args[0] or kwargs['NewInstance']
-        try:
-            self.instances[self.default_namespace].append(inst)
-        except KeyError:
-            self.instances[self.default_namespace] = [inst]
+        ns = self._ns(kwargs.get('namespace'))
+        if inst.path is None:
+            inst = inst.copy()
+            inst.path = self._instance_path(ns, inst)
+        cname = inst.classname.lower()
+        if inst.path.keybindings:
+            key = _instance_key(inst.path)
+            if key in self.index.get(ns, {}).get(cname, {}):
+                raise CIMError(CIM_ERR_ALREADY_EXISTS, str(inst.path))
+        else:
+            self.keyless += 1
+            key = ((None, self.keyless),)
+        self._store(ns, cname, key, inst)
         return inst.path
 
+    def ModifyInstance(self, *args, **kwargs):
+        inst = len(args) > 0 and args[0] or kwargs['ModifiedInstance']
+        ns = self._ns(kwargs.get('namespace'))
+        property_list = kwargs.get('PropertyList')
+        cname, key, old = self._find(ns, inst.path)
+
+        modified = old.copy()
+        if property_list is None:
+            property_list = inst.properties.keys()
+        for name in property_list:
+            if name in inst.properties:
+                modified.properties[name] = inst.properties[name].copy()
+            elif name in modified.properties:
+                modified.properties[name] = modified.properties[name].copy()
+                modified.properties[name].value = None
+        self._store(ns, cname, key, modified, old)
+
+    def DeleteInstance(self, InstanceName, namespace=None, **params):
+        ns = self._ns(namespace or InstanceName.namespace)
+        cname, key, inst = self._find(ns, InstanceName)
+        del self.index[ns][cname][key]
+        self._remove_references(ns, cname, key, inst)
+        self.instances[ns] = [x for x in self.instances[ns] if x is not inst]
+
+    def GetInstance(self, InstanceName, namespace=None, LocalOnly=True,
+                    IncludeQualifiers=False, IncludeClassOrigin=False,
+                    PropertyList=None, **params):
+        ns = self._ns(namespace or InstanceName.namespace)
+        inst = self._find(ns, InstanceName)[2]
+        return self._filtered(ns, inst, None, IncludeQualifiers,
+                              IncludeClassOrigin, PropertyList)
+
+    def EnumerateInstanceNames(self, ClassName, namespace=None, **params):
+        ns = self._ns(namespace)
+        result = []
+        for inst in self._iter_instances(ns, _classname(ClassName)):
+            path = inst.path.copy()
+            path.namespace = ns
+            result.append(path)
+        return result
+
+    def EnumerateInstances(self, ClassName, namespace=None, LocalOnly=True,
+                           DeepInheritance=True, IncludeQualifiers=False,
+                           IncludeClassOrigin=False, PropertyList=None,
+                           **params):
+        """Return the instances of ClassName and its subclasses.  Without
+        DeepInheritance, only the properties of ClassName are returned."""
+        ns = self._ns(namespace)
+        classname = _classname(ClassName)
+        if DeepInheritance:
+            limit = None
+        else:
+            limit = classname
+        return [self._filtered(ns, x, limit, IncludeQualifiers,
+                               IncludeClassOrigin, PropertyList)
+                for x in self._iter_instances(ns, classname)]
+
+    def ExecQuery(self, QueryLanguage, Query, namespace=None, **params):
+        """Answer a SELECT query on a single class, with a WHERE clause
+        in the subset understood by the cql module."""
+        ns = self._ns(namespace)
+        if QueryLanguage.upper() not in _QUERY_LANGUAGES:
+            raise CIMError(CIM_ERR_QUERY_LANGUAGE_NOT_SUPPORTED,
+                    QueryLanguage)
+        m = _SELECT.match(Query)
+        if m is None:
+            raise CIMError(CIM_ERR_INVALID_QUERY, Query)
+        try:
+            predicate = compile_where(Query)
+        except CQLError, e:
+            raise CIMError(CIM_ERR_INVALID_QUERY, str(e))
+
+        property_list = None
+        if m.group('properties').strip() != '*':
+            property_list = [x.strip().split('.')[-1]
+                             for x in m.group('properties').split(',')]
+
+        return [self._filtered(ns, x, PropertyList=property_list)
+                for x in self._iter_instances(ns, m.group('classname'))
+                if predicate is None or predicate(x)]
+
+    def _references(self, ns, ObjectName, ResultClass=None, Role=None):
+        """Return the association instances referring to ObjectName,
+        with the name of the referring property."""
+        if not isinstance(ObjectName, CIMInstanceName):
+            raise CIMError(CIM_ERR_NOT_SUPPORTED,
+                    'Class-level associations are not supported')
+        target = (ObjectName.classname.lower(), _instance_key(ObjectName))
+        refs = self.references.get(ns, {}).get(target, {})
+        classes = None
+        if ResultClass is not None:
+            classes = self._subclasses(ns, _classname(ResultClass))
+
+        result = []
+        for (cname, key, role), name in refs.items():
+            if classes is not None and cname not in classes:
+                continue
+            if Role is not None and role != Role.lower():
+                continue
+            result.append((self.index[ns][cname][key], name))
+        return result
+
+    def _associators(self, ns, ObjectName, AssocClass=None,
+                     ResultClass=None, Role=None, ResultRole=None):
+        classes = None
+        if ResultClass is not None:
+            classes = self._subclasses(ns, _classname(ResultClass))
+
+        result = OrderedDict()
+        for assoc, role in self._references(ns, ObjectName, AssocClass,
+                                            Role):
+            for prop in assoc.properties.values():
+                if not isinstance(prop.value, CIMInstanceName) or \
+                        prop.name.lower() == role.lower():
+                    continue
+                if ResultRole is not None and \
+                        prop.name.lower() != ResultRole.lower():
+                    continue
+                try:
+                    cname, key, inst = self._find(ns, prop.value)
+                except CIMError:
+                    continue
+                if classes is None or cname in classes:
+                    result[(cname, key)] = inst
+        return result.values()
+
+    def References(self, ObjectName, namespace=None, ResultClass=None,
+                   Role=None, IncludeQualifiers=False,
+                   IncludeClassOrigin=False, PropertyList=None, **params):
+        ns = self._ns(namespace or getattr(ObjectName, 'namespace', None))
+        return [self._filtered(ns, x[0], None, IncludeQualifiers,
+                               IncludeClassOrigin, PropertyList)
+                for x in self._references(ns, ObjectName, ResultClass, Role)]
+
+    def ReferenceNames(self, ObjectName, namespace=None, ResultClass=None,
+                       Role=None, **params):
+        return [x.path for x in self.References(
+            ObjectName, namespace, ResultClass, Role, PropertyList=[])]
+
+    def Associators(self, ObjectName, namespace=None, AssocClass=None,
+                    ResultClass=None, Role=None, ResultRole=None,
+                    IncludeQualifiers=False, IncludeClassOrigin=False,
+                    PropertyList=None, **params):
+        ns = self._ns(namespace or getattr(ObjectName, 'namespace', None))
+        return [self._filtered(ns, x, None, IncludeQualifiers,
+                               IncludeClassOrigin, PropertyList)
+                for x in self._associators(ns, ObjectName, AssocClass,
+                                           ResultClass, Role, ResultRole)]
+
+    def AssociatorNames(self, ObjectName, namespace=None, AssocClass=None,
+                        ResultClass=None, Role=None, ResultRole=None,
+                        **params):
+        return [x.path for x in self.Associators(
+            ObjectName, namespace, AssocClass, ResultClass, Role,
+            ResultRole, PropertyList=[])]
+
     def rollback(self, verbose=False):
         for ns, insts in self.instances.items():
             insts.reverse()
@@ -1523,7 +2080,7 @@ def _errcode2string(code):
 
 class MOFCompiler(object):
     def __init__(self, handle, search_paths=[], verbose=False,
-                 log_func=_print_logger):
+                 log_func=_print_logger, cache_dir=None, fast_lexer=True):
         """Initialize the compiler.
 
         Keyword arguments:
@@ -1547,13 +2104,20 @@ class MOFCompiler(object):
         verbose -- True if extra messages should be printed. 
         log_func -- A callable that takes a single string argument.  
             The default logger prints to stdout. 
+        cache_dir -- A directory where the results of compiling each file
+            are kept.  A file is loaded from there instead of being parsed
+            if neither it nor the files it depends on, as found in 
+            search_paths, have changed since it was last compiled.  
+            Remove the cached results after changing schema elements that
+            the files depend on and that come from elsewhere. 
+        fast_lexer -- False to tokenize with the PLY lexer instead of
+            _FastLexer.  Both produce the same tokens.
         """
 
-        self.parser = yacc.yacc(tabmodule=_tabmodule, optimize=_optimize)
+        self.parser, self.lexer = _shared_parser(fast_lexer)
         self.parser.search_paths = search_paths
         self.handle = handle
         self.parser.handle = handle
-        self.lexer = lex.lex(lextab=_lextab, optimize=_optimize)
         self.lexer.parser = self.parser
         self.parser.qualcache = {handle.default_namespace:NocaseDict()}
         self.parser.classnames = {handle.default_namespace:[]}
@@ -1561,6 +2125,16 @@ class MOFCompiler(object):
         self.parser.verbose = verbose
         self.parser.log = log_func
         self.parser.aliases = {}
+        self.parser.records = None
+        self.cache_dir = cache_dir
+        # Records of files parsed by compile_files(), keyed by their
+        # absolute path and namespace.
+        self.parsed = {}
+        self.index = None
+        # Dependency graph of the files being compiled by compile_files(),
+        # and the digests of their contents.
+        self.graph = None
+        self.digests = None
 
     def compile_string(self, mof, ns, filename=None):
         """Compile a string of MOF.
@@ -1574,8 +2148,11 @@ class MOFCompiler(object):
             is used in status and error messages.
         """
 
-        lexer = self.lexer.clone()
-        lexer.parser = self.parser
+        return self._compile(mof, ns, filename)
+
+    def _compile(self, mof, ns, filename, records=None):
+        """Parse mof, or replay the records of its cached compilation."""
+
         try:
             oldfile = self.parser.file
         except AttributeError:
@@ -1592,7 +2169,12 @@ class MOFCompiler(object):
         if ns not in self.parser.classnames:
             self.parser.classnames[ns] = []
         try:
-            rv = self.parser.parse(mof, lexer=lexer)
+            if records is None:
+                lexer = self.lexer.clone()
+                lexer.parser = self.parser
+                rv = self.parser.parse(mof, lexer=lexer)
+            else:
+                rv = self._replay(records)
             self.parser.file = oldfile
             self.parser.mof = oldmof
             return rv
@@ -1625,11 +2207,206 @@ class MOFCompiler(object):
 
         if self.parser.verbose:
             self.parser.log('Compiling file ' + filename)
-        f = open(filename, 'r')
-        mof = f.read()
-        f.close()
+        mof = _read_mof(filename)
+
+        records = self.parsed.pop((os.path.abspath(filename), ns), None)
+        cache_file = None
+        if records is None and self.cache_dir is not None:
+            cache_file = self._cache_file(filename, ns, mof)
+            records = _load_records(cache_file)
+            if records is not None and self.parser.verbose:
+                self.parser.log('Using cached ' + cache_file)
+
+        if records is not None:
+            return self._compile(mof, ns, filename, records)
+        if cache_file is None:
+            return self.compile_string(mof, ns, filename=filename)
+
+        rv, records = self._record(mof, ns, filename)
+        _save_records(cache_file, records)
+        return rv
+
+    def compile_files(self, filenames, ns, processes=None):
+        """Compile MOF from several files, parsing them in parallel.
 
-        return self.compile_string(mof, ns, filename=filename)
+        The files and the files they depend on, as found by a quick scan 
+        for superclasses, references, instances, includes and qualifiers,
+        are parsed by a pool of processes.  Each file is parsed once the
+        files it depends on have been parsed.  The files are then applied
+        to the handle in dependency order, from the parsed results.  A 
+        file that fails to parse in the pool is compiled as usual, so
+        that errors are reported as compile_file() reports them.
+
+        Arguments:
+        filenames -- The files to read MOF from
+        ns -- The CIM namespace
+
+        Keyword arguments:
+        processes -- The number of processes to parse with.  Defaults to
+            the number of CPUs.  With 1, the files are compiled in 
+            dependency order without a pool.
+        """
+
+        names = dict([(os.path.abspath(x), x) for x in filenames])
+        graph = self._dependency_graph(names.keys())
+        levels = _levels(graph)
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        self.graph = graph
+        self.digests = {}
+        try:
+            if processes > 1:
+                self.parsed.update(self._parse_levels(levels, graph, ns,
+                                                      processes))
+            for level in levels:
+                for path in level:
+                    if path in names:
+                        self.compile_file(names[path], ns)
+        finally:
+            self.parsed.clear()
+            self.graph = None
+            self.digests = None
+
+    def _parse_levels(self, levels, graph, ns, processes):
+        """Parse the files of levels in a pool of processes and return 
+        their records, keyed like parsed."""
+
+        parsed = {}
+        pool = multiprocessing.Pool(
+            processes, _init_worker, 
+            (self.parser.search_paths, self.cache_dir, self._mof_index(),
+             graph))
+        try:
+            for level in levels:
+                tasks = []
+                for path in level:
+                    deps = {}
+                    for dep in _closure(graph, path):
+                        if (dep, ns) in parsed:
+                            deps[(dep, ns)] = parsed[(dep, ns)]
+                    tasks.append((path, ns, deps))
+                for path, records in pool.imap_unordered(_parse_in_worker,
+                                                         tasks):
+                    if records is not None:
+                        parsed[(path, ns)] = records
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        return parsed
+
+    def _parse_file(self, filename, ns):
+        """Return the records of the productions of a file, from the cache
+        or by compiling it."""
+
+        mof = _read_mof(filename)
+        cache_file = None
+        if self.cache_dir is not None:
+            cache_file = self._cache_file(filename, ns, mof)
+            records = _load_records(cache_file)
+            if records is not None:
+                return records
+
+        records = self._record(mof, ns, filename)[1]
+        if cache_file is not None:
+            _save_records(cache_file, records)
+        return records
+
+    def _record(self, mof, ns, filename):
+        """Compile mof and return the result along with the records of its
+        productions."""
+
+        oldrecords = self.parser.records
+        self.parser.records = []
+        try:
+            rv = self.compile_string(mof, ns, filename=filename)
+            return rv, self.parser.records
+        finally:
+            self.parser.records = oldrecords
+
+    def _cache_file(self, filename, ns, mof):
+        """Return the cache file of filename, named after its contents and
+        the contents of the files it depends on."""
+
+        path = os.path.abspath(filename)
+        graph = self.graph
+        if graph is None or path not in graph:
+            graph = self._dependency_graph([path])
+        deps = [(x, self._digest(x)) for x in sorted(_closure(graph, path))]
+        return os.path.join(self.cache_dir, 
+                            _cache_key(filename, ns, mof, deps) + '.pickle')
+
+    def _digest(self, path):
+        """Return the digest of a file, computed once per compile_files()
+        call."""
+
+        if self.digests is None:
+            return _file_digest(path)
+        if path not in self.digests:
+            self.digests[path] = _file_digest(path)
+        return self.digests[path]
+
+    def _dependency_graph(self, filenames):
+        """Return a dict mapping each of filenames, and each file they 
+        depend on, to the set of files it depends on."""
+
+        index = self._mof_index()
+        graph = OrderedDict()
+        pending = list(filenames)
+        while pending:
+            path = pending.pop(0)
+            if path in graph:
+                continue
+            try:
+                mof = _read_mof(path)
+            except IOError:
+                # compile_file() reports missing files.
+                graph[path] = set()
+                continue
+
+            deps = set()
+            for superclass, reference, instance, include in \
+                    _DEPENDENCY.findall(mof):
+                if include:
+                    deps.add(os.path.abspath(
+                        os.path.join(os.path.dirname(path), include)))
+                    continue
+                dep = index.get((superclass or reference or instance).lower())
+                if dep:
+                    deps.add(os.path.abspath(dep))
+            if '[' in mof:
+                for fname in ['qualifiers', 'qualifiers_optional']:
+                    if fname in index:
+                        deps.add(os.path.abspath(index[fname]))
+            deps.discard(path)
+
+            graph[path] = deps
+            pending.extend(deps)
+        return graph
+
+    def _replay(self, records):
+        """Apply the recorded productions of a file to the handle."""
+
+        oldrecords = self.parser.records
+        self.parser.records = None
+        try:
+            for kind, value, lineno in records:
+                p = _Production(self.parser, value, lineno)
+                if kind == 'qualifier':
+                    p_mp_setQualifier(p)
+                elif kind == 'class':
+                    p_mp_createClass(p)
+                elif kind == 'instance':
+                    _instance_class(p, value.classname)
+                    p_mp_createInstance(p)
+                elif kind == 'pragma':
+                    _pragma(p, *value)
+                elif kind == 'alias':
+                    self.parser.aliases[value[0]] = value[1]
+        finally:
+            self.parser.records = oldrecords
 
     def find_mof(self, classname):
         """Find a MOF file corresponding to a CIM class name.  The search_paths
@@ -1639,21 +2416,255 @@ class MOFCompiler(object):
         classname -- The name of the class to look for
         """
 
-        classname = classname.lower()
-        for search in self.parser.search_paths:
-            for root, dirs, files in os.walk(search):
-                for file_ in files:
-                    if file_.endswith('.mof') and \
-                            file_[:-4].lower() == classname:
-                        return root + '/' + file_
-        return None
+        return self._mof_index().get(classname.lower())
+
+    def _mof_index(self):
+        """Return a dict mapping lower-case class names to MOF files.
+
+        The search_paths are walked once, and again only when they change.
+        Files added to them later are not found.
+        """
+
+        paths = list(self.parser.search_paths)
+        if self.index is None or self.index[0] != paths:
+            index = {}
+            for search in paths:
+                for root, dirs, files in os.walk(search):
+                    for file_ in files:
+                        if file_.endswith('.mof'):
+                            index.setdefault(file_[:-4].lower(), 
+                                             root + '/' + file_)
+            self.index = (paths, index)
+        return self.index[1]
 
     def rollback(self, verbose=False):
         self.handle.rollback(verbose=verbose)
 
-def _build():
-    yacc.yacc(optimize=_optimize, tabmodule=_tabmodule)
-    lex.lex(optimize=_optimize, lextab=_lextab)
+# Names that a MOF file may depend on: superclasses, referenced classes,
+# classes of instances and included files.
+_DEPENDENCY = re.compile(
+    r'\bclass\s+\w+\s*:\s*(\w+)|'
+    r'\b(\w+)\s+REF\b|'
+    r'\binstance\s+of\s+(\w+)|'
+    r'#\s*pragma\s+include\s*\(\s*"([^"]+)"', re.I)
+
+def _read_mof(filename):
+    f = open(filename, 'r')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def _closure(graph, path):
+    """Return the files path depends on, directly or not."""
+    seen = set()
+    pending = list(graph.get(path, ()))
+    while pending:
+        dep = pending.pop()
+        if dep not in seen:
+            seen.add(dep)
+            pending.extend(graph.get(dep, ()))
+    return seen
+
+def _levels(graph):
+    """Return the files of graph in lists, each depending only on files of
+    the lists before it.  Cycles are broken at the first file in them."""
+
+    done = set()
+    levels = []
+    pending = list(graph)
+    while pending:
+        level = [x for x in pending if graph[x] <= done]
+        if not level:
+            level = pending[:1]
+        levels.append(level)
+        done.update(level)
+        pending = [x for x in pending if x not in done]
+    return levels
+
+# The compiler of a compile_files() worker process.
+_worker = None
+
+def _init_worker(search_paths, cache_dir, index, graph):
+    global _worker
+    _worker = MOFCompiler(MOFWBEMConnection(), search_paths=search_paths,
+                          log_func=lambda msg: None, cache_dir=cache_dir)
+    _worker.index = (list(search_paths), index)
+    _worker.graph = graph
+    _worker.digests = {}
+
+def _parse_in_worker(task):
+    path, ns, parsed = task
+    _worker.parsed = parsed
+    try:
+        return path, _worker._parse_file(path, ns)
+    except Exception:
+        return path, None
+
+class _Production(object):
+    """Stands in for the yacc production of a cached MOF production."""
+
+    def __init__(self, parser, value, lineno):
+        self.parser = parser
+        self.lexer = self
+        self.lineno = lineno
+        self.value = value
+
+    def __getitem__(self, index):
+        return self.value
+
+def _cache_key(filename, ns, mof, deps=()):
+    """Return the cache key of a file, given the (path, digest) pairs of
+    the files it depends on."""
+    digest = hashlib.sha1()
+    parts = [str(_cache_version), os.path.abspath(filename), ns, mof]
+    for path, dep_digest in deps:
+        parts.extend([path, dep_digest])
+    for part in parts:
+        digest.update(part)
+        digest.update('\0')
+    return digest.hexdigest()
+
+def _file_digest(path):
+    """Return the SHA-1 digest of a file's contents, or '' if it can't be
+    read."""
+    try:
+        return hashlib.sha1(_read_mof(path)).hexdigest()
+    except IOError:
+        return ''
+
+def _load_records(cache_file):
+    """Return the records cached in cache_file, or None."""
+    try:
+        f = open(cache_file, 'rb')
+    except IOError:
+        return None
+    try:
+        try:
+            return cPickle.load(f)
+        except Exception:
+            return None
+    finally:
+        f.close()
+
+def _save_records(cache_file, records):
+    """Write records to cache_file.  Failures to write are ignored."""
+    dirname = os.path.dirname(cache_file)
+    try:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, tmp = tempfile.mkstemp(dir=dirname)
+    except OSError:
+        return
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            cPickle.dump(records, f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(tmp, cache_file)
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+def _table_dirs():
+    """Return the directories searched for parser tables, in order.
+
+    The tables are built into the package directory at install time by
+    setup.py.  When they are missing or out of date there, they are
+    rebuilt at run time and written to $PYWBEM_TABLE_DIR or
+    ~/.cache/pywbem, never to the package directory.
+    """
+
+    cache_dir = os.environ.get('PYWBEM_TABLE_DIR')
+    if not cache_dir:
+        cache_dir = os.path.join(
+            os.environ.get('XDG_CACHE_HOME') or
+            os.path.join(os.path.expanduser('~'), '.cache'), 'pywbem')
+    return [os.path.dirname(os.path.abspath(__file__)), cache_dir]
+
+def _read_tables():
+    """Return the first table module built for this PLY version and
+    grammar, or None."""
+
+    pinfo = yacc.ParserReflect(globals(), log=yacc.NullLogger())
+    pinfo.get_all()
+    signature = pinfo.signature()
+
+    for dirname in _table_dirs():
+        filename = os.path.join(dirname, _tabmodule + '.py')
+        if not os.path.exists(filename):
+            continue
+        try:
+            tables = imp.load_source('_' + _tabmodule, filename)
+        except Exception:
+            continue
+        if getattr(tables, '_tabversion', None) == yacc.__tabversion__ and \
+                getattr(tables, '_lr_signature', None) == signature:
+            return tables
+    return None
+
+def _writable_dir():
+    """Return the first directory after the package directory that tables
+    built at run time can be written to, or None."""
+
+    for dirname in _table_dirs()[1:]:
+        try:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+        except OSError:
+            continue
+        if os.access(dirname, os.W_OK):
+            return dirname
+    return None
+
+def _build(outputdir=None):
+    """Return the parser, building its tables and writing them to
+    outputdir unless up-to-date tables can be imported already.
+    outputdir defaults to the package directory, for setup.py."""
+
+    if outputdir is None:
+        outputdir = _table_dirs()[0]
+    return yacc.yacc(module=sys.modules[__name__], tabmodule=_tabmodule,
+                     debug=0, outputdir=outputdir)
+
+_parser = None
+_lexer = None
+
+def _shared_parser(fast_lexer=True):
+    """Return a parser and a lexer for a new MOFCompiler.
+
+    The parser tables and PLY lexer are built once per process and
+    shared.  Each compiler gets its own copy of the parser, since the
+    compiler keeps its state on it.  With fast_lexer, the lexer is a
+    _FastLexer instead of the PLY lexer.
+    """
+
+    global _parser, _lexer
+
+    if _parser is None:
+        module = sys.modules[__name__]
+        tables = _read_tables()
+        if tables is not None:
+            _parser = yacc.yacc(module=module, tabmodule=tables, optimize=1,
+                                debug=0, write_tables=0)
+        else:
+            outputdir = _writable_dir()
+            if outputdir is not None:
+                _parser = _build(outputdir)
+            else:
+                _parser = yacc.yacc(module=module, tabmodule=_tabmodule,
+                                    debug=0, write_tables=0)
+
+    if fast_lexer:
+        return copy.copy(_parser), _FastLexer()
+
+    if _lexer is None:
+        _lexer = lex.lex(module=sys.modules[__name__])
+
+    return copy.copy(_parser), _lexer.clone()
 
 
 if __name__ == '__main__':
@@ -1680,6 +2691,12 @@ if __name__ == '__main__':
     oparser.add_option('-p', '--password', 
             dest='password', metavar='Password',
             help='Specify the password')
+    oparser.add_option('-c', '--cache', 
+            dest='cache_dir', metavar='Path',
+            help='Directory to cache the compiled MOF files in')
+    oparser.add_option('-j', '--jobs', 
+            dest='jobs', metavar='N', type='int',
+            help='Parse the MOF files with N processes')
 
     (options, args) = oparser.parse_args()
     search = options.search
@@ -1716,13 +2733,20 @@ if __name__ == '__main__':
     verbose = options.verbose and not options.remove
 
     mofcomp = MOFCompiler(handle=conn, search_paths=search, 
-            verbose=verbose)
+            verbose=verbose, cache_dir=options.cache_dir)
+
+    fnames = []
+    for fname in args:
+        if fname[0] != '/':
+            fname = os.path.curdir + '/' + fname
+        fnames.append(fname)
 
     try:
-        for fname in args:
-            if fname[0] != '/':
-                fname = os.path.curdir + '/' + fname
-            mofcomp.compile_file(fname, options.ns)
+        if options.jobs:
+            mofcomp.compile_files(fnames, options.ns, processes=options.jobs)
+        else:
+            for fname in fnames:
+                mofcomp.compile_file(fname, options.ns)
     except MOFParseError, pe:
         sys.exit(1)
     except CIMError, ce:
@@ -0,0 +1,51 @@
+#!/usr/bin/python
+#
+# Benchmark the time taken to import pywbem.
+#
+# Each import runs in a fresh interpreter.  Importing the package alone
+# defers the operations, HTTP and parsing submodules; looking up
+# WBEMConnection and ParseError loads them all, as importing the package
+# used to.
+#
+# Usage: bench_import.py [REPEAT]
+#
+
+import subprocess
+import sys
+
+IMPORTS = (
+    ('all submodules',
+     'import pywbem; pywbem.WBEMConnection; pywbem.ParseError'),
+    ('import pywbem', 'import pywbem'),
+    ('import twisted_client', 'import pywbem.twisted_client'),
+    )
+
+TIMER = """
+import sys, time
+start = time.time()
+%s
+print time.time() - start, len(sys.modules)
+"""
+
+def import_time(statement):
+    output = subprocess.check_output(
+        [sys.executable, '-W', 'ignore', '-c', TIMER % statement])
+    seconds, modules = output.split()
+    return float(seconds), int(modules)
+
+def main():
+    repeat = len(sys.argv) > 1 and int(sys.argv[1]) or 10
+
+    print 'Fresh interpreters, best of %d' % repeat
+
+    baseline = None
+
+    for name, statement in IMPORTS:
+        results = [import_time(statement) for i in range(repeat)]
+        best = min(x[0] for x in results)
+        baseline = baseline or best
+        print '%-24s %8.4fs  %5.1fx  %d modules' % \
+              (name, best, baseline / best, results[0][1])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+#
+# Benchmark serializing many instances of one class to CIM-XML.
+#
+# Compares instance.tocimxml().toxml() for each instance with
+# InstanceSerializer, which builds the markup around each property's
+# value once per class.
+#
+# Usage: bench_instancexml.py [INSTANCES [REPEAT]]
+#
+
+import sys
+import timeit
+
+from pywbem import *
+from pywbem.instancexml import InstanceSerializer
+
+def instances(count, properties = 30):
+    return [CIMInstance(
+                'CIM_StorageVolume',
+                dict([('Prop%d' % p, 'value %d' % i)
+                      for p in range(properties)] +
+                     [('BlockSize', Uint64(512)),
+                      ('NumberOfBlocks', Uint64(i * 1024)),
+                      ('OperationalStatus', [Uint16(2), Uint16(32768)]),
+                      ('Primordial', False)]),
+                path = CIMInstanceName('CIM_StorageVolume',
+                                       {'DeviceID': 'vol%d' % i}))
+            for i in range(count)]
+
+def main():
+    count = len(sys.argv) > 1 and int(sys.argv[1]) or 1000
+    repeat = len(sys.argv) > 2 and int(sys.argv[2]) or 5
+
+    objs = instances(count)
+
+    def tocimxml():
+        return ''.join(x.tocimxml().toxml() for x in objs)
+
+    def serializer():
+        return InstanceSerializer().toxml(objs)
+
+    assert tocimxml() == serializer()
+
+    print '%d instances, best of %d' % (count, repeat)
+
+    baseline = None
+
+    for name, func in (('tocimxml().toxml()', tocimxml),
+                       ('InstanceSerializer', serializer)):
+        best = min(timeit.repeat(func, number = 1, repeat = repeat))
+        baseline = baseline or best
+        print '%-24s %8.4fs  %5.1fx' % (name, best, baseline / best)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+#
+# Benchmark lexing and compiling the CIM schema.
+#
+# Compares the PLY lexer with mof_compiler's fast lexer, first by
+# tokenizing every MOF file of the schema, then by compiling the whole
+# schema with each.  Run test_mof_compiler.py first to download the
+# schema into the schema directory.
+#
+# Usage: bench_mof_compiler.py [SCHEMA_MOF [REPEAT]]
+#
+
+import os
+import sys
+import timeit
+
+from pywbem import mof_compiler
+from pywbem.mof_compiler import MOFCompiler, MOFWBEMConnection
+
+SCHEMA_MOF = 'schema/cim_schema_2.20.0.mof'
+
+def mof_files(dirname):
+    for path, dirs, files in os.walk(dirname):
+        for name in files:
+            if name.lower().endswith('.mof'):
+                yield os.path.join(path, name)
+
+class Parser(object):
+    """The parser attributes used by the lexers."""
+
+    mof = ''
+
+    def log(self, msg):
+        pass
+
+def tokenize(fast_lexer, mofs):
+    lexer = mof_compiler._shared_parser(fast_lexer)[1]
+    lexer.parser = Parser()
+    count = 0
+    for mof in mofs:
+        lexer.input(mof)
+        while lexer.token() is not None:
+            count += 1
+    return count
+
+def compile_schema(fast_lexer, schema):
+    mofcomp = MOFCompiler(MOFWBEMConnection(),
+                          search_paths=[os.path.dirname(schema)],
+                          log_func=lambda msg: None,
+                          fast_lexer=fast_lexer)
+    mofcomp.compile_file(schema, 'root/cimv2')
+    return len(mofcomp.handle.classes['root/cimv2'])
+
+def compare(title, func, *args):
+    print title
+
+    baseline = None
+    results = []
+
+    for name, fast_lexer in (('PLY lexer', False), ('fast lexer', True)):
+        results.append(func(fast_lexer, *args))
+        best = min(timeit.repeat(lambda: func(fast_lexer, *args),
+                                 number = 1, repeat = repeat))
+        baseline = baseline or best
+        print '  %-12s %8.4fs  %5.1fx' % (name, best, baseline / best)
+
+    assert results[0] == results[1]
+    return results[0]
+
+def main():
+    global repeat
+
+    schema = len(sys.argv) > 1 and sys.argv[1] or SCHEMA_MOF
+    repeat = len(sys.argv) > 2 and int(sys.argv[2]) or 3
+
+    if not os.path.exists(schema):
+        sys.exit('%s not found.  Run test_mof_compiler.py to download '
+                 'the schema.' % schema)
+
+    schema = os.path.abspath(schema)
+    mofs = [open(x).read() for x in mof_files(os.path.dirname(schema))]
+
+    # Build the parser tables before timing anything.
+    mof_compiler._shared_parser(False)
+
+    tokens = compare('Tokenizing %d files, best of %d' % (len(mofs), repeat),
+                     tokenize, mofs)
+    print '  %d tokens' % tokens
+
+    classes = compare('Compiling %s, best of %d' %
+                      (os.path.basename(schema), repeat),
+                      compile_schema, schema)
+    print '  %d classes' % classes
+
+if __name__ == '__main__':
+    main()
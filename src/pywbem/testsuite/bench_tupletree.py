@@ -0,0 +1,76 @@
+#!/usr/bin/python
+#
+# Benchmark conversion of parsed responses to tupletrees.
+#
+# Compares the conversion used by twisted_client before tupletree accepted
+# already-parsed elements (serialize each INSTANCE with tostring(), re-parse
+# it and walk it recursively, checking each child's type string) with
+# converting the parsed elements directly.
+#
+# Usage: bench_tupletree.py [INSTANCES [REPEAT]]
+#
+
+import sys
+import timeit
+
+import xml.etree.cElementTree as cElementTree
+from xml.etree.ElementTree import fromstring, tostring
+
+from pywbem.tupletree import ele_to_tupletree
+
+def recursive_ele_to_tupletree(node):
+    """The original recursive converter."""
+
+    contents = [node.text]
+    for child in node:
+        if str(type(child)) == "<type 'Element'>":
+            contents.append(recursive_ele_to_tupletree(child))
+    return (node.tag, node.attrib, contents, None)
+
+def recursive_xml_to_tupletree(xml_string):
+    import xml.etree.cElementTree as ElementTree
+    return recursive_ele_to_tupletree(ElementTree.fromstring(xml_string))
+
+PROPERTY = '<PROPERTY NAME="Prop%d" TYPE="string"><VALUE>value %d</VALUE>' \
+           '</PROPERTY>'
+
+ARRAY = '<PROPERTY.ARRAY NAME="Status" TYPE="uint16"><VALUE.ARRAY>' \
+        '<VALUE>2</VALUE><VALUE>32768</VALUE></VALUE.ARRAY></PROPERTY.ARRAY>'
+
+def response(instances, properties = 30):
+    body = ''.join(PROPERTY % (i, i) for i in range(properties)) + ARRAY
+    instance = '<INSTANCE CLASSNAME="CIM_StorageVolume">%s</INSTANCE>' % body
+    return '<IRETURNVALUE>%s</IRETURNVALUE>' % (instance * instances)
+
+def main():
+    instances = len(sys.argv) > 1 and int(sys.argv[1]) or 1000
+    repeat = len(sys.argv) > 2 and int(sys.argv[2]) or 5
+
+    xml = fromstring(response(instances))
+    cxml = cElementTree.fromstring(response(instances))
+
+    def roundtrip():
+        return [recursive_xml_to_tupletree(tostring(x))
+                for x in xml.findall('.//INSTANCE')]
+
+    def direct():
+        return [ele_to_tupletree(x) for x in xml.findall('.//INSTANCE')]
+
+    def direct_celementtree():
+        return [ele_to_tupletree(x) for x in cxml.findall('.//INSTANCE')]
+
+    assert roundtrip() == direct() == direct_celementtree()
+
+    print '%d instances, best of %d' % (instances, repeat)
+
+    baseline = None
+
+    for name, func in (('tostring + recursive', roundtrip),
+                       ('direct (ElementTree)', direct),
+                       ('direct (cElementTree)', direct_celementtree)):
+        best = min(timeit.repeat(func, number = 1, repeat = repeat))
+        baseline = baseline or best
+        print '%-24s %8.4fs  %5.1fx' % (name, best, baseline / best)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/python
+#
+# Test CIMProvider2 enumeration and ProviderProxy module loading.
+#
+
+import comfychair
+import os
+import shutil
+import sys
+import tempfile
+
+from pywbem import *
+from pywbem.cim_provider2 import CIMProvider2, ProviderProxy, _batches
+
+class Logger(object):
+    def log_debug(self, msg):
+        pass
+
+class CIMOMHandle(object):
+    """Serves GetInstance for the names in instances."""
+
+    def __init__(self, instances):
+        self.instances = instances
+        self.requests = []
+
+    def GetInstance(self, instance_name, property_list):
+        self.requests.append(instance_name['Name'])
+        inst = self.instances.get(instance_name['Name'])
+        if inst is None:
+            raise CIMError(CIM_ERR_NOT_FOUND, '')
+        return inst
+
+class Env(object):
+    def __init__(self, ch=None):
+        self.ch = ch
+
+    def get_logger(self):
+        return Logger()
+
+    def get_cimom_handle(self):
+        return self.ch
+
+class ReusedModelProvider(CIMProvider2):
+    """Yields the model for every instance, as generated providers do."""
+
+    batch_size = 2
+
+    def __init__(self, count):
+        self.count = count
+        self.batches = []
+
+    def enum_instances(self, env, model, keys_only):
+        model.path.update({'Name': None})
+        for i in range(self.count):
+            model['Name'] = 'disk%d' % i
+            yield model
+
+    def enum_instances_batch(self, env, model, keys_only, batch_size):
+        for batch in CIMProvider2.enum_instances_batch(
+                self, env, model, keys_only, batch_size):
+            self.batches.append(len(batch))
+            yield batch
+
+class BulkProvider(CIMProvider2):
+    """Overrides enum_instances_batch only."""
+
+    def enum_instances_batch(self, env, model, keys_only, batch_size):
+        yield [CIMInstance(model.classname, {'Name': 'a'}),
+               CIMInstance(model.classname, {'Name': 'b'})]
+        yield [CIMInstance(model.classname, {'Name': 'c'})]
+
+def path():
+    return CIMInstanceName('CIM_DiskDrive', namespace = 'root/cimv2')
+
+def named(classname, name):
+    return CIMInstanceName(classname, {'Name': name})
+
+class AssociationProvider(CIMProvider2):
+    """Associates a system with its disks and its chassis."""
+
+    batch_size = 2
+
+    def __init__(self):
+        self.batches = []
+
+    def references(self, env, object_name, model, result_class_name,
+                   role, result_role, keys_only):
+        for name in ['disk0', 'chassis', 'disk1', 'disk2']:
+            classname = 'CIM_DiskDrive'
+            if name == 'chassis':
+                classname = 'CIM_Chassis'
+            inst = model.copy()
+            inst['Antecedent'] = object_name
+            inst['Dependent'] = named(classname, name)
+            yield inst
+
+    def get_instances_batch(self, env, instance_names, property_list):
+        self.batches.append([x['Name'] for x in instance_names])
+        return CIMProvider2.get_instances_batch(self, env, instance_names,
+                                                property_list)
+
+def associators(provider, env):
+    return provider.MI_associators(
+        env, CIMInstanceName('CIM_System', {'Name': 'sys'},
+                             namespace = 'root/cimv2'),
+        'CIM_SystemDevice', None, None, None, None)
+
+class Batches(comfychair.TestCase):
+    def runtest(self):
+        # Each instance is used before the next is requested, as it is
+        # when the provider yields instances one at a time.
+        provider = ReusedModelProvider(5)
+        names = [x['Name']
+                 for x in provider.MI_enumInstances(Env(), path(), None)]
+
+        self.assert_equal(names, ['disk%d' % i for i in range(5)])
+        self.assert_equal(provider.batches, [2, 2, 1])
+
+        names = [x['Name']
+                 for x in provider.MI_enumInstanceNames(Env(), path())]
+        self.assert_equal(names, ['disk%d' % i for i in range(5)])
+
+class Backpressure(comfychair.TestCase):
+    """A batch is only requested once the previous one is consumed."""
+
+    def runtest(self):
+        provider = ReusedModelProvider(5)
+        gen = provider.MI_enumInstances(Env(), path(), None)
+
+        gen.next()
+        self.assert_equal(provider.batches, [2])
+        gen.next()
+        self.assert_equal(provider.batches, [2])
+        gen.next()
+        self.assert_equal(provider.batches, [2, 2])
+
+class Copies(comfychair.TestCase):
+    """The model is copied only while a batch holds it across a yield."""
+
+    def runtest(self):
+        model = CIMInstance('CIM_DiskDrive')
+
+        def gen():
+            for i in range(3):
+                model['Name'] = 'disk%d' % i
+                yield model
+
+        for batch in _batches(gen(), model, 1):
+            self.assert_(batch[0] is model)
+
+        batches = []
+        for batch in _batches(gen(), model, 2):
+            batches.append([x is model for x in batch])
+            self.assert_equal(batch[-1]['Name'], model['Name'])
+        self.assert_equal(batches, [[False, True], [False]])
+
+class Override(comfychair.TestCase):
+    def runtest(self):
+        instances = BulkProvider().MI_enumInstances(Env(), path(), None)
+        self.assert_equal([x['Name'] for x in instances], ['a', 'b', 'c'])
+
+class NoInstances(comfychair.TestCase):
+    """Providers that don't implement enum_instances return nothing."""
+
+    def runtest(self):
+        provider = CIMProvider2()
+        self.assert_equal(
+            list(provider.MI_enumInstances(Env(), path(), None)), [])
+        self.assert_equal(
+            list(provider.MI_enumInstanceNames(Env(), path())), [])
+
+class Associators(comfychair.TestCase):
+    """Associated objects are resolved in batches of one class."""
+
+    def runtest(self):
+        ch = CIMOMHandle(dict((x, CIMInstance('CIM_DiskDrive', {'Name': x}))
+                              for x in ['disk0', 'disk1', 'chassis']))
+        provider = AssociationProvider()
+        gen = associators(provider, Env(ch))
+
+        # The first batch is full once disk1 is seen.
+        self.assert_equal(gen.next()['Name'], 'disk0')
+        self.assert_equal(provider.batches, [['disk0', 'disk1']])
+
+        rest = list(gen)
+        self.assert_equal(sorted(provider.batches),
+                          [['chassis'], ['disk0', 'disk1'], ['disk2']])
+
+        # disk2 doesn't exist, and paths are filled in.
+        self.assert_equal(sorted(x['Name'] for x in rest),
+                          ['chassis', 'disk1'])
+        for inst in rest:
+            self.assert_equal(inst.path.namespace, 'root/cimv2')
+        self.assert_equal(sorted(ch.requests),
+                          ['chassis', 'disk0', 'disk1', 'disk2'])
+
+PROVIDER_SOURCE = '''
+import pywbem
+from pywbem.cim_provider2 import CIMProvider2
+
+class Provider(CIMProvider2):
+    def enum_instances(self, env, model, keys_only):
+        yield pywbem.CIMInstance(model.classname, {'Version': pywbem.Uint32(%d)})
+
+def get_providers(env):
+    return {'CIM_Foo': Provider()}
+'''
+
+class ProviderModule(comfychair.TestCase):
+    """Provider modules are loaded on first use and reloaded when their
+    modification time changes."""
+
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test_provider_module.py')
+        self.write(1, 1000)
+
+    def write(self, version, mtime):
+        f = open(self.path, 'w')
+        f.write(PROVIDER_SOURCE % version)
+        f.close()
+        for suffix in ('c', 'o'):
+            if os.path.exists(self.path + suffix):
+                os.unlink(self.path + suffix)
+        os.utime(self.path, (mtime, mtime))
+
+    def teardown(self):
+        sys.modules.pop('test_provider_module', None)
+        if self.dir in sys.path:
+            sys.path.remove(self.dir)
+        shutil.rmtree(self.dir)
+
+    def versions(self, proxy):
+        objpath = CIMInstanceName('CIM_Foo')
+        return [x['Version'] for x in
+                proxy.MI_enumInstances(Env(), objpath, None)]
+
+    def runtest(self):
+        proxy = ProviderProxy(Env(), self.path)
+        self.assert_equal(proxy.provmod, None)
+        self.assert_('test_provider_module' not in sys.modules)
+
+        self.assert_equal(self.versions(proxy), [1])
+        self.assert_equal(proxy.callables.keys(),
+                          [('cim_foo', 'MI_enumInstances')])
+
+        callable = proxy.callables[('cim_foo', 'MI_enumInstances')]
+        self.assert_equal(self.versions(proxy), [1])
+        self.assert_(
+            proxy.callables[('cim_foo', 'MI_enumInstances')] is callable)
+
+        self.write(2, 2000)
+        self.assert_equal(self.versions(proxy), [2])
+        self.assert_(
+            proxy.callables[('cim_foo', 'MI_enumInstances')] is not callable)
+
+#################################################################
+# Main function
+#################################################################
+
+tests = [
+    Batches,
+    Backpressure,
+    Copies,
+    Override,
+    NoInstances,
+    Associators,
+    ProviderModule,
+    ]
+
+if __name__ == '__main__':
+    comfychair.main(tests)
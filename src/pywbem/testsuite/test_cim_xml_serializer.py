@@ -0,0 +1,124 @@
+#!/usr/bin/python
+#
+# Check that cim_xml elements serialize exactly as xml.dom.minidom
+# would serialize the same document.
+#
+
+import comfychair
+
+from xml.dom import minidom
+
+from pywbem import *
+from pywbem import cim_xml
+
+import test_cim_xml
+
+def to_minidom(element, doc = None):
+    """Rebuild a cim_xml element as a minidom node."""
+
+    if doc is None:
+        doc = minidom.Document()
+
+    if element.nodeType == cim_xml.TEXT_NODE:
+        # Values aren't always strings, so bypass createTextNode()'s
+        # check like cim_xml used to.
+        node = minidom.Text()
+        node.data = element.data
+        return node
+
+    node = doc.createElement(element.tagName)
+    for name, value in element.attributes.items():
+        node.setAttribute(name, value)
+    for child in element.childNodes:
+        node.appendChild(to_minidom(child, doc))
+
+    return node
+
+class SerializerTest(comfychair.TestCase):
+
+    def check(self, element):
+        expected = to_minidom(element)
+
+        self.assert_equal(element.toxml(), expected.toxml())
+        self.assert_equal(type(element.toxml()), type(expected.toxml()))
+        self.assert_equal(element.toprettyxml(indent = '  '),
+                          expected.toprettyxml(indent = '  '))
+
+class Elements(SerializerTest):
+    """Every element built by test_cim_xml."""
+
+    def runtest(self):
+        for test in test_cim_xml.tests:
+            try:
+                test().setup()
+            except Exception:
+                pass
+
+        self.assert_(len(test_cim_xml.CIMXMLTest.xml) > 50)
+
+        for element in test_cim_xml.CIMXMLTest.xml:
+            self.check(element)
+
+class Objects(SerializerTest):
+    """CIM objects, including values that need escaping."""
+
+    def runtest(self):
+        path = CIMInstanceName(
+            'CIM_Foo', {'Name': 'a<b>&"c"', 'Count': Uint32(3),
+                        'Flag': True,
+                        'Ref': CIMInstanceName('CIM_Bar', {'Id': u'\xe9'})},
+            namespace = 'root/cimv2', host = 'leonardo')
+
+        instance = CIMInstance(
+            'CIM_Foo',
+            {'Name': 'a&b',
+             'Sizes': [Uint8(1), Uint8(2)],
+             'Empty': CIMProperty('Empty', None, type = 'string'),
+             'Blank': '',
+             'Embedded': CIMProperty('Embedded',
+                                     CIMInstance('CIM_E', {'x': '<y>'}),
+                                     embedded_object = 'instance'),
+             'Other': CIMProperty('Other', path)},
+            qualifiers = {'Key': CIMQualifier('Key', True)},
+            path = path)
+
+        klass = CIMClass(
+            'CIM_Foo', superclass = 'CIM_Bar',
+            properties = {'p': CIMProperty(
+                'p', None, type = 'uint32',
+                qualifiers = {'Description':
+                              CIMQualifier('Description', 'say "hi"')})},
+            methods = {'m': CIMMethod(
+                'm', 'uint32',
+                parameters = {'a': CIMParameter('a', 'string',
+                                                is_array = True,
+                                                array_size = 3)})})
+
+        for obj in [path, instance, klass,
+                    CIMClassName('CIM_Foo', namespace = 'root/cimv2'),
+                    CIMQualifierDeclaration('Key', 'boolean', value = False,
+                                            scopes = {'PROPERTY': True})]:
+            self.check(obj.tocimxml())
+
+class Text(comfychair.TestCase):
+    """Text is converted with %s, and empty text keeps both tags."""
+
+    def runtest(self):
+        self.assert_equal(cim_xml.VALUE('').toxml(), '<VALUE></VALUE>')
+        self.assert_equal(cim_xml.VALUE(None).toxml(), '<VALUE/>')
+        self.assert_equal(cim_xml.VALUE(True).toxml(), '<VALUE>True</VALUE>')
+        self.assert_equal(cim_xml.VALUE(u'\xe9').toxml(encoding = 'utf-8'),
+                          '<VALUE>\xc3\xa9</VALUE>')
+
+#################################################################
+# Main function
+#################################################################
+
+tests = [
+    Elements,
+    Objects,
+    Text,
+    ]
+
+if __name__ == '__main__':
+    comfychair.main(tests)
@@ -0,0 +1,123 @@
+#!/usr/bin/python
+#
+# Test caching of class relationships for subclass checks.
+#
+
+import comfychair
+
+from pywbem import *
+
+CLASSES = [
+    CIMClass('CIM_ManagedElement'),
+    CIMClass('CIM_ManagedSystemElement', superclass = 'CIM_ManagedElement'),
+    CIMClass('CIM_LogicalElement', superclass = 'CIM_ManagedSystemElement'),
+    CIMClass('CIM_LogicalDevice', superclass = 'CIM_LogicalElement'),
+    CIMClass('CIM_StorageExtent', superclass = 'CIM_LogicalDevice'),
+    CIMClass('Vendor_Volume', superclass = 'CIM_StorageExtent'),
+    ]
+
+class FakeConnection(WBEMConnection):
+    """A WBEMConnection answering class operations from CLASSES and
+    counting the requests that would have gone to the server."""
+
+    def __init__(self):
+        WBEMConnection.__init__(self, 'http://localhost')
+        self.calls = []
+
+    def GetClass(self, ClassName, namespace = None, **params):
+        self.calls.append(('GetClass', ClassName))
+        for klass in CLASSES:
+            if klass.classname.lower() == ClassName.lower():
+                return klass
+        raise CIMError(CIM_ERR_NOT_FOUND, ClassName)
+
+    def EnumerateClasses(self, namespace = None, **params):
+        self.calls.append(('EnumerateClasses', namespace))
+        return CLASSES
+
+class Lazy(comfychair.TestCase):
+    def runtest(self):
+        ch = FakeConnection()
+
+        self.assert_(is_subclass(ch, 'root/cimv2', 'CIM_LogicalDevice',
+                                 'Vendor_Volume'))
+        self.assert_equal(len(ch.calls), 2)
+
+        # Ancestors are now known; no further round trips.
+
+        self.assert_(is_subclass(ch, 'root/cimv2', 'cim_managedelement',
+                                 'vendor_volume'))
+        self.assert_(not is_subclass(ch, 'root/cimv2', 'Vendor_Volume',
+                                     'CIM_StorageExtent'))
+        self.assert_equal(len(ch.calls), 6)
+        self.assert_(is_subclass(ch, 'root/cimv2', 'CIM_ManagedElement',
+                                 'Vendor_Volume'))
+        self.assert_equal(len(ch.calls), 6)
+
+        # Other namespaces have their own cache.
+
+        is_subclass(ch, 'root/emc', 'CIM_LogicalDevice', 'Vendor_Volume')
+        self.assert_equal(len(ch.calls), 8)
+
+class Bulk(comfychair.TestCase):
+    def runtest(self):
+        ch = FakeConnection()
+
+        hierarchy = ch.class_hierarchy('root/cimv2', load = True)
+        self.assert_equal(len(hierarchy), len(CLASSES))
+        self.assert_equal(hierarchy.ancestors('Vendor_Volume'),
+                          ['CIM_StorageExtent', 'CIM_LogicalDevice',
+                           'CIM_LogicalElement', 'CIM_ManagedSystemElement',
+                           'CIM_ManagedElement'])
+        self.assert_(is_subclass(ch, '/root/cimv2', 'CIM_LogicalElement',
+                                 'Vendor_Volume'))
+        self.assert_equal(ch.calls, [('EnumerateClasses', 'root/cimv2')])
+
+        # Unknown classes still raise when no handle is given.
+
+        try:
+            hierarchy.superclass('Vendor_Unknown')
+        except KeyError:
+            pass
+        else:
+            self.fail('KeyError not raised')
+
+class Invalidate(comfychair.TestCase):
+    def runtest(self):
+        ch = FakeConnection()
+        ch.imethodcall = lambda *args, **kwargs: None
+
+        ch.class_hierarchy(load = True)
+        ch.CreateClass(CIMClass('Vendor_Disk', superclass = 'CIM_LogicalDevice'))
+        self.assert_(not ch.class_hierarchy().loaded)
+
+        ch.class_hierarchy(load = True)
+        ch.class_hierarchy('root/emc', load = True)
+        ch.invalidate_class_hierarchy()
+        self.assert_equal(ch.class_hierarchies, {})
+
+class FromClasses(comfychair.TestCase):
+    """A hierarchy can be built from EnumerateClasses results."""
+
+    def runtest(self):
+        hierarchy = ClassHierarchy()
+        hierarchy.add_classes(CLASSES)
+
+        self.assert_(hierarchy.is_subclass('CIM_StorageExtent',
+                                           'Vendor_Volume'))
+        self.assert_(not hierarchy.is_subclass('Vendor_Volume',
+                                               'CIM_LogicalDevice'))
+
+#################################################################
+# Main function
+#################################################################
+
+tests = [
+    Lazy,
+    Bulk,
+    Invalidate,
+    FromClasses,
+    ]
+
+if __name__ == '__main__':
+    comfychair.main(tests)
@@ -0,0 +1,205 @@
+#!/usr/bin/python
+#
+# Test client-side evaluation of CQL WHERE clauses.
+#
+
+import comfychair
+
+from xml.etree.ElementTree import fromstring
+
+from pywbem import *
+from pywbem.cql import CQLError, compile_where, where_clause, any_of
+
+INSTANCE_XML = """<INSTANCE CLASSNAME="CIM_StorageVolume">
+<PROPERTY NAME="ElementName" TYPE="string"><VALUE>vol01</VALUE></PROPERTY>
+<PROPERTY NAME="BlockSize" TYPE="uint64"><VALUE>512</VALUE></PROPERTY>
+<PROPERTY NAME="Caption" TYPE="string"></PROPERTY>
+<PROPERTY NAME="Primordial" TYPE="boolean"><VALUE>FALSE</VALUE></PROPERTY>
+<PROPERTY NAME="InstallDate" TYPE="datetime"><VALUE>20170101000000.000000+000</VALUE></PROPERTY>
+<PROPERTY.ARRAY NAME="OperationalStatus" TYPE="uint16"><VALUE.ARRAY>
+<VALUE>2</VALUE><VALUE>32768</VALUE>
+</VALUE.ARRAY></PROPERTY.ARRAY>
+</INSTANCE>"""
+
+def instance():
+    return CIMInstance(
+        'CIM_StorageVolume',
+        properties = {'ElementName': 'vol01',
+                      'BlockSize': Uint64(512),
+                      'Caption': CIMProperty('Caption', None, type = 'string'),
+                      'Primordial': False,
+                      'InstallDate':
+                          CIMDateTime('20170101000000.000000+000'),
+                      'OperationalStatus': [Uint16(2), Uint16(32768)]})
+
+class WhereTest(comfychair.TestCase):
+
+    def match(self, where, expected):
+        """Check a WHERE clause against both a parsed instance and the
+        raw XML, which must agree."""
+
+        predicate = compile_where('SELECT * FROM CIM_StorageVolume WHERE ' +
+                                  where)
+
+        self.log('%s' % predicate)
+
+        self.assert_equal(predicate(instance()), expected)
+        self.assert_equal(predicate.match_element(fromstring(INSTANCE_XML)),
+                          expected)
+
+class Comparisons(WhereTest):
+    def runtest(self):
+        self.match("ElementName = 'vol01'", True)
+        self.match("ElementName <> 'vol01'", False)
+        self.match("BlockSize >= 512", True)
+        self.match("BlockSize < 512", False)
+        self.match("BlockSize != 4096", True)
+        self.match("CIM_StorageVolume.BlockSize = 512", True)
+        self.match("Primordial = FALSE", True)
+        self.match("Caption IS NULL", True)
+        self.match("Caption IS NOT NULL", False)
+        self.match("Caption = 'x'", False)
+
+        # Quoted numbers and booleans take the type of the property.
+        self.match("BlockSize = '512'", True)
+        self.match("BlockSize > '100'", True)
+        self.match("BlockSize IN ('4096', '512')", True)
+        self.match("OperationalStatus = '32768'", True)
+        self.match("BlockSize = '512.5'", False)
+        self.match("Primordial = 'false'", True)
+
+        # Values that can't be converted to one type are unknown.
+        self.match("BlockSize = 'big'", True)
+        self.match("NOT BlockSize = 'big'", True)
+        self.match("ElementName = 512", True)
+        self.match("ElementName = 512 AND BlockSize = 1", False)
+        self.match("BlockSize IN ('big', 1)", True)
+        self.match("BlockSize NOT IN ('big', 512)", False)
+
+class Datetimes(WhereTest):
+    def runtest(self):
+        self.match("InstallDate = '20170101000000.000000+000'", True)
+        self.match("InstallDate = '20170101010000.000000+060'", True)
+        self.match("InstallDate <> '20170101000000.000000+000'", False)
+        self.match("InstallDate > '20990101000000.000000+000'", False)
+        self.match("InstallDate < '20990101000000.000000+000'", True)
+        self.match("InstallDate >= '20160101000000.000000+000'", True)
+        self.match("InstallDate IN ('20160101000000.000000+000', "
+                   "'20170101000000.000000+000')", True)
+
+        # Malformed literals, intervals and numbers are unknown.
+        self.match("InstallDate = 'yesterday'", True)
+        self.match("NOT InstallDate > 'yesterday'", True)
+        self.match("InstallDate < '00000001000000.000000:000'", True)
+        self.match("InstallDate > 20170101", True)
+        self.match("InstallDate = TRUE AND BlockSize = 1", False)
+
+class MalformedValues(comfychair.TestCase):
+    def runtest(self):
+        # A value that doesn't convert can't reject the instance, and
+        # doesn't fail the other conditions.
+        xml = INSTANCE_XML.replace('<VALUE>512</VALUE>',
+                                   '<VALUE>lots</VALUE>')
+        xml = xml.replace('<VALUE>2</VALUE>', '<VALUE>two</VALUE>')
+        element = fromstring(xml)
+
+        for where, expected in (("BlockSize = 1", True),
+                                ("OperationalStatus = 6", True),
+                                ("BlockSize = 1 AND ElementName = 'x'",
+                                 False),
+                                ("ElementName = 'vol01'", True)):
+            predicate = compile_where('SELECT * FROM F WHERE ' + where)
+            self.assert_equal(predicate.match_element(element), expected)
+
+class Lists(WhereTest):
+    def runtest(self):
+        self.match("ElementName IN ('vol00', 'vol01')", True)
+        self.match("ElementName NOT IN ('vol00', 'vol01')", False)
+        self.match("BlockSize IN (512, 4096)", True)
+        self.match("OperationalStatus = 2", True)
+        self.match("OperationalStatus IN (6, 32768)", True)
+        self.match("OperationalStatus = 6", False)
+
+class Like(WhereTest):
+    def runtest(self):
+        self.match("ElementName LIKE 'vol%'", True)
+        self.match("ElementName LIKE 'vol_1'", True)
+        self.match("ElementName NOT LIKE 'lun%'", True)
+        self.match("ElementName LIKE 'lun%'", False)
+
+class Logic(WhereTest):
+    def runtest(self):
+        self.match("BlockSize = 512 AND ElementName = 'vol01'", True)
+        self.match("BlockSize = 512 AND ElementName = 'vol02'", False)
+        self.match("BlockSize = 1 OR ElementName = 'vol01'", True)
+        self.match("NOT (BlockSize = 1 OR ElementName = 'vol02')", True)
+        self.match("(BlockSize = 1 OR BlockSize = 512) and "
+                   "not Primordial = TRUE", True)
+
+class MissingProperties(WhereTest):
+    def runtest(self):
+        # Properties not in the instance can't reject it.
+        self.match("SerialNumber = 'x'", True)
+        self.match("SerialNumber = 'x' AND BlockSize = 1", False)
+        self.match("SerialNumber = 'x' OR BlockSize = 1", True)
+
+        # NOT leaves a condition on a missing property unknown.
+        self.match("NOT SerialNumber = 'x'", True)
+        self.match("NOT (SerialNumber IS NULL)", True)
+        self.match("NOT (SerialNumber = 'x' AND BlockSize = 1)", True)
+        self.match("NOT (SerialNumber = 'x' OR BlockSize = 512)", False)
+
+        predicate = compile_where('SELECT Name FROM X WHERE NOT Status = 2')
+        self.assert_(predicate(CIMInstance('X', {'Name': 'a'})))
+
+class Clauses(comfychair.TestCase):
+    def runtest(self):
+        self.assert_equal(where_clause('SELECT * FROM CIM_Foo'), None)
+        self.assert_equal(
+            where_clause("select Name from CIM_Foo where Name = 'where'"),
+            "Name = 'where'")
+        self.assert_equal(compile_where('SELECT * FROM CIM_Foo'), None)
+
+        predicate = compile_where("SELECT * FROM F WHERE Name = 'it''s'")
+        self.assert_(predicate({'Name': "it's"}))
+
+        for where in ("Name =", "Name = 'a' AND", "(Name = 'a'",
+                      "Name ~ 1", "Name NOT = 1", "'a' = Name"):
+            try:
+                compile_where('SELECT * FROM F WHERE ' + where)
+            except CQLError:
+                pass
+            else:
+                self.fail('%r compiled' % where)
+
+class AnyOf(comfychair.TestCase):
+    def runtest(self):
+        a = compile_where("SELECT * FROM F WHERE Name = 'a'")
+        b = compile_where("SELECT * FROM F WHERE Name = 'b'")
+
+        self.assert_equal(any_of([]), None)
+        self.assert_equal(any_of([a, None]), None)
+        self.assert_(any_of([a]) is a)
+
+        either = any_of([a, b])
+        self.assert_(either({'Name': 'a'}) and either({'Name': 'b'}))
+        self.assert_(not either({'Name': 'c'}))
+
+#################################################################
+# Main function
+#################################################################
+
+tests = [
+    Comparisons,
+    Datetimes,
+    Lists,
+    Like,
+    Logic,
+    MissingProperties,
+    MalformedValues,
+    Clauses,
+    AnyOf,
+    ]
+
+if __name__ == '__main__':
+    comfychair.main(tests)
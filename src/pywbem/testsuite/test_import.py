@@ -0,0 +1,70 @@
+#!/usr/bin/python
+#
+# Test the submodules imported by importing pywbem.
+#
+
+import comfychair
+import subprocess
+import sys
+
+def run(statements):
+    """Return what statements print in a fresh interpreter."""
+    return subprocess.check_output(
+        [sys.executable, '-W', 'ignore', '-c', statements]).strip()
+
+LOADED = "; print sorted(x for x in sys.modules " \
+         "if x.startswith('pywbem.') and sys.modules[x])"
+
+class Lazy(comfychair.TestCase):
+    """The operations, HTTP and parsing submodules load on first use."""
+
+    def runtest(self):
+        self.assert_equal(
+            run('import sys, pywbem' + LOADED),
+            "['pywbem.cim_constants', 'pywbem.cim_obj', 'pywbem.cim_types', "
+            "'pywbem.cim_xml']")
+
+        self.assert_equal(
+            run('import sys; from pywbem import CIMError, CIMInstance'
+                + LOADED).count('cim_operations'), 0)
+
+        self.assert_equal(
+            run('import pywbem; print pywbem.WBEMConnection, '
+                'pywbem.cim_http.__name__'),
+            "<class 'pywbem.cim_operations.WBEMConnection'> pywbem.cim_http")
+
+        self.assert_equal(
+            run('import pywbem; print pywbem.CIMError is '
+                'pywbem.cim_operations.CIMError'), 'True')
+
+        self.assert_equal(
+            run('from pywbem import *; print ParseError.__module__, '
+                'DEFAULT_NAMESPACE, CIM_ERR_NOT_FOUND'),
+            'pywbem.tupleparse root/cimv2 6')
+
+        # Star imports still export what the submodules always brought in.
+        self.assert_equal(
+            run('from pywbem import *; print sys.__name__, '
+                'cim_operations.__name__, tupletree.__name__, '
+                'xml_to_tupletree.__name__, Document.__module__'),
+            'sys pywbem.cim_operations pywbem.tupletree xml_to_tupletree '
+            'xml.dom.minidom')
+
+        try:
+            import pywbem
+            pywbem.NoSuchName
+        except AttributeError:
+            pass
+        else:
+            self.fail('AttributeError not raised')
+
+#################################################################
+# Main function
+#################################################################
+
+tests = [
+    Lazy,
+    ]
+
+if __name__ == '__main__':
+    comfychair.main(tests)
@@ -0,0 +1,345 @@
+#!/usr/bin/python
+#
+# Test the high-throughput indication listener.
+#
+
+import comfychair
+import threading
+
+from StringIO import StringIO
+
+from pywbem import *
+from pywbem import cim_xml
+from pywbem.tupleparse import parse_cim
+from pywbem.tupletree import xml_to_tupletree
+from pywbem import indication_listener
+from pywbem.indication_listener import IndicationCoalescer, \
+     IndicationListener, iter_indications
+
+def indication(i):
+    return CIMInstance('CIM_AlertIndication',
+                       {'IndicationIdentifier': 'alert%d' % i,
+                        'AlertType': Uint16(2),
+                        'PerceivedSeverity': Uint16(6),
+                        'Description': u'Disk <%d> failed' % i})
+
+def simpleexpreq(indications):
+    params = [cim_xml.EXPPARAMVALUE('NewIndication', x.tocimxml())
+              for x in indications]
+    call = cim_xml.EXPMETHODCALL('ExportIndication', params)
+    message = cim_xml.MESSAGE(cim_xml.SIMPLEEXPREQ(call), '1001', '1.0')
+    return cim_xml.CIM(message, '2.0', '2.0')
+
+def export_request(indications):
+    return '<?xml version="1.0" encoding="utf-8" ?>\n' + \
+        simpleexpreq(indications).toxml()
+
+def multi_export_request(indications):
+    reqs = [cim_xml.SIMPLEEXPREQ(cim_xml.EXPMETHODCALL(
+        'ExportIndication',
+        [cim_xml.EXPPARAMVALUE('NewIndication', x.tocimxml())]))
+            for x in indications]
+    message = cim_xml.MESSAGE(cim_xml.MULTIEXPREQ(reqs), '1001', '1.0')
+    return cim_xml.CIM(message, '2.0', '2.0').toxml()
+
+class Request(object):
+    """The parts of twisted.web.server.Request used by the listener."""
+
+    def __init__(self, body):
+        self.content = StringIO(body)
+        self.code = 200
+
+    def setResponseCode(self, code):
+        self.code = code
+
+    def getClientIP(self):
+        return '10.0.0.1'
+
+class Parse(comfychair.TestCase):
+    """Indications parse as they did through a full tupletree."""
+
+    def runtest(self):
+        indications = [indication(i) for i in range(3)]
+        body = export_request(indications)
+
+        tt = parse_cim(xml_to_tupletree(body))
+        expected = [x[1] for x in tt[2][2][0][2][2]]
+
+        self.assert_equal(list(iter_indications(StringIO(body))), expected)
+        self.assert_equal(expected, indications)
+
+        body = multi_export_request(indications)
+        self.assert_equal(list(iter_indications(StringIO(body))),
+                          indications)
+
+class Batches(comfychair.TestCase):
+    """Queued indications are delivered in batches by the workers."""
+
+    def runtest(self):
+        batches = []
+        done = threading.Event()
+
+        def callback(batch):
+            batches.append(batch)
+            if sum(len(x) for x in batches) == 5:
+                done.set()
+
+        listener = IndicationListener(callback, workers=1, batch_size=2)
+
+        for i in range(5):
+            request = Request(export_request([indication(i)]))
+            self.assert_equal(listener.render_POST(request), '')
+            self.assert_equal(request.code, 200)
+
+        # Nothing is delivered until the workers start.
+        self.assert_equal(batches, [])
+
+        listener.start()
+        done.wait(10)
+        listener.stop(10)
+
+        self.assert_equal([len(x) for x in batches], [2, 2, 1])
+        self.assert_equal([y[1]['IndicationIdentifier']
+                           for x in batches for y in x],
+                          ['alert%d' % i for i in range(5)])
+        self.assert_equal(batches[0][0][0], '10.0.0.1')
+        self.assert_equal(listener.stats['requests'], 5)
+        self.assert_equal(listener.stats['received'], 5)
+        self.assert_equal(listener.stats['delivered'], 5)
+
+class Overflow(comfychair.TestCase):
+    """Indications that don't fit in the queue are dropped and counted."""
+
+    def runtest(self):
+        dropped = []
+        listener = IndicationListener(lambda batch: None, max_queue=3,
+                                      dropped=dropped.append)
+
+        listener.render_POST(Request(export_request(
+            [indication(i) for i in range(2)])))
+        listener.render_POST(Request(export_request(
+            [indication(i) for i in range(4)])))
+
+        self.assert_equal(listener.queue.qsize(), 3)
+        self.assert_equal(listener.stats['received'], 6)
+        self.assert_equal(listener.stats['dropped'], 3)
+        self.assert_equal(listener.stats['overflows'], 1)
+
+        self.assert_equal(len(dropped), 1)
+        self.assert_equal([(x[0], x[1]['IndicationIdentifier'])
+                           for x in dropped[0]],
+                          [('10.0.0.1', 'alert%d' % i) for i in range(1, 4)])
+
+class StopFull(comfychair.TestCase):
+    """Stopping with a full queue doesn't block, and the workers still
+    deliver every queued indication before they stop."""
+
+    def runtest(self):
+        entered = threading.Semaphore(0)
+        release = threading.Event()
+
+        def callback(batch):
+            entered.release()
+            release.wait(10)
+
+        listener = IndicationListener(callback, max_queue=2, workers=2,
+                                      batch_size=1)
+        listener.start()
+        listener.render_POST(Request(export_request(
+            [indication(i) for i in range(2)])))
+        entered.acquire()
+        entered.acquire()
+
+        # Both workers are busy and the queue is full.
+        listener.render_POST(Request(export_request(
+            [indication(i) for i in range(2, 5)])))
+        self.assert_equal(listener.queue.qsize(), 2)
+
+        threads = listener.threads
+        listener.stop(0)
+        self.assert_equal(listener.unqueued_stops, 2)
+
+        release.set()
+        for thread in threads:
+            thread.join(10)
+            self.assert_(not thread.isAlive())
+        self.assert_equal(listener.queue.qsize(), 0)
+        self.assert_equal(listener.stats['delivered'], 4)
+
+class Shutdown(comfychair.TestCase):
+    """Shutting down doesn't wait for the workers in the reactor thread."""
+
+    def runtest(self):
+        release = threading.Event()
+        calls = []
+
+        def deferToThread(f, *args):
+            calls.append((f, args))
+            return 'deferred'
+
+        listener = IndicationListener(lambda batch: release.wait(10),
+                                      workers=2)
+        listener.start()
+        listener.render_POST(Request(export_request(
+            [indication(i) for i in range(3)])))
+
+        original = indication_listener.deferToThread
+        indication_listener.deferToThread = deferToThread
+        try:
+            self.assert_equal(listener.shutdown(30), 'deferred')
+        finally:
+            indication_listener.deferToThread = original
+
+        self.assert_equal(listener.threads, [])
+        f, args = calls[0]
+        threads, timeout = args
+        self.assert_equal(len(threads), 2)
+        self.assert_equal(timeout, 30)
+
+        # The workers are still delivering when joining times out.
+        f(threads, 0.1)
+        self.assert_(threads[0].isAlive() or threads[1].isAlive())
+
+        release.set()
+        f(*args)
+        for thread in threads:
+            self.assert_(not thread.isAlive())
+        self.assert_equal(listener.stats['delivered'], 3)
+
+class Errors(comfychair.TestCase):
+    """Bad requests and failing callbacks are counted."""
+
+    def runtest(self):
+        done = threading.Event()
+
+        def callback(batch):
+            done.set()
+            raise ValueError('callback failed')
+
+        listener = IndicationListener(callback, workers=1)
+
+        request = Request('<CIM><MESSAGE>')
+        listener.render_POST(request)
+        self.assert_equal(request.code, 400)
+        self.assert_equal(listener.stats['parse_errors'], 1)
+
+        listener.start()
+        listener.render_POST(Request(export_request([indication(0)])))
+        done.wait(10)
+        listener.stop(10)
+
+        self.assert_equal(listener.stats['callback_errors'], 1)
+        self.assert_equal(listener.stats['delivered'], 1)
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def alert(identifier, severity=6):
+    return CIMInstance('CIM_AlertIndication',
+                       {'IndicationIdentifier': identifier,
+                        'AlertType': Uint16(2),
+                        'PerceivedSeverity': Uint16(severity)})
+
+class Coalesce(comfychair.TestCase):
+    """Repeats within the window are passed on once, with a count."""
+
+    def runtest(self):
+        clock = Clock()
+        coalescer = IndicationCoalescer(window=10, clock=clock)
+
+        passed = coalescer.add('a', [alert('disk1'), alert('disk1'),
+                                     alert('disk1', 7), alert('disk2')])
+        self.assert_equal(passed, [('a', alert('disk1')),
+                                   ('a', alert('disk1', 7)),
+                                   ('a', alert('disk2'))])
+
+        # The same alert from another source is not a repeat.
+        self.assert_equal(coalescer.add('b', [alert('disk1')]),
+                          [('b', alert('disk1'))])
+
+        clock.now += 5
+        self.assert_equal(coalescer.add('a', [alert('disk1')]), [])
+        self.assert_equal(coalescer.coalesced, 2)
+        self.assert_equal(coalescer.expire(), [])
+
+        clock.now += 5
+        summaries = coalescer.expire()
+        self.assert_equal(len(summaries), 1)
+        source, summary = summaries[0]
+        self.assert_equal(source, 'a')
+        self.assert_equal(summary['IndicationIdentifier'], 'disk1')
+        self.assert_equal(summary['CoalescedCount'], 2)
+        self.assert_equal(coalescer.entries, {})
+
+        # Indications that don't name an element are passed on.
+        other = CIMInstance('CIM_InstModification', {})
+        self.assert_equal(coalescer.add('a', [other, other]),
+                          [('a', other), ('a', other)])
+
+class CoalesceLimit(comfychair.TestCase):
+    """The oldest window ends early when max_keys is reached."""
+
+    def runtest(self):
+        coalescer = IndicationCoalescer(window=10, max_keys=2,
+                                        clock=Clock())
+
+        coalescer.add('a', [alert('disk1'), alert('disk1'), alert('disk2')])
+        passed = coalescer.add('a', [alert('disk3')])
+
+        self.assert_equal([x[1]['IndicationIdentifier'] for x in passed],
+                          ['disk1', 'disk3'])
+        self.assert_equal(passed[0][1]['CoalescedCount'], 1)
+        self.assert_equal(len(coalescer.entries), 2)
+
+class ListenerCoalesce(comfychair.TestCase):
+    def runtest(self):
+        listener = IndicationListener(lambda batch: None, coalesce_window=60)
+
+        for i in range(3):
+            listener.render_POST(Request(export_request([indication(0)])))
+
+        self.assert_equal(listener.queue.qsize(), 1)
+        self.assert_equal(listener.stats['received'], 3)
+        self.assert_equal(listener.stats['coalesced'], 2)
+
+class StopCoalesced(comfychair.TestCase):
+    """Repeats held back when the listener stops are still delivered."""
+
+    def runtest(self):
+        batches = []
+        listener = IndicationListener(batches.append, workers=1,
+                                      coalesce_window=60)
+        listener.start()
+
+        for i in range(3):
+            listener.render_POST(Request(export_request([indication(0)])))
+        listener.stop(10)
+
+        delivered = [x[1] for batch in batches for x in batch]
+        self.assert_equal(len(delivered), 2)
+        self.assert_equal(delivered[1]['CoalescedCount'], 2)
+        self.assert_equal(listener.coalescer.entries, {})
+
+#################################################################
+# Main function
+#################################################################
+
+tests = [
+    Parse,
+    Batches,
+    Overflow,
+    StopFull,
+    Shutdown,
+    Errors,
+    Coalesce,
+    CoalesceLimit,
+    ListenerCoalesce,
+    StopCoalesced,
+    ]
+
+if __name__ == '__main__':
+    comfychair.main(tests)
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+#
+# Check that InstanceSerializer gives the same XML as tocimxml().
+#
+
+import comfychair
+
+from datetime import datetime
+
+from pywbem import *
+from pywbem.instancexml import InstanceSerializer, instances_toxml
+
+def instances():
+    path = CIMInstanceName('CIM_Foo', {'Name': 'a'}, namespace = 'root/cimv2')
+
+    yield CIMInstance('CIM_Foo')
+    yield CIMInstance('CIM_Foo', path = path)
+
+    for i in range(3):
+        yield CIMInstance(
+            'CIM_Foo',
+            {'Name': 'vol<%d> & "x"' % i,
+             'Empty': '',
+             'Size': Uint64(i * 512),
+             'Ratio': Real32(i / 3.0),
+             'Flag': i % 2 == 0,
+             'Status': [Uint16(2), Uint16(i)],
+             'Names': ['a', '', u'\xe9'],
+             'Created': CIMDateTime('20170101000000.000000+000'),
+             'When': datetime(2017, 1, 1),
+             'Null': CIMProperty('Null', None, type = 'string'),
+             'NullArray': CIMProperty('NullArray', None, type = 'uint8',
+                                      is_array = True),
+             'EmptyArray': CIMProperty('EmptyArray', [], type = 'uint8'),
+             'NullItems': CIMProperty('NullItems', [None, 'x'],
+                                      type = 'string'),
+             'Origin': CIMProperty('Origin', Uint8(i), class_origin = 'CIM_X',
+                                   propagated = True),
+             'Described': CIMProperty(
+                 'Described', 'd', qualifiers = {
+                     'Description': CIMQualifier('Description', 'q')}),
+             'Ref': CIMProperty('Ref', CIMInstanceName('CIM_Bar', {'k': 'v'})),
+             'Embedded': CIMInstance('CIM_E', {'x': 'y'}),
+             },
+            qualifiers = {'Key': CIMQualifier('Key', True)},
+            path = i and path or None)
+
+    # The same property name with a different type in another class.
+
+    yield CIMInstance('CIM_Bar', {'Size': 'large', 'Status': [u'OK']})
+
+class SameXML(comfychair.TestCase):
+    def runtest(self):
+        serializer = InstanceSerializer()
+        objs = list(instances())
+
+        for pass_ in range(2):
+            for obj in objs:
+                expected = obj.tocimxml().toxml()
+                xml = serializer.toxml([obj])
+                self.assert_equal(xml, expected)
+                self.assert_equal(type(xml), type(expected))
+
+        expected = ''.join(x.tocimxml().toxml() for x in objs)
+        self.assert_equal(serializer.toxml(objs), expected)
+        self.assert_equal(''.join(serializer.iterxml(objs)), expected)
+        self.assert_equal(instances_toxml(objs), expected)
+
+        # Without their path, instances are written as INSTANCE elements.
+        for obj in objs:
+            buf = []
+            serializer.instance_xml(obj, buf.append, with_path = False)
+            expected = obj.tocimxml()
+            if obj.path is not None:
+                expected = expected.childNodes[1]
+            self.assert_equal(''.join(buf), expected.toxml())
+
+class Errors(comfychair.TestCase):
+    """Values tocimxml() rejects are rejected the same way."""
+
+    def runtest(self):
+        for properties in ({'Empty': []}, {'Null': None}):
+            try:
+                InstanceSerializer().toxml([CIMInstance('CIM_Foo',
+                                                        properties)])
+            except TypeError:
+                pass
+            else:
+                self.fail('%r serialized' % properties)
+
+#################################################################
+# Main function
+#################################################################
+
+tests = [
+    SameXML,
+    Errors,
+    ]
+
+if __name__ == '__main__':
+    comfychair.main(tests)
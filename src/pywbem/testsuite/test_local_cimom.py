@@ -0,0 +1,338 @@
+#!/usr/bin/python
+#
+# Test the in-memory repository and the local CIMOM serving it.
+#
+
+import comfychair
+
+from StringIO import StringIO
+
+from pywbem import *
+from pywbem import twisted_client
+from pywbem import local_cimom
+from pywbem.local_cimom import LocalCIMOM
+from pywbem.mof_compiler import MOFCompiler, MOFWBEMConnection
+
+ns = 'root/cimv2'
+
+MOF = """
+Qualifier Key : boolean = false, Scope(property, reference),
+    Flavor(DisableOverride);
+Qualifier Association : boolean = false, Scope(association),
+    Flavor(DisableOverride);
+
+class CIM_Base {
+    [Key] string Name;
+};
+
+class CIM_Disk : CIM_Base {
+    uint32 Size;
+};
+
+class Vendor_Disk : CIM_Disk {
+    string Firmware;
+};
+
+class CIM_System : CIM_Base {
+};
+
+[Association]
+class CIM_SystemDisk {
+    [Key] CIM_System REF System;
+    [Key] CIM_Disk REF Disk;
+};
+
+instance of CIM_System as $system {
+    Name = "system0";
+};
+
+instance of CIM_Disk as $disk0 {
+    Name = "disk0";
+    Size = 80;
+};
+
+instance of Vendor_Disk as $disk1 {
+    Name = "disk1";
+    Size = 160;
+    Firmware = "1.2";
+};
+
+instance of CIM_SystemDisk {
+    System = $system;
+    Disk = $disk0;
+};
+
+instance of CIM_SystemDisk {
+    System = $system;
+    Disk = $disk1;
+};
+"""
+
+def repository():
+    handle = MOFWBEMConnection()
+    MOFCompiler(handle, log_func=lambda msg: None).compile_string(MOF, ns)
+    return handle
+
+def disk(name, classname='CIM_Disk'):
+    return CIMInstanceName(classname, {'Name': name}, namespace=ns)
+
+def names(objects):
+    return [x['Name'] for x in objects]
+
+class TestCase(comfychair.TestCase):
+    def setup(self):
+        self.repo = repository()
+
+    def assert_error(self, code, f, *args, **kwargs):
+        try:
+            f(*args, **kwargs)
+        except CIMError, ce:
+            self.assert_equal(ce.args[0], code)
+        else:
+            self.fail('CIMError %d not raised' % code)
+
+class Instances(TestCase):
+    """Instances are found by key and enumerated with subclasses."""
+
+    def runtest(self):
+        inst = self.repo.GetInstance(disk('disk1', 'Vendor_Disk'))
+        self.assert_equal(inst['Firmware'], '1.2')
+        self.assert_equal(inst.path.namespace, ns)
+        self.assert_equal(inst.properties['Name'].qualifiers.keys(), [])
+
+        # A path naming a superclass finds the instance too.
+        self.assert_equal(self.repo.GetInstance(disk('disk1'))['Size'], 160)
+        self.assert_error(CIM_ERR_NOT_FOUND,
+                          self.repo.GetInstance, disk('disk2'))
+
+        self.assert_equal(
+            names(self.repo.EnumerateInstanceNames('CIM_Base')),
+            ['system0', 'disk0', 'disk1'])
+
+        disks = self.repo.EnumerateInstances('CIM_Disk')
+        self.assert_equal(names(disks), ['disk0', 'disk1'])
+        self.assert_equal(disks[1]['Firmware'], '1.2')
+
+        disks = self.repo.EnumerateInstances('CIM_Disk',
+                                             DeepInheritance=False)
+        self.assert_(disks[0].has_key('Size'))
+        self.assert_(not disks[1].has_key('Firmware'))
+
+        disks = self.repo.EnumerateInstances('CIM_Disk',
+                                             PropertyList=['size'])
+        self.assert_equal(disks[1].keys(), ['Size'])
+
+        self.assert_equal(self.repo.EnumerateInstances('CIM_Other'), [])
+
+class Changes(TestCase):
+    """Instances can be created, modified and deleted."""
+
+    def runtest(self):
+        new = CIMInstance('CIM_Disk', {'Name': 'disk2', 'Size': Uint32(1)})
+        path = self.repo.CreateInstance(new)
+        self.assert_equal(path, disk('disk2'))
+        self.assert_error(CIM_ERR_ALREADY_EXISTS,
+                          self.repo.CreateInstance, new)
+        self.assert_error(CIM_ERR_INVALID_PARAMETER, self.repo.CreateInstance,
+                          CIMInstance('CIM_Disk', {'Size': Uint32(1)}))
+
+        modified = CIMInstance('CIM_Disk', {'Size': Uint32(2)},
+                               path=disk('disk2'))
+        self.repo.ModifyInstance(modified)
+        self.assert_equal(self.repo.GetInstance(path)['Size'], 2)
+
+        self.repo.DeleteInstance(path)
+        self.assert_error(CIM_ERR_NOT_FOUND, self.repo.GetInstance, path)
+        self.assert_error(CIM_ERR_NOT_FOUND, self.repo.DeleteInstance, path)
+        self.assert_equal(len(self.repo.instances[ns]), 5)
+
+        # Associations left referring to a deleted disk don't lead to it.
+        self.repo.DeleteInstance(disk('disk0'))
+        system = CIMInstanceName('CIM_System', {'Name': 'system0'})
+        self.assert_equal(names(self.repo.Associators(system)), ['disk1'])
+
+class Associations(TestCase):
+    """Associators and References follow the reference index."""
+
+    def runtest(self):
+        system = CIMInstanceName('CIM_System', {'Name': 'system0'},
+                                 namespace=ns)
+
+        self.assert_equal(names(self.repo.Associators(system)),
+                          ['disk0', 'disk1'])
+        self.assert_equal(
+            names(self.repo.Associators(system, ResultClass='Vendor_Disk')),
+            ['disk1'])
+        self.assert_equal(
+            self.repo.Associators(system, Role='Disk'), [])
+        self.assert_equal(
+            [x.classname for x in self.repo.AssociatorNames(
+                disk('disk1', 'Vendor_Disk'), ResultRole='System')],
+            ['CIM_System'])
+
+        refs = self.repo.References(disk('disk0'), Role='disk')
+        self.assert_equal(len(refs), 1)
+        self.assert_equal(refs[0]['System'], system)
+        self.assert_equal(
+            len(self.repo.ReferenceNames(system,
+                                         ResultClass='CIM_SystemDisk')), 2)
+        self.assert_error(CIM_ERR_NOT_SUPPORTED,
+                          self.repo.References, 'CIM_System')
+
+class Query(TestCase):
+    """ExecQuery selects instances of a class with a WHERE clause."""
+
+    def runtest(self):
+        result = self.repo.ExecQuery(
+            'WQL', 'SELECT Name FROM CIM_Disk WHERE Size > 100')
+        self.assert_equal(names(result), ['disk1'])
+        self.assert_equal(result[0].keys(), ['Name'])
+
+        self.assert_equal(
+            len(self.repo.ExecQuery('DMTF:CQL', 'select * from CIM_Base')), 3)
+        self.assert_error(CIM_ERR_QUERY_LANGUAGE_NOT_SUPPORTED,
+                          self.repo.ExecQuery, 'SQL', 'SELECT * FROM CIM_Disk')
+        self.assert_error(CIM_ERR_INVALID_QUERY,
+                          self.repo.ExecQuery, 'WQL', 'DELETE FROM CIM_Disk')
+
+class Classes(TestCase):
+    def runtest(self):
+        self.assert_equal(self.repo.EnumerateClassNames(),
+                          ['CIM_Base', 'CIM_SystemDisk'])
+        self.assert_equal(
+            self.repo.EnumerateClassNames(ClassName='CIM_Base',
+                                          DeepInheritance=True),
+            ['CIM_Disk', 'Vendor_Disk', 'CIM_System'])
+        self.assert_error(CIM_ERR_INVALID_CLASS,
+                          self.repo.EnumerateClasses, ClassName='CIM_Other')
+
+class Request(object):
+    """The parts of twisted.web.server.Request used by the CIMOM."""
+
+    def __init__(self, body):
+        self.content = StringIO(body)
+        self.code = 200
+        self.headers = {}
+
+    def setResponseCode(self, code):
+        self.code = code
+
+    def setHeader(self, name, value):
+        self.headers[name] = value
+
+class Server(TestCase):
+    """Requests of the twisted client are answered over CIM-XML."""
+
+    def setup(self):
+        TestCase.setup(self)
+        self.cimom = LocalCIMOM(self.repo)
+
+    def call(self, factory):
+        results = []
+        factory.deferred.addBoth(results.append)
+        request = Request(factory.payload)
+        factory.parseErrorAndResponse(self.cimom.render_POST(request))
+        self.assert_equal(request.code, 200)
+        return results[0]
+
+    def runtest(self):
+        disks = self.call(twisted_client.EnumerateInstances(None, 'CIM_Disk'))
+        self.assert_equal(names(disks), ['disk0', 'disk1'])
+        self.assert_equal(disks[1].path.keybindings['Name'], 'disk1')
+
+        disk1 = self.call(twisted_client.GetInstance(
+            None, CIMInstanceName('Vendor_Disk', {'Name': 'disk1'})))
+        self.assert_equal(disk1['Firmware'], '1.2')
+        self.assert_equal(disk1.properties['Size'].type, 'uint32')
+
+        paths = self.call(twisted_client.EnumerateInstanceNames(
+            None, 'CIM_Base'))
+        self.assert_equal(names(paths), ['system0', 'disk0', 'disk1'])
+
+        result = self.call(twisted_client.ExecQuery(
+            None, 'WQL', 'SELECT * FROM CIM_Disk WHERE Size < 100'))
+        self.assert_equal(names(result), ['disk0'])
+
+        system = paths[0].copy()
+        system.namespace = None
+        result = self.call(twisted_client.AssociatorNames(None, system))
+        self.assert_equal(names(result), ['disk0', 'disk1'])
+
+        error = self.call(twisted_client.GetInstance(
+            None, CIMInstanceName('CIM_Disk', {'Name': 'disk9'})))
+        self.assert_equal(error.value.args[0], CIM_ERR_NOT_FOUND)
+        self.assert_equal(self.cimom.stats['errors'], 1)
+
+        request = Request('<CIM><MESSAGE>')
+        self.cimom.render_POST(request)
+        self.assert_equal(request.code, 400)
+
+class Pull(Server):
+    """Pulled enumerations return MaxObjectCount instances at a time."""
+
+    def runtest(self):
+        instances, end, context = self.call(
+            twisted_client.OpenEnumerateInstances(
+                None, 'CIM_Base', MaxObjectCount=Uint32(2)))
+        self.assert_equal(names(instances), ['system0', 'disk0'])
+        self.assert_equal(end, False)
+
+        instances = self.call(twisted_client.PullInstances(
+            None, ns, context, Uint32(2), 'CIM_Base'))
+        self.assert_equal(names(instances), ['disk1'])
+        self.assert_equal(self.cimom.contexts, {})
+
+        error = self.call(twisted_client.PullInstances(
+            None, ns, context, Uint32(2), 'CIM_Base'))
+        self.assert_equal(error.value.args[0],
+                          CIM_ERR_INVALID_ENUMERATION_CONTEXT)
+
+        # A MaxObjectCount of 0 returns no instances and keeps the
+        # enumeration open.
+        instances, end, context = self.call(
+            twisted_client.OpenEnumerateInstances(
+                None, 'CIM_Disk', MaxObjectCount=Uint32(1)))
+        instances, end, context = self.call(twisted_client.PullInstances(
+            None, ns, context, Uint32(0), 'CIM_Disk'))
+        self.assert_equal((instances, end), ([], False))
+        self.assert_equal(len(self.cimom.contexts[context][1]), 1)
+
+class Listen(Server):
+    """The CIMOM listens on the loopback interface by default."""
+
+    def runtest(self):
+        calls = []
+        reactor = local_cimom.reactor
+        local_cimom.reactor = FakeReactor(calls)
+        try:
+            self.cimom.listen()
+            self.cimom.listen(http_port=15988, interface='')
+        finally:
+            local_cimom.reactor = reactor
+
+        self.assert_equal(calls, [(5988, '127.0.0.1'), (15988, '')])
+
+class FakeReactor(object):
+    def __init__(self, calls):
+        self.calls = calls
+
+    def listenTCP(self, port, factory, interface=''):
+        self.calls.append((port, interface))
+
+#################################################################
+# Main function
+#################################################################
+
+tests = [
+    Instances,
+    Changes,
+    Associations,
+    Query,
+    Classes,
+    Server,
+    Pull,
+    Listen,
+    ]
+
+if __name__ == '__main__':
+    comfychair.main(tests)
@@ -4,15 +4,17 @@
 from comfychair import main, TestCase, NotRunError
 from pywbem import *
 
+from pywbem import mof_compiler
 from pywbem.mof_compiler import MOFCompiler, MOFWBEMConnection, MOFParseError
 
 from urllib import urlretrieve, urlopen
 from time import time
 
 import os
+import shutil
 import sys
 from zipfile import ZipFile
-from tempfile import TemporaryFile
+from tempfile import TemporaryFile, mkdtemp
 
 ns = 'root/test'
 
@@ -123,6 +125,266 @@ class TestRefs(MOFTest):
     def runtest(self):
         self.mofcomp.compile_file('testmofs/test_refs.mof', ns)
 
+class TestTables(TestCase):
+    """Parser tables are read from the first directory holding tables for
+    the current grammar, or built into the first writable directory other
+    than the package directory."""
+
+    def setup(self):
+        self.dir = mkdtemp()
+        self.table_dirs = mof_compiler._table_dirs
+        # Keep yacc from importing the tables in the package directory.
+        sys.modules['pywbem.mofparsetab'] = None
+
+    def teardown(self):
+        del sys.modules['pywbem.mofparsetab']
+        mof_compiler._table_dirs = self.table_dirs
+        shutil.rmtree(self.dir)
+
+    def runtest(self):
+        # A directory that can't be created stands in for a read-only
+        # package directory.
+        open(os.path.join(self.dir, 'file'), 'w').close()
+        readonly = os.path.join(self.dir, 'file', 'pywbem')
+        stale = os.path.join(self.dir, 'stale')
+        cache = os.path.join(self.dir, 'cache')
+
+        os.mkdir(stale)
+        f = open(os.path.join(stale, 'mofparsetab.py'), 'w')
+        f.write('_tabversion = %r\n_lr_signature = None\n' %
+                mof_compiler.yacc.__tabversion__)
+        f.close()
+
+        mof_compiler._table_dirs = lambda: [readonly, cache]
+        self.assert_equal(mof_compiler._read_tables(), None)
+        self.assert_equal(mof_compiler._writable_dir(), cache)
+
+        # A writable package directory isn't written to at run time.
+        mof_compiler._table_dirs = lambda: [stale, cache]
+        self.assert_equal(mof_compiler._writable_dir(), cache)
+
+        mof_compiler._build(cache)
+        mof_compiler._table_dirs = lambda: [readonly, stale, cache]
+        tables = mof_compiler._read_tables()
+        self.assert_equal(os.path.dirname(tables.__file__), cache)
+
+class TestSharedParser(TestCase):
+    """Compilers share the parser tables but not the parser state."""
+
+    def runtest(self):
+        first = MOFCompiler(MOFWBEMConnection())
+        second = MOFCompiler(MOFWBEMConnection())
+
+        self.assert_(first.parser is not second.parser)
+        self.assert_(first.parser.action is second.parser.action)
+        self.assert_(first.parser.handle is first.handle)
+        self.assert_(second.parser.handle is second.handle)
+
+        first.compile_string('Qualifier Key : boolean = false, '
+                             'Scope(property, reference), '
+                             'Flavor(DisableOverride);', ns)
+        self.assert_(ns in first.parser.qualcache)
+        self.assert_(ns not in second.parser.qualcache)
+
+CACHE_MOFS = {
+    'qualifiers.mof': """
+Qualifier Key : boolean = false, Scope(property, reference),
+    Flavor(DisableOverride);
+Qualifier Description : string = null, Scope(any), Flavor(Translatable);
+""",
+    'CIM_Base.mof': """
+[Description("Base")]
+class CIM_Base {
+    [Key] string Name;
+};
+""",
+    'CIM_Disk.mof': """
+class CIM_Disk : CIM_Base {
+    uint32 Size;
+};
+""",
+    'disks.mof': """
+#pragma include ("qualifiers.mof")
+instance of CIM_Disk as $disk {
+    Name = "disk0";
+    Size = 80;
+};
+""",
+    }
+
+class TestCache(TestCase):
+    """Unchanged files are loaded from the compiled MOF cache."""
+
+    def setup(self):
+        self.dir = mkdtemp()
+        self.cache_dir = os.path.join(self.dir, 'cache')
+        for name, mof in CACHE_MOFS.items():
+            self.write(name, mof)
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, mof):
+        f = open(os.path.join(self.dir, name), 'w')
+        f.write(mof)
+        f.close()
+
+    def compile(self):
+        mofcomp = MOFCompiler(MOFWBEMConnection(), search_paths=[self.dir],
+                              log_func=lambda msg: None,
+                              cache_dir=self.cache_dir)
+        mofcomp.compile_file(os.path.join(self.dir, 'disks.mof'), ns)
+        return mofcomp
+
+    def runtest(self):
+        parsed = self.compile()
+        self.assert_equal(len(os.listdir(self.cache_dir)), 4)
+
+        cached = self.compile()
+        for attr in ('qualifiers', 'classes', 'instances'):
+            self.assert_equal(getattr(cached.handle, attr),
+                              getattr(parsed.handle, attr))
+        self.assert_equal(cached.handle.class_names[ns],
+                          ['CIM_Base', 'CIM_Disk'])
+        self.assert_equal(cached.parser.aliases.keys(), ['$disk'])
+        self.assert_equal(
+            cached.handle.instances[ns][0].path['Name'], 'disk0')
+
+        def parse(*args, **kwargs):
+            raise AssertionError('cached file was parsed')
+
+        mofcomp = MOFCompiler(MOFWBEMConnection(), search_paths=[self.dir],
+                              cache_dir=self.cache_dir)
+        mofcomp.parser.parse = parse
+        mofcomp.compile_file(os.path.join(self.dir, 'disks.mof'), ns)
+
+        # A changed file is parsed again.
+        self.write('CIM_Disk.mof', CACHE_MOFS['CIM_Disk.mof'].replace(
+            'uint32 Size;', 'uint64 Size;'))
+        changed = self.compile()
+        self.assert_equal(len(os.listdir(self.cache_dir)), 6)
+        self.assert_equal(
+            changed.handle.classes[ns]['CIM_Disk'].properties['Size'].type,
+            'uint64')
+
+        # So are the files depending on a changed file, directly or not.
+        self.write('CIM_Base.mof', CACHE_MOFS['CIM_Base.mof'].replace(
+            'string Name;', 'string Name;\n    string Caption;'))
+        changed = self.compile()
+        self.assert_equal(len(os.listdir(self.cache_dir)), 9)
+        self.assert_(
+            'Caption' in changed.handle.classes[ns]['CIM_Disk'].properties)
+
+        self.write('qualifiers.mof', CACHE_MOFS['qualifiers.mof'] +
+                   'Qualifier Units : string = null, Scope(property);\n')
+        self.compile()
+        self.assert_equal(len(os.listdir(self.cache_dir)), 13)
+
+        # Cached or not, compiling returns the same.
+        results = []
+        for i in range(2):
+            mofcomp = MOFCompiler(MOFWBEMConnection(), search_paths=[self.dir],
+                                  log_func=lambda msg: None,
+                                  cache_dir=os.path.join(self.dir, 'again'))
+            results.append(mofcomp.compile_file(
+                os.path.join(self.dir, 'CIM_Base.mof'), ns))
+        self.assert_equal(results[0], results[1])
+
+class TestParallel(TestCache):
+    """Files parsed by a pool are applied as if compiled one by one."""
+
+    def setup(self):
+        TestCache.setup(self)
+        self.write('qualifiers.mof', CACHE_MOFS['qualifiers.mof'] + """
+Qualifier Association : boolean = false, Scope(association),
+    Flavor(DisableOverride);
+""")
+        self.write('CIM_DiskUse.mof', """
+[Association]
+class CIM_DiskUse {
+    [Key] CIM_Disk REF Disk;
+    [Key] CIM_Base REF User;
+};
+""")
+
+    def compiler(self):
+        return MOFCompiler(MOFWBEMConnection(), search_paths=[self.dir],
+                           log_func=lambda msg: None)
+
+    def runtest(self):
+        files = [os.path.join(self.dir, x)
+                 for x in ('CIM_DiskUse.mof', 'disks.mof', 'CIM_Disk.mof')]
+
+        # Compile them one by one, dependencies first.
+        serial = self.compiler()
+        for filename in files[2:] + files[:2]:
+            serial.compile_file(filename, ns)
+
+        parallel = self.compiler()
+        parallel.parser.parse = None
+        parallel.compile_files(files, ns, processes=2)
+
+        for attr in ('qualifiers', 'classes', 'instances'):
+            self.assert_equal(getattr(parallel.handle, attr),
+                              getattr(serial.handle, attr))
+        self.assert_equal(parallel.handle.class_names[ns],
+                          ['CIM_Base', 'CIM_Disk', 'CIM_DiskUse'])
+        self.assert_equal(parallel.parsed, {})
+
+        graph = parallel._dependency_graph(files[:1])
+        self.assert_equal(
+            sorted([os.path.basename(x) for x in graph[files[0]]]),
+            ['CIM_Base.mof', 'CIM_Disk.mof', 'qualifiers.mof'])
+
+        # Files that fail to parse in the pool are compiled as usual.
+        self.write('CIM_Base.mof', CACHE_MOFS['CIM_Base.mof'].replace(
+            'Name;', 'Name'))
+        try:
+            self.compiler().compile_files(files, ns, processes=2)
+        except MOFParseError, pe:
+            self.assert_equal(pe.file, os.path.join(self.dir, 'CIM_Base.mof'))
+        else:
+            self.fail('no parse error')
+
+class TestFastLexer(TestCase):
+    """The fast lexer produces the tokens of the PLY lexer."""
+
+    def tokens(self, lexer, mof):
+        lexer.parser = self
+        lexer.input(mof)
+        return [(t.type, t.value, t.lineno, t.lexpos) for t in iter(
+            lexer.token, None)]
+
+    def log(self, msg):
+        pass
+
+    def runtest(self):
+        mofs = CACHE_MOFS.values()
+        testmofs = os.path.join(cwd, 'testmofs')
+        for name in [os.path.join(cwd, 'test.mof')] + [
+                os.path.join(testmofs, x) for x in os.listdir(testmofs)]:
+            mofs.append(open(name).read())
+        mofs.append('instance of X { S = "a\\"b\\x41\\n\\\\"; '
+                    'N = -0x1F; M = 1.5e3; B = 101b; } ~ // done')
+
+        for mof in mofs:
+            self.mof = mof
+            fast = self.tokens(mof_compiler._shared_parser(True)[1], mof)
+            ply = self.tokens(mof_compiler._shared_parser(False)[1], mof)
+            self.assert_equal(fast, ply)
+
+        self.assert_equal(
+            mof_compiler._fixStringValue(r'"a\"b\x41\x263A\n\\"'),
+            u'a"bA\u263a\n\\')
+        self.assert_equal(mof_compiler._fixStringValue('"plain"'), 'plain')
+        self.assert_equal(mof_compiler._fixStringValue(r'"a\X41 zzzz"'),
+                          'aA zzzz')
+
+        # Identifiers are interned.
+        first, second = [t[1] for t in self.tokens(
+            mof_compiler._FastLexer(), 'Size Size')]
+        self.assert_(first is second)
+
 #################################################################
 # Main function
 #################################################################
@@ -134,6 +396,11 @@ tests = [
     TestSchemaSearch, 
     TestParseError, 
     TestFullSchema,
+    TestTables,
+    TestSharedParser,
+    TestCache,
+    TestParallel,
+    TestFastLexer,
     ]
 
 if __name__ == '__main__':
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+#
+# Test conversion of ElementTree elements to tupletrees.
+#
+
+import comfychair
+
+import xml.etree.ElementTree
+import xml.etree.cElementTree
+
+from pywbem.tupletree import ele_to_tupletree, xml_to_tupletree
+
+XML = """<INSTANCE CLASSNAME="CIM_Foo">text<!-- comment -->
+<PROPERTY NAME="Name" TYPE="string"><VALUE>foo</VALUE></PROPERTY>
+<?pi data?><PROPERTY.ARRAY NAME="Status" TYPE="uint16"><VALUE.ARRAY>
+<VALUE>2</VALUE><VALUE>3</VALUE></VALUE.ARRAY></PROPERTY.ARRAY>
+</INSTANCE>"""
+
+EXPECTED = (
+    'INSTANCE', {'CLASSNAME': 'CIM_Foo'},
+    ['text\n',
+     ('PROPERTY', {'NAME': 'Name', 'TYPE': 'string'},
+      [None, ('VALUE', {}, ['foo'], None)], None),
+     ('PROPERTY.ARRAY', {'NAME': 'Status', 'TYPE': 'uint16'},
+      [None, ('VALUE.ARRAY', {},
+              ['\n', ('VALUE', {}, ['2'], None),
+               ('VALUE', {}, ['3'], None)], None)], None)],
+    None)
+
+class FromString(comfychair.TestCase):
+    def runtest(self):
+        self.assert_equal(xml_to_tupletree(XML), EXPECTED)
+
+class FromElement(comfychair.TestCase):
+    """Elements from either ElementTree implementation convert alike, so
+    responses parsed by callers need not be serialized again."""
+
+    def runtest(self):
+        for module in (xml.etree.ElementTree, xml.etree.cElementTree):
+            element = module.fromstring(XML)
+            self.assert_equal(ele_to_tupletree(element), EXPECTED)
+
+            # Converting a subtree directly gives the same result as
+            # serializing and re-parsing it.
+
+            prop = element.find('PROPERTY.ARRAY')
+            self.assert_equal(ele_to_tupletree(prop),
+                              xml_to_tupletree(module.tostring(prop)))
+
+class Deep(comfychair.TestCase):
+    """Deeply nested documents don't hit the recursion limit."""
+
+    def runtest(self):
+        depth = 5000
+        tt = xml_to_tupletree('<A>' * depth + '</A>' * depth)
+
+        for i in range(depth - 1):
+            tt = tt[2][1]
+
+        self.assert_equal(tt, ('A', {}, [None], None))
+
+#################################################################
+# Main function
+#################################################################
+
+tests = [
+    FromString,
+    FromElement,
+    Deep,
+    ]
+
+if __name__ == '__main__':
+    comfychair.main(tests)
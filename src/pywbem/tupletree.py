@@ -46,25 +46,39 @@ The CONTENTS is a list of child elements.
 The fourth element is reserved.
 """
 
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
 def ele_to_tupletree(node):
-    """Convert a ElementTree to a Tuple"""
-    
-    name = node.tag
-    attrs = {}
-    contents = []
-    
-    contents.append(node.text)
-    
-    for child in node:
-        if str(type(child)) == "<type 'Element'>":
-            contents.append(ele_to_tupletree(child))
-            
-    attrs = node.attrib
-    return (name, attrs, contents, None)
-    
+    """Convert an ElementTree element to a tupletree.
+
+    Any ElementTree implementation may be used, so elements already
+    parsed by a caller can be converted without serializing them back
+    to a string.  Comments and processing instructions, whose tag is not
+    a string, are skipped.  The tree is walked with an explicit stack
+    rather than by recursion."""
+
+    contents = [node.text]
+    result = (node.tag, node.attrib, contents, None)
+
+    stack = [(node, contents)]
+    pop = stack.pop
+    push = stack.append
+
+    while stack:
+        parent, contents = pop()
+        for child in parent:
+            tag = child.tag
+            if isinstance(tag, basestring):
+                child_contents = [child.text]
+                contents.append((tag, child.attrib, child_contents, None))
+                push((child, child_contents))
+
+    return result
+
 def xml_to_tupletree(xml_string):
     """Parse XML straight into tupletree."""
 
-    import xml.etree.cElementTree as ElementTree
-    ele_xml = ElementTree.fromstring(xml_string)
-    return ele_to_tupletree(ele_xml)
+    return ele_to_tupletree(ElementTree.fromstring(xml_string))
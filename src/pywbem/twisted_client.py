@@ -25,6 +25,8 @@ twisted.protocols.http.HTTPClient base class.
 """
 
 from twisted.internet import reactor, protocol, defer
+from twisted.internet.error import TimeoutError
+from twisted.python import failure
 from twisted.web import http, client, error
 
 from pywbem import CIMClass, CIMClassName, CIMInstance, CIMInstanceName, CIMError, CIMDateTime, cim_types, cim_xml, cim_obj
@@ -36,7 +38,8 @@ except ImportError, arg:
     from xml.etree.ElementTree import fromstring, tostring
 
 import six
-import string, base64
+import string, base64, time
+import hashlib
 
 from types import StringTypes
 from datetime import datetime, timedelta
@@ -46,16 +49,35 @@ from utils import extend_results
 
 protocol.ClientFactory.noisy = False
 
+# Points in the life of a request at which WBEMClientFactory.mark() records
+# a timestamp, in the order they are expected to occur.
+
+TIMING_SPANS = ('connect_start', 'connected', 'request_sent', 'first_byte',
+                'last_byte', 'parse_done', 'callback_done')
+
+# Named phases measured between two consecutive spans.
+
+TIMING_PHASES = (('connect', 'connect_start', 'connected'),
+                 ('send', 'connected', 'request_sent'),
+                 ('wait', 'request_sent', 'first_byte'),
+                 ('transfer', 'first_byte', 'last_byte'),
+                 ('parse', 'last_byte', 'parse_done'),
+                 ('callback', 'parse_done', 'callback_done'))
+
 
 class WBEMClient(http.HTTPClient):
     """A HTTPClient subclass that handles WBEM requests."""
 
     status = None
 
+    # Ask the server to keep the connection open after the response.
+    persistent = False
+
     def connectionMade(self):
         """Send a HTTP POST command with the appropriate CIM over HTTP
         headers and payload."""
 
+        self.factory.mark('connected')
         self.factory.request_xml = str(self.factory.payload)
 
         self.sendCommand('POST', '/cimom')
@@ -76,6 +98,9 @@ class WBEMClient(http.HTTPClient):
         self.sendHeader('CIMMethod', str(self.factory.method))
         self.sendHeader('CIMObject', str(self.factory.object))
 
+        if self.persistent:
+            self.sendHeader('Connection', 'Keep-Alive')
+
         self.endHeaders()
 
         # TODO: Figure out why twisted doesn't support unicode.  An
@@ -83,17 +108,39 @@ class WBEMClient(http.HTTPClient):
         # can't be converted to the current codepage.
 
         self.transport.write(str(self.factory.payload))
+        self.factory.mark('request_sent')
+
+    def dataReceived(self, data):
+        """Record the arrival of the first response byte."""
+
+        self.factory.mark('first_byte')
+        http.HTTPClient.dataReceived(self, data)
+
+    def rawDataReceived(self, data):
+        """Cancel the factory's deferred_timeout, if it has one, once the
+        server starts sending the response body."""
+
+        timeout = getattr(self.factory, 'deferred_timeout', None)
+        if timeout is not None and timeout.active():
+            timeout.cancel()
+        http.HTTPClient.rawDataReceived(self, data)
 
     def handleResponse(self, data):
         """Called when all response data has been received."""
 
+        self.finishResponse(data)
+        self.transport.loseConnection()
+
+    def finishResponse(self, data):
+        """Pass the response to the factory and mark it as answered."""
+
+        self.factory.mark('last_byte')
         self.factory.response_xml = data
 
         if self.status == '200':
             self.factory.parseErrorAndResponse(data)
 
         self.factory.deferred = None
-        self.transport.loseConnection()
 
     def handleStatus(self, version, status, message):
         """Save the status code for processing when we get to the end
@@ -129,12 +176,164 @@ class WBEMClient(http.HTTPClient):
                 self.factory.deferred.errback(
                     CIMError(0, '%s: %s' % (cimerror, errordetail)))
 
+            self.factory.finishTiming('error')
+
+
+class KeepAliveWBEMClient(WBEMClient):
+    """A WBEMClient sending the requests of a RequestQueue one after
+    another over the same connection, for as long as the server keeps it
+    open."""
+
+    persistent = True
+    queue = None
+    version = None
+    keep_alive = False
+    responses = 0
+
+    def connectionMade(self):
+        self.sendNext()
+
+    def sendNext(self):
+        factory = self.queue.next(self.responses > 0)
+        if factory is None:
+            self.transport.loseConnection()
+            return
+
+        self.factory = factory
+        self.firstLine = True
+        self.length = None
+        self._header = ''
+        self.status = None
+        self.version = None
+        self.keep_alive = False
+
+        self.queue.startTimeout(factory, self.transport)
+        WBEMClient.connectionMade(self)
+
+    def handleStatus(self, version, status, message):
+        WBEMClient.handleStatus(self, version, status, message)
+        self.version = version
+        self.keep_alive = version == 'HTTP/1.1'
+
+    def handleHeader(self, key, value):
+        WBEMClient.handleHeader(self, key, value)
+        if key.lower() == 'connection':
+            self.keep_alive = value.lower() == 'keep-alive'
+
+    def handleResponse(self, data):
+        # The body of a response without a Content-Length ends when the
+        # server closes the connection.
+
+        reusable = self.keep_alive and self.length == 0
+
+        self.queue.answered(self.factory)
+        self.finishResponse(data)
+        self.responses += 1
+
+        if reusable:
+            self.sendNext()
+        else:
+            self.transport.loseConnection()
+
+class RequestQueue(protocol.ClientFactory):
+    """Sends the requests of several WBEMClientFactory objects one after
+    another, reusing the connection while the server keeps it alive.
+
+    Each request fails with TimeoutError if it isn't answered within
+    timeout seconds of being sent.  When the connection is closed the
+    request in flight fails, and the remaining requests are sent over a
+    new connection.  A request sent over a reused connection that the
+    server closed before answering is sent again.
+    """
+
+    def __init__(self, factories, timeout=None):
+        self.pending = list(factories)
+        self.timeout = timeout
+        self.current = None
+        self.reused = False
+        self.client = None
+
+    def buildProtocol(self, addr):
+        self.client = KeepAliveWBEMClient()
+        self.client.queue = self
+        return self.client
+
+    def next(self, reused):
+        """Return the next request to send, or None."""
+
+        if self.pending:
+            self.current = self.pending.pop(0)
+        else:
+            self.current = None
+        self.reused = reused
+        return self.current
+
+    def startTimeout(self, factory, transport):
+        if self.timeout is None:
+            return
+
+        def fire_timeout():
+            factory.finishTiming('timeout')
+            if self.current is factory:
+                self.current = None
+                transport.loseConnection()
+            if factory.deferred is not None and not factory.deferred.called:
+                factory.deferred.errback(failure.Failure(TimeoutError()))
+
+        factory.deferred_timeout = reactor.callLater(self.timeout,
+                                                     fire_timeout)
+
+    def answered(self, factory):
+        timeout = getattr(factory, 'deferred_timeout', None)
+        if timeout is not None and timeout.active():
+            timeout.cancel()
+        self.current = None
+
+    def stop(self):
+        """Cancel every request not answered yet and close the
+        connection."""
+
+        pending, self.pending = self.pending, []
+        current, self.current = self.current, None
+
+        if current is not None:
+            self.answered(current)
+            pending.insert(0, current)
+            self.client.transport.loseConnection()
+
+        for factory in pending:
+            if factory.deferred is not None:
+                factory.deferred.cancel()
+
+    def startedConnecting(self, connector):
+        if self.pending:
+            self.pending[0].startedConnecting(connector)
+
+    def clientConnectionFailed(self, connector, reason):
+        pending, self.pending = self.pending, []
+        for factory in pending:
+            factory.clientConnectionFailed(connector, reason)
+
+    def clientConnectionLost(self, connector, reason):
+        current, self.current = self.current, None
+
+        if current is not None:
+            self.answered(current)
+            if self.reused and 'first_byte' not in current.timings and \
+               not current.deferred.called:
+                self.pending.insert(0, current)
+            else:
+                current.clientConnectionLost(connector, reason)
+
+        if self.pending:
+            connector.connect()
 
 class WBEMClientFactory(protocol.ClientFactory):
     """Create instances of the WBEMClient class."""
 
     request_xml = None
     response_xml = None
+    timing_record = None
     xml_header = '<?xml version="1.0" encoding="utf-8" ?>'
 
     def __init__(self, creds, operation, method, object, payload):
@@ -145,14 +344,68 @@ class WBEMClientFactory(protocol.ClientFactory):
         self.payload = payload
         self.protocol = lambda: WBEMClient()
         self.deferred = defer.Deferred()
+        self.timings = {}
+        self.timing_observers = []
+
+    def startedConnecting(self, connector):
+        self.mark('connect_start')
 
     def clientConnectionFailed(self, connector, reason):
         if self.deferred is not None:
             reactor.callLater(0, self.deferred.errback, reason)
+            self.finishTiming('error')
 
     def clientConnectionLost(self, connector, reason):
         if self.deferred is not None:
             reactor.callLater(0, self.deferred.errback, reason)
+            self.finishTiming('error')
+
+    def mark(self, span):
+        """Record the time a request span was reached.  Only the first
+        occurrence of each span is kept."""
+
+        if span not in self.timings:
+            self.timings[span] = time.time()
+
+    def durations(self):
+        """Return a dictionary of seconds spent in each completed phase
+        of the request, plus the total since the connection started."""
+
+        result = {}
+
+        for phase, start, end in TIMING_PHASES:
+            if start in self.timings and end in self.timings:
+                result[phase] = self.timings[end] - self.timings[start]
+
+        if self.timings:
+            result['total'] = max(self.timings.values()) - \
+                              min(self.timings.values())
+
+        return result
+
+    def lastSpan(self):
+        """Return the name of the last span reached, or None."""
+
+        reached = [x for x in TIMING_SPANS if x in self.timings]
+        return reached[-1] if reached else None
+
+    def finishTiming(self, outcome):
+        """Pass a timing record for this request to every callable in
+        timing_observers.  Only the first call has any effect."""
+
+        if self.timing_record is not None:
+            return
+
+        self.timing_record = {
+            'method': self.method,
+            'classname': getattr(self, 'classname', None),
+            'outcome': outcome,
+            'last_span': self.lastSpan(),
+            'durations': self.durations(),
+            }
+
+        for observer in self.timing_observers:
+            observer(self, self.timing_record)
 
     def imethodcallPayload(self, methodname, localnsp, **kwargs):
         """Generate the XML payload for an intrinsic methodcall."""
@@ -255,7 +508,7 @@ class WBEMClientFactory(protocol.ClientFactory):
         error = xml.find('.//ERROR')
 
         if error is None:
-            self.deferred.callback(self.parseResponse(xml))
+            self.deliverResponse(xml)
             return
 
         try:
@@ -264,6 +517,18 @@ class WBEMClientFactory(protocol.ClientFactory):
             code = 0
 
         self.deferred.errback(CIMError(code, error.attrib['DESCRIPTION']))
+        self.finishTiming('error')
+
+    def deliverResponse(self, xml):
+        """Convert a successful response and fire the deferred with
+        the result, recording the parse and callback spans."""
+
+        result = self.parseResponse(xml)
+        self.mark('parse_done')
+
+        self.deferred.callback(result)
+        self.mark('callback_done')
+        self.finishTiming('success')
 
     def parseResponse(self, xml):
         """Parse returned XML and convert into appropriate Python
@@ -277,10 +542,12 @@ class WBEMClientFactory(protocol.ClientFactory):
 import pywbem.tupletree
 
 class ExecQuery(WBEMClientFactory):
-    def __init__(self, creds, QueryLanguage, Query, namespace = 'root/cimv2'):
+    def __init__(self, creds, QueryLanguage, Query, namespace = 'root/cimv2',
+                 Where = None):
         self.QueryLanguage = QueryLanguage
         self.Query = Query
         self.namespace = namespace
+        self.where = Where
 
         payload = self.imethodcallPayload(
             'ExecQuery',
@@ -301,12 +568,64 @@ class ExecQuery(WBEMClientFactory):
                (self.__class__, self.namespace, self.Query, id(self))
 
     def parseResponse(self, xml):
-        tt = [pywbem.tupletree.xml_to_tupletree(tostring(x))
-              for x in xml.findall('.//INSTANCE')]
+        instances = xml.findall('.//INSTANCE')
+
+        if self.where is not None:
+            instances = [x for x in instances if self.where.match_element(x)]
+
+        tt = [pywbem.tupletree.ele_to_tupletree(x)
+              for x in instances]
 
         return [pywbem.tupleparse.parse_instance(x) for x in tt]
 
 
+class InstanceFingerprints(object):
+    """Digests of the raw XML of instances received by pulled
+    enumerations, keyed by a digest of each instance's INSTANCEPATH.
+
+    A collection cycle calls begin(), passes the object to
+    OpenEnumerateInstances and PullInstances as the Fingerprints keyword
+    argument, and then calls commit() if every response arrived or abort()
+    if not.  Instances whose XML is identical to the last committed cycle
+    are skipped without being parsed, unless begin() was called with
+    full=True."""
+
+    def __init__(self):
+        self.digests = {}
+        self.pending = None
+        self.full = True
+        self.skipped = 0
+
+    def begin(self, full=False):
+        self.pending = {}
+        self.full = full or not self.digests
+        self.skipped = 0
+
+    def changed(self, path_xml, instance_xml):
+        """Record the digest of an instance and return True if it
+        differs from the last committed cycle."""
+
+        key = hashlib.md5(path_xml).digest()
+        digest = hashlib.md5(instance_xml).digest()
+
+        if self.pending is not None:
+            self.pending[key] = digest
+
+        if self.full or self.digests.get(key) != digest:
+            return True
+
+        self.skipped += 1
+        return False
+
+    def commit(self):
+        if self.pending is not None:
+            self.digests = self.pending
+        self.pending = None
+
+    def abort(self):
+        self.pending = None
+
+
 class OpenEnumerateInstances(WBEMClientFactory):
     """Factory to produce EnumerateInstances WBEM clients."""
 
@@ -316,6 +635,8 @@ class OpenEnumerateInstances(WBEMClientFactory):
         self.context = None
         self.property_filter = (None, None)
         self.result_component_key = None
+        self.fingerprints = kwargs.pop('Fingerprints', None)
+        self.where = kwargs.pop('Where', None)
 
         if not kwargs.get('MaxObjectCount'):
             kwargs['MaxObjectCount'] = DEFAULT_ITER_MAXOBJECTCOUNT
@@ -352,13 +673,23 @@ class OpenEnumerateInstances(WBEMClientFactory):
         results_for_monitoring = {}
 
         for paramvalue in xml.findall('.//PARAMVALUE'):
-            str_paramvalue = tostring(paramvalue)
-            tuple_paramvalue = pywbem.tupletree.xml_to_tupletree(str_paramvalue)
+            tuple_paramvalue = pywbem.tupletree.ele_to_tupletree(paramvalue)
             part_results.update(pywbem.tupleparse.parse_iter_paramvalue(tuple_paramvalue))
 
         for x in xml.findall('.//VALUE.INSTANCEWITHPATH'):
-            s = tostring(x)
-            tt = pywbem.tupletree.xml_to_tupletree(s)
+            if self.where is not None:
+                instance = x.find('INSTANCE')
+                if instance is not None and \
+                   not self.where.match_element(instance):
+                    continue
+
+            if self.fingerprints is not None:
+                path = x.find('INSTANCEPATH')
+                if path is not None and \
+                   not self.fingerprints.changed(tostring(path), tostring(x)):
+                    continue
+
+            tt = pywbem.tupletree.ele_to_tupletree(x)
             part_res = pywbem.tupleparse.parse_value_instancewithpath(tt)
             result_element = part_res['VALUE.INSTANCEWITHPATH']
 
@@ -440,6 +771,8 @@ class PullInstances(OpenEnumerateInstances):
 
         self.property_filter = (None, None)
         self.result_component_key = None
+        self.fingerprints = kwargs.get('Fingerprints')
+        self.where = kwargs.get('Where')
 
         if all(kwargs.get('PropertyFilter', self.property_filter)):
             self.property_filter = kwargs['PropertyFilter']
@@ -493,8 +826,7 @@ class EnumerateInstances(WBEMClientFactory):
     def parseResponse(xml):
         res = []
         for x in xml.findall('.//VALUE.NAMEDINSTANCE'):
-            s = tostring(x)
-            tt = pywbem.tupletree.xml_to_tupletree(s)
+            tt = pywbem.tupletree.ele_to_tupletree(x)
             r = pywbem.tupleparse.parse_value_namedinstance(tt)
             res.append(r)
         return res
@@ -527,7 +859,7 @@ class EnumerateInstanceNames(WBEMClientFactory):
 
     def parseResponse(self, xml):
 
-        tt = [pywbem.tupletree.xml_to_tupletree(tostring(x))
+        tt = [pywbem.tupletree.ele_to_tupletree(x)
               for x in xml.findall('.//INSTANCENAME')]
 
         names = [pywbem.tupleparse.parse_instancename(x) for x in tt]
@@ -564,8 +896,8 @@ class GetInstance(WBEMClientFactory):
 
     def parseResponse(self, xml):
 
-        tt = pywbem.tupletree.xml_to_tupletree(
-            tostring(xml.find('.//INSTANCE')))
+        tt = pywbem.tupletree.ele_to_tupletree(
+            xml.find('.//INSTANCE'))
 
         return pywbem.tupleparse.parse_instance(tt)
 
@@ -602,6 +934,9 @@ class CreateInstance(WBEMClientFactory):
 
     def __init__(self, creds, instance, namespace = 'root/cimv2', **kwargs):
 
+        self.instance = instance
+        self.namespace = namespace
+
         payload = self.imethodcallPayload(
             'CreateInstance',
             namespace,
@@ -618,8 +953,8 @@ class CreateInstance(WBEMClientFactory):
 
     def parseResponse(self, xml):
 
-        tt = pywbem.tupletree.xml_to_tupletree(
-            tostring(xml.find('.//INSTANCENAME')))
+        tt = pywbem.tupletree.ele_to_tupletree(
+            xml.find('.//INSTANCENAME'))
 
         return pywbem.tupleparse.parse_instancename(tt)
 
@@ -631,7 +966,11 @@ class ModifyInstance(WBEMClientFactory):
     def __init__(self, creds, instancename, instance, namespace = 'root/cimv2',
                  **kwargs):
 
-        wrapped_instance = CIMNamedInstance(instancename, instance)
+        # An instance with a path is sent as a VALUE.NAMEDINSTANCE.
+
+        wrapped_instance = instance.copy()
+        wrapped_instance.path = instancename.copy()
+        wrapped_instance.path.namespace = None
 
         payload = self.imethodcallPayload(
             'ModifyInstance',
@@ -673,7 +1012,7 @@ class EnumerateClassNames(WBEMClientFactory):
 
     def parseResponse(self, xml):
 
-        tt = [pywbem.tupletree.xml_to_tupletree(tostring(x))
+        tt = [pywbem.tupletree.ele_to_tupletree(x)
               for x in xml.findall('.//CLASSNAME')]
 
         return [pywbem.tupleparse.parse_classname(x) for x in tt]
@@ -705,7 +1044,7 @@ class EnumerateClasses(WBEMClientFactory):
 
     def parseResponse(self, xml):
 
-        tt = [pywbem.tupletree.xml_to_tupletree(tostring(x))
+        tt = [pywbem.tupletree.ele_to_tupletree(x)
               for x in xml.findall('.//CLASS')]
 
         return [pywbem.tupleparse.parse_class(x) for x in tt]
@@ -738,8 +1077,8 @@ class GetClass(WBEMClientFactory):
 
     def parseResponse(self, xml):
 
-        tt = pywbem.tupletree.xml_to_tupletree(
-            tostring(xml.find('.//CLASS')))
+        tt = pywbem.tupletree.ele_to_tupletree(
+            xml.find('.//CLASS'))
 
         return pywbem.tupleparse.parse_class(tt)
 
@@ -797,14 +1136,14 @@ class AssociatorNames(WBEMClientFactory):
 
         if len(xml.findall('.//INSTANCENAME')) > 0:
 
-            tt = [pywbem.tupletree.xml_to_tupletree(tostring(x))
+            tt = [pywbem.tupletree.ele_to_tupletree(x)
                   for x in xml.findall('.//INSTANCENAME')]
 
             return [pywbem.tupleparse.parse_instancename(x) for x in tt]
 
         else:
 
-            tt = [pywbem.tupletree.xml_to_tupletree(tostring(x))
+            tt = [pywbem.tupletree.ele_to_tupletree(x)
                   for x in xml.findall('.//OBJECTPATH')]
 
             return [pywbem.tupleparse.parse_objectpath(x)[2] for x in tt]
@@ -861,14 +1200,14 @@ class ReferenceNames(WBEMClientFactory):
 
         if len(xml.findall('.//INSTANCENAME')) > 0:
 
-            tt = [pywbem.tupletree.xml_to_tupletree(tostring(x))
+            tt = [pywbem.tupletree.ele_to_tupletree(x)
                   for x in xml.findall('.//INSTANCENAME')]
 
             return [pywbem.tupleparse.parse_instancename(x) for x in tt]
 
         else:
 
-            tt = [pywbem.tupletree.xml_to_tupletree(tostring(x))
+            tt = [pywbem.tupletree.ele_to_tupletree(x)
                   for x in xml.findall('.//OBJECTPATH')]
 
             return [pywbem.tupleparse.parse_objectpath(x)[2] for x in tt]
@@ -910,8 +1249,8 @@ class InvokeMethod(WBEMClientFactory):
 
         # Return value of method
 
-        result_xml = pywbem.tupletree.xml_to_tupletree(
-            tostring(xml.find('.//RETURNVALUE')))
+        result_xml = pywbem.tupletree.ele_to_tupletree(
+            xml.find('.//RETURNVALUE'))
 
         result_tt = pywbem.tupleparse.parse_any(result_xml)
 
@@ -920,7 +1259,7 @@ class InvokeMethod(WBEMClientFactory):
 
         # Output parameters
 
-        params_xml = [pywbem.tupletree.xml_to_tupletree(tostring(x))
+        params_xml = [pywbem.tupletree.ele_to_tupletree(x)
                       for x in xml.findall('.//PARAMVALUE')]
 
         params_tt = [pywbem.tupleparse.parse_any(x) for x in params_xml]